@@ -21,6 +21,29 @@ const BrainIcon = () => (
     </svg>
 );
 
+// --- Raw frame ingestion ---
+// Header 16 byte little-endian: "AIPX" | version u8 | dtype code u8 | channels u16 | rows u32 | cols u32
+const RAW_FRAME_DTYPE_CODES: Record<string, number> = {
+    Uint8Array: 1,
+    Uint16Array: 2,
+    Int16Array: 3,
+    Float32Array: 4,
+};
+
+const packRawFrame = (pixelData: ArrayBufferView, rows: number, columns: number, channels = 1): Blob | null => {
+    const dtypeCode = RAW_FRAME_DTYPE_CODES[pixelData.constructor.name];
+    if (!dtypeCode) return null;
+    const header = new ArrayBuffer(16);
+    const view = new DataView(header);
+    [0x41, 0x49, 0x50, 0x58].forEach((byte, i) => view.setUint8(i, byte));
+    view.setUint8(4, 1);
+    view.setUint8(5, dtypeCode);
+    view.setUint16(6, channels, true);
+    view.setUint32(8, rows, true);
+    view.setUint32(12, columns, true);
+    return new Blob([header, pixelData], { type: 'application/x-raw-frame' });
+};
+
 const PanelAIDiagnosis: React.FC<{ servicesManager: any }> = ({ servicesManager }) => {
     const { displaySetService } = servicesManager.services;
     const [models, setModels] = useState<any[]>([]);
@@ -110,14 +133,28 @@ const PanelAIDiagnosis: React.FC<{ servicesManager: any }> = ({ servicesManager
             const canvas = document.querySelector('canvas.cornerstone-canvas') as HTMLCanvasElement | null;
             if (!canvas) throw new Error('Viewport canvas element not found.');
 
-            const imageData = canvas.toDataURL('image/png');
-            const body = { imageData, studyInstanceUID: StudyInstanceUID, modelId: selectedModelId };
-
-            const res = await fetch('http://localhost:8000/api/ai/predict-frame/', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(body),
-            });
+            // Ưu tiên gửi pixel gốc (đúng bit-depth) dạng nhị phân; fallback về PNG của canvas
+            const image = canvas.parentElement ? getEnabledElement(canvas.parentElement)?.image : null;
+            const pixelData = image?.getPixelData?.();
+            const rawFrame = pixelData && image.color === false ? packRawFrame(pixelData, image.rows, image.columns) : null;
+
+            let res: Response;
+            if (rawFrame) {
+                const params = new URLSearchParams({ studyInstanceUID: StudyInstanceUID, modelId: selectedModelId });
+                res = await fetch(`http://localhost:8000/api/ai/predict-frame/?${params}`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/x-raw-frame' },
+                    body: rawFrame,
+                });
+            } else {
+                const imageData = canvas.toDataURL('image/png');
+                const body = { imageData, studyInstanceUID: StudyInstanceUID, modelId: selectedModelId };
+                res = await fetch('http://localhost:8000/api/ai/predict-frame/', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify(body),
+                });
+            }
 
             if (!res.ok) {
                 let errText = `Server responded with ${res.status}`;
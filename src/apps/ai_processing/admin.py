@@ -3,7 +3,8 @@ from .models import AIModel, AIReport, ReviewSession
 
 @admin.register(AIModel)
 class AIModelAdmin(admin.ModelAdmin):
-    list_display = ('model_name', 'model_version', 'created_at')
+    list_display = ('model_name', 'model_version', 'backend', 'variant', 'is_active', 'created_at')
+    list_filter = ('backend', 'variant', 'is_active')
     search_fields = ('model_name', 'description')
 
 @admin.register(AIReport)
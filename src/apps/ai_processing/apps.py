@@ -2,4 +2,7 @@ from django.apps import AppConfig
 
 class AiProcessingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'apps.ai_processing' 
\ No newline at end of file
+    name = 'apps.ai_processing'
+
+    def ready(self):
+        from . import signals  # noqa: F401
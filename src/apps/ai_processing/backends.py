@@ -0,0 +1,200 @@
+import os
+import threading
+
+import numpy as np
+
+BACKENDS = ("keras", "onnx", "tflite")
+EXPORT_SUFFIXES = {"onnx": ".onnx", "tflite": ".tflite"}
+HEAD_SUFFIX = ".head.npz"
+
+
+def export_root(weights_path):
+    """Đường dẫn gốc (bỏ đuôi) của các file export nằm cạnh file trọng số Keras."""
+    root = os.path.splitext(weights_path)[0]
+    # "model.weights.h5" -> "model"
+    return root[: -len(".weights")] if root.endswith(".weights") else root
+
+
+def exported_path(weights_path, backend):
+    """File model dùng cho `backend`: chính file trọng số với keras, file .onnx/.tflite đã export với backend khác."""
+    if backend == "keras":
+        return weights_path
+    if backend not in EXPORT_SUFFIXES:
+        raise ValueError(f"Backend không hợp lệ: {backend}. Hỗ trợ: {', '.join(BACKENDS)}")
+    return export_root(weights_path) + EXPORT_SUFFIXES[backend]
+
+
+def head_path(model_path):
+    """File .npz chứa trọng số hai lớp Dense sau conv5, dùng để tính gradient Grad-CAM ngoài TensorFlow."""
+    for suffix in EXPORT_SUFFIXES.values():
+        if model_path.endswith(suffix):
+            return model_path[: -len(suffix)] + HEAD_SUFFIX
+    return export_root(model_path) + HEAD_SUFFIX
+
+
+def backend_for_path(model_path):
+    for backend, suffix in EXPORT_SUFFIXES.items():
+        if model_path.endswith(suffix):
+            return backend
+    return "keras"
+
+
+def _split_outputs(outputs):
+    """Tách (conv5, probabilities) theo số chiều: converter không đảm bảo giữ thứ tự output."""
+    conv = next(o for o in outputs if np.ndim(o) == 4)
+    probs = next(o for o in outputs if np.ndim(o) == 2)
+    return np.asarray(conv, dtype=np.float32), np.asarray(probs, dtype=np.float32)
+
+
+class CamHead:
+    """
+    Gradient của xác suất lớp dự đoán theo activations conv5, tính bằng numpy từ trọng số của phần đầu
+    GlobalAveragePooling -> Dense(512, relu) -> Dropout (bỏ qua khi suy luận) -> Dense(softmax).
+    Cho kết quả như tf.GradientTape trong make_explainer mà backend export không cần hỗ trợ đạo hàm.
+    """
+
+    def __init__(self, w1, b1, w2, b2):
+        self.w1, self.b1 = np.asarray(w1, dtype=np.float64), np.asarray(b1, dtype=np.float64)
+        self.w2, self.b2 = np.asarray(w2, dtype=np.float64), np.asarray(b2, dtype=np.float64)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["w1"], data["b1"], data["w2"], data["b2"])
+
+    def save(self, path):
+        # Lưu float32 như trọng số gốc; phép tính gradient vẫn làm ở float64
+        np.savez(path, **{name: getattr(self, name).astype(np.float32) for name in ("w1", "b1", "w2", "b2")})
+
+    @property
+    def nbytes(self):
+        return self.w1.nbytes + self.b1.nbytes + self.w2.nbytes + self.b2.nbytes
+
+    def gradients(self, conv, probs, class_index=None):
+        """d p[c] / d conv với c = `class_index` (int hoặc (N,)), mặc định argmax(probs); conv (N, h, w, C), probs (N, K)."""
+        n, h, w, _ = conv.shape
+        pooled = conv.mean(axis=(1, 2), dtype=np.float64)
+        hidden = pooled @ self.w1 + self.b1
+        probs = probs.astype(np.float64)
+        if class_index is None:
+            class_index = np.argmax(probs, axis=-1)
+        else:
+            class_index = np.broadcast_to(np.asarray(class_index, dtype=np.int64), (n,))
+        p_c = probs[np.arange(n), class_index]
+        # Đạo hàm softmax: d p_c / d z_k = p_c * (1[k == c] - p_k)
+        d_logits = -p_c[:, None] * probs
+        d_logits[np.arange(n), class_index] += p_c
+        d_hidden = (d_logits @ self.w2.T) * (hidden > 0)
+        d_pooled = (d_hidden @ self.w1.T) / (h * w)
+        return np.broadcast_to(d_pooled[:, None, None, :].astype(np.float32), conv.shape)
+
+
+class KerasBackend:
+    """Đường TensorFlow gốc: predict_on_batch cho xác suất, `explain_batch` (tf.function) cho Grad-CAM."""
+
+    name = "keras"
+
+    def __init__(self, model, explain_batch, nbytes=0):
+        self.model = model
+        self._explain_batch = explain_batch
+        self.nbytes = nbytes
+
+    def predict(self, img_batch):
+        return np.asarray(self.model.predict_on_batch(img_batch))
+
+    def explain(self, img_batch, class_index=None):
+        return self._explain_batch(img_batch, class_index)
+
+
+class _ExportedBackend:
+    """Backend chạy model đã export với output [conv5_block3_out, probabilities]; gradient lấy từ CamHead."""
+
+    name = None
+
+    def __init__(self, model_path, head):
+        self.model_path = model_path
+        self.head = head
+        self.nbytes = os.path.getsize(model_path) + head.nbytes
+
+    def _run(self, img_batch):
+        raise NotImplementedError
+
+    def predict(self, img_batch):
+        return self._run(img_batch)[1]
+
+    def explain(self, img_batch, class_index=None):
+        conv, probs = self._run(img_batch)
+        grads = self.head.gradients(conv, probs, class_index)
+        return list(zip(probs, conv, grads))
+
+
+class OnnxBackend(_ExportedBackend):
+    name = "onnx"
+
+    def __init__(self, model_path, head, threads=0):
+        super().__init__(model_path, head)
+        try:
+            import onnxruntime as ort
+        except ImportError as exc:
+            raise RuntimeError("Backend onnx cần cài onnxruntime.") from exc
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self._session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self._input = self._session.get_inputs()[0].name
+
+    def _run(self, img_batch):
+        # InferenceSession.run an toàn khi gọi từ nhiều thread
+        return _split_outputs(self._session.run(None, {self._input: np.asarray(img_batch, dtype=np.float32)}))
+
+
+class TFLiteBackend(_ExportedBackend):
+    name = "tflite"
+
+    def __init__(self, model_path, head, threads=0, content=None):
+        super().__init__(model_path, head)
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            try:
+                # tensorflow.lite là module nạp lười: `from tensorflow.lite import Interpreter` không import được
+                import tensorflow as tf
+                Interpreter = tf.lite.Interpreter
+            except ImportError as exc:
+                raise RuntimeError("Backend tflite cần cài tflite-runtime hoặc tensorflow.") from exc
+
+        if content is not None:
+            # Flatbuffer được dùng tại chỗ: buffer nạp sẵn trong process master được chia sẻ copy-on-write sau fork
+            self._interpreter = Interpreter(model_content=content, num_threads=threads or None)
+        else:
+            self._interpreter = Interpreter(model_path=model_path, num_threads=threads or None)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]["index"]
+        self._outputs = [detail["index"] for detail in self._interpreter.get_output_details()]
+        self._batch_size = int(self._interpreter.get_input_details()[0]["shape"][0])
+        # Interpreter giữ tensor trung gian bên trong nên không dùng chung giữa các thread
+        self._lock = threading.Lock()
+
+    def _run(self, img_batch):
+        img_batch = np.asarray(img_batch, dtype=np.float32)
+        with self._lock:
+            if len(img_batch) != self._batch_size:
+                self._interpreter.resize_tensor_input(self._input, list(img_batch.shape))
+                self._interpreter.allocate_tensors()
+                self._batch_size = len(img_batch)
+            self._interpreter.set_tensor(self._input, img_batch)
+            self._interpreter.invoke()
+            return _split_outputs([self._interpreter.get_tensor(index).copy() for index in self._outputs])
+
+
+def load_exported(model_path, threads=0, content=None):
+    """Nạp model .onnx/.tflite cùng CamHead đi kèm; `content` là nội dung file .tflite đã đọc sẵn (nếu có)."""
+    head = CamHead.load(head_path(model_path))
+    backend = backend_for_path(model_path)
+    if backend == "onnx":
+        return OnnxBackend(model_path, head, threads)
+    if backend == "tflite":
+        return TFLiteBackend(model_path, head, threads, content)
+    raise ValueError(f"{model_path} không phải model đã export (.onnx/.tflite).")
@@ -0,0 +1,128 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingRequest:
+    __slots__ = ("inputs", "runner", "future")
+
+    def __init__(self, inputs, runner):
+        self.inputs = inputs
+        self.runner = runner
+        self.future = Future()
+
+
+class BatchingInferenceEngine:
+    """
+    Gom các request dự đoán đồng thời thành một batch cho mỗi model.
+
+    Mỗi model có một hàng đợi và một worker thread riêng. Worker lấy request đầu tiên,
+    chờ thêm tối đa `max_wait_ms` hoặc đến khi đủ `max_batch_size` ảnh, rồi chạy một
+    lần forward pass duy nhất và trả kết quả từng dòng về cho từng caller.
+    Chỉ các request có cùng `runner` được ghép với nhau; request không vừa batch hiện tại (quá số ảnh còn lại
+    hoặc khác runner, ví dụ model vừa được nạp lại) được giữ nguyên thứ tự cho batch sau.
+    """
+
+    def __init__(self, max_batch_size=8, max_wait_ms=10.0):
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def submit(self, model_key, inputs, runner):
+        """
+        Đưa `inputs` (batch shape (n, ...)) vào hàng đợi của model.
+        `runner(batch)` nhận batch đã ghép và trả về một sequence kết quả theo từng dòng.
+        """
+        request = _PendingRequest(inputs, runner)
+        self._get_queue(model_key).put(request)
+        return request.future
+
+    def infer(self, model_key, inputs, runner, timeout=None):
+        """Phiên bản blocking của `submit`, trả về list kết quả ứng với các dòng của `inputs`."""
+        return self.submit(model_key, inputs, runner).result(timeout=timeout)
+
+    def _get_queue(self, model_key):
+        with self._lock:
+            q = self._queues.get(model_key)
+            if q is None:
+                q = queue.Queue()
+                self._queues[model_key] = q
+                worker = threading.Thread(
+                    target=self._worker_loop,
+                    args=(model_key, q),
+                    name=f"ai-batcher-{model_key}",
+                    daemon=True,
+                )
+                worker.start()
+            return q
+
+    def _collect(self, q, deferred):
+        """Batch tiếp theo: request đầu tiên (ưu tiên `deferred`) cùng các request cùng runner còn vừa batch."""
+        first = deferred.popleft() if deferred else q.get()
+        batch = [first]
+        size = len(first.inputs)
+        skipped = []
+        # Request bị hoãn từ vòng trước đã chờ đủ lâu nên được xét ngay, không đợi max_wait
+        while deferred and size < self.max_batch_size:
+            request = deferred.popleft()
+            if self._fits(request, first, size):
+                batch.append(request)
+                size += len(request.inputs)
+            else:
+                skipped.append(request)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = q.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if self._fits(request, first, size):
+                batch.append(request)
+                size += len(request.inputs)
+            else:
+                skipped.append(request)
+        deferred.extendleft(reversed(skipped))
+        return batch
+
+    def _fits(self, request, first, size):
+        # So sánh bằng ==: bound method `backend.explain` là object mới mỗi lần truy cập nhưng bằng nhau
+        # khi cùng backend
+        return request.runner == first.runner and size + len(request.inputs) <= self.max_batch_size
+
+    def _run(self, runner, inputs):
+        """Forward pass theo từng đoạn tối đa `max_batch_size` ảnh (chỉ tách khi một request lớn hơn một batch)."""
+        outputs = []
+        for start in range(0, len(inputs), self.max_batch_size):
+            outputs.extend(runner(inputs[start:start + self.max_batch_size]))
+        return outputs
+
+    def _worker_loop(self, model_key, q):
+        deferred = deque()
+        while True:
+            batch = self._collect(q, deferred)
+            try:
+                inputs = np.concatenate([r.inputs for r in batch], axis=0)
+                outputs = self._run(batch[0].runner, inputs)
+            except Exception as exc:
+                logger.exception(f"[AI BATCH] Lỗi khi chạy batch cho model {model_key}")
+                for r in batch:
+                    r.future.set_exception(exc)
+                continue
+
+            logger.debug(f"[AI BATCH] Model {model_key}: {len(batch)} request, {len(inputs)} ảnh")
+            offset = 0
+            for r in batch:
+                n = len(r.inputs)
+                r.future.set_result(list(outputs[offset:offset + n]))
+                offset += n
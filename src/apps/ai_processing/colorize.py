@@ -0,0 +1,84 @@
+from functools import lru_cache
+
+import numpy as np
+
+LUT_SIZE = 256
+
+# Dữ liệu segment (x, y0, y1) của các colormap matplotlib tương ứng (matplotlib/_cm.py)
+_SEGMENT_DATA = {
+    "jet": {
+        "red": ((0.0, 0, 0), (0.35, 0, 0), (0.66, 1, 1), (0.89, 1, 1), (1, 0.5, 0.5)),
+        "green": ((0.0, 0, 0), (0.125, 0, 0), (0.375, 1, 1), (0.64, 1, 1), (0.91, 0, 0), (1, 0, 0)),
+        "blue": ((0.0, 0.5, 0.5), (0.11, 1, 1), (0.34, 1, 1), (0.65, 0, 0), (1, 0, 0)),
+    },
+    "hot": {
+        "red": ((0.0, 0.0416, 0.0416), (0.365079, 1.0, 1.0), (1.0, 1.0, 1.0)),
+        "green": ((0.0, 0.0, 0.0), (0.365079, 0.0, 0.0), (0.746032, 1.0, 1.0), (1.0, 1.0, 1.0)),
+        "blue": ((0.0, 0.0, 0.0), (0.746032, 0.0, 0.0), (1.0, 1.0, 1.0)),
+    },
+    "gray": {
+        "red": ((0.0, 0, 0), (1.0, 1, 1)),
+        "green": ((0.0, 0, 0), (1.0, 1, 1)),
+        "blue": ((0.0, 0, 0), (1.0, 1, 1)),
+    },
+}
+COLORMAPS = tuple(name for base in _SEGMENT_DATA for name in (base, f"{base}_r"))
+
+
+def _segment_lut(segments, n=LUT_SIZE):
+    """
+    Nội suy tuyến tính từng đoạn giống matplotlib.colors._create_lookup_table (gamma = 1), kể cả thứ tự phép tính:
+    x và điểm lấy mẫu được nhân với (n - 1) trước khi nội suy, nếu không vài entry lệch 1 sau khi làm tròn uint8.
+    """
+    data = np.asarray(segments, dtype=np.float64)
+    x, y0, y1 = data[:, 0] * (n - 1), data[:, 1], data[:, 2]
+    xind = (n - 1) * np.linspace(0, 1, n)
+    ind = np.searchsorted(x, xind)[1:-1]
+    distance = (xind[1:-1] - x[ind - 1]) / (x[ind] - x[ind - 1])
+    lut = np.concatenate([[y1[0]], distance * (y0[ind] - y1[ind - 1]) + y1[ind - 1], [y0[-1]]])
+    return np.clip(lut, 0.0, 1.0)
+
+
+@lru_cache(maxsize=None)
+def colormap_lut(name):
+    """LUT RGBA uint8 (256, 4) của colormap `name`; hậu tố "_r" là colormap đảo như Colormap.reversed()."""
+    if name not in COLORMAPS:
+        raise ValueError(f"Colormap không hợp lệ: {name}. Hỗ trợ: {', '.join(COLORMAPS)}")
+    base, reverse = (name[:-2], True) if name.endswith("_r") else (name, False)
+    channels = []
+    for channel in ("red", "green", "blue"):
+        segments = _SEGMENT_DATA[base][channel]
+        if reverse:
+            segments = [(1.0 - x, y1, y0) for x, y0, y1 in reversed(segments)]
+        channels.append(_segment_lut(segments))
+    rgba = np.stack(channels + [np.ones(LUT_SIZE)], axis=1)
+    # Cùng phép làm tròn với np.uint8(cmap(x) * 255)
+    lut = np.uint8(rgba * 255)
+    lut.setflags(write=False)
+    return lut
+
+
+def quantize(values, n=LUT_SIZE):
+    """Chỉ số LUT cho giá trị trong [0, 1] theo đúng quy tắc của Colormap.__call__: int(x * N), x = 1 -> N - 1."""
+    # Một mảng tạm duy nhất, clip/nan_to_num làm tại chỗ; NaN -> 0 (colorize ghi đè bằng màu "bad")
+    index = np.multiply(values, n, dtype=np.float64)
+    np.clip(index, 0, n - 1, out=index)
+    np.nan_to_num(index, copy=False, nan=0.0)
+    return index.astype(np.uint8)
+
+
+@lru_cache(maxsize=None)
+def _packed_lut(name):
+    """LUT của `name` xem như (256,) uint32: mỗi pixel gom một lần 4 byte thay vì fancy-index theo từng kênh."""
+    return colormap_lut(name).view(np.uint32).ravel()
+
+
+def colorize(values, name="jet_r"):
+    """Tô màu mảng giá trị trong [0, 1] thành ảnh RGBA uint8, trùng với np.uint8(matplotlib cmap(values) * 255)."""
+    index = quantize(values)
+    rgba = np.take(_packed_lut(name), index).view(np.uint8).reshape(index.shape + (4,))
+    nan = np.isnan(values)
+    if nan.any():
+        # Giá trị "bad" của matplotlib: (0, 0, 0, 0)
+        rgba[nan] = 0
+    return rgba
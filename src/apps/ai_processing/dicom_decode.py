@@ -0,0 +1,198 @@
+import logging
+from functools import lru_cache
+from io import BytesIO
+
+import cv2
+import numpy as np
+import pydicom
+from pydicom.uid import ExplicitVRLittleEndian, ImplicitVRLittleEndian
+
+try:  # pydicom >= 3: giải mã từng frame của dữ liệu nén
+    from pydicom.pixels import pixel_array as _decode_frame
+except ImportError:
+    _decode_frame = None
+
+logger = logging.getLogger(__name__)
+
+# "minmax": kéo giãn min/max từng frame về 8-bit (cách model được huấn luyện);
+# "window": Rescale + VOI window trong header; "study": một cửa sổ chung cho mọi lát của study
+INTENSITY_MODES = ("minmax", "window", "study")
+_NATIVE_SYNTAXES = (ImplicitVRLittleEndian, ExplicitVRLittleEndian)
+
+
+def open_dataset(source):
+    """
+    Đọc dataset mà không giải mã pixel. `source` là bytes hoặc đường dẫn file; với file trên đĩa,
+    PixelData được đọc trễ để read_frame có thể memory-map đúng frame cần dùng.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return pydicom.dcmread(BytesIO(source))
+    return pydicom.dcmread(source, defer_size="1 MB")
+
+
+def number_of_frames(ds):
+    return int(ds.get("NumberOfFrames", 1) or 1)
+
+
+def _is_native(ds):
+    transfer_syntax = getattr(getattr(ds, "file_meta", None), "TransferSyntaxUID", None)
+    return transfer_syntax in _NATIVE_SYNTAXES and int(ds.BitsAllocated) in (8, 16, 32)
+
+
+def _stored_dtype(ds):
+    signed = int(ds.get("PixelRepresentation", 0)) == 1
+    return np.dtype(f"<{'i' if signed else 'u'}{int(ds.BitsAllocated) // 8}")
+
+
+def _fit_bits_stored(frame, ds):
+    """
+    Bỏ các bit cao ngoài BitsStored như pixel_array của pydicom: xoá về 0 với dữ liệu không dấu, mở rộng dấu
+    từ bit BitsStored - 1 với dữ liệu có dấu. Frame đủ BitsAllocated bit được trả lại nguyên (không copy).
+    """
+    bits_allocated = int(ds.BitsAllocated)
+    bits_stored = int(ds.get("BitsStored", bits_allocated) or bits_allocated)
+    if not 0 < bits_stored < bits_allocated:
+        return frame
+    if frame.dtype.kind == "i":
+        shift = bits_allocated - bits_stored
+        return (frame << shift) >> shift
+    return frame & frame.dtype.type((1 << bits_stored) - 1)
+
+
+def _pixel_buffer(ds):
+    """Buffer PixelData không nén: memmap vào file nếu phần tử đang được đọc trễ, ngược lại là bytes trong dataset."""
+    element = ds.get_item("PixelData")
+    filename = getattr(ds, "filename", None)
+    if getattr(element, "value", None) is None and isinstance(filename, str) and element.value_tell is not None:
+        return np.memmap(filename, dtype=np.uint8, mode="r", offset=element.value_tell, shape=(element.length,))
+    return ds.PixelData
+
+
+def read_frame(ds, index=0):
+    """
+    Pixel gốc (chưa rescale) của một frame. Dữ liệu không nén được đọc bằng np.frombuffer/memmap trên đúng
+    đoạn byte của frame đó; dữ liệu nén giải mã từng frame nếu pydicom hỗ trợ, không thì giải mã cả object một lần.
+    """
+    if "PixelData" not in ds:
+        raise ValueError("DICOM không có PixelData.")
+    count = number_of_frames(ds)
+    if not 0 <= index < count:
+        raise ValueError(f"Frame {index} không tồn tại (object có {count} frame).")
+
+    rows, cols = int(ds.Rows), int(ds.Columns)
+    samples = int(ds.get("SamplesPerPixel", 1))
+    if _is_native(ds):
+        dtype = _stored_dtype(ds)
+        length = rows * cols * samples
+        frame = np.frombuffer(_pixel_buffer(ds), dtype=dtype, count=length, offset=index * length * dtype.itemsize)
+        frame = _fit_bits_stored(frame, ds)
+        if samples == 1:
+            return frame.reshape(rows, cols)
+        if int(ds.get("PlanarConfiguration", 0)) == 1:
+            return frame.reshape(samples, rows, cols).transpose(1, 2, 0)
+        return frame.reshape(rows, cols, samples)
+
+    if _decode_frame is not None:
+        return _decode_frame(ds, index=index)
+    pixel_array = ds.pixel_array  # pydicom giữ lại mảng đã giải mã trên dataset
+    return pixel_array[index] if count > 1 else pixel_array
+
+
+def _first(value):
+    if isinstance(value, pydicom.multival.MultiValue):
+        return value[0] if len(value) else None
+    return value
+
+
+def rescale_params(ds):
+    return float(ds.get("RescaleSlope", 1) or 1), float(ds.get("RescaleIntercept", 0) or 0)
+
+
+def header_window(ds):
+    """Cửa sổ (low, high) theo đơn vị modality từ WindowCenter/WindowWidth (giá trị đầu tiên), hoặc None."""
+    center, width = _first(ds.get("WindowCenter")), _first(ds.get("WindowWidth"))
+    if center is None or width is None or float(width) < 1:
+        return None
+    # Hàm VOI tuyến tính của DICOM (PS3.3 C.11.2.1.2)
+    center, width = float(center), float(width)
+    return center - 0.5 - (width - 1) / 2, center - 0.5 + (width - 1) / 2
+
+
+def _modality_range(stored_min, stored_max, slope, intercept):
+    low, high = stored_min * slope + intercept, stored_max * slope + intercept
+    return (low, high) if low <= high else (high, low)
+
+
+def dataset_window(datasets):
+    """Cửa sổ (low, high) bao min/max giá trị modality của mọi frame xám trong các dataset (chuẩn hoá theo study)."""
+    low, high = np.inf, -np.inf
+    for ds in datasets:
+        if int(ds.get("SamplesPerPixel", 1)) != 1:
+            continue
+        slope, intercept = rescale_params(ds)
+        for index in range(number_of_frames(ds)):
+            frame = read_frame(ds, index)
+            frame_low, frame_high = _modality_range(float(frame.min()), float(frame.max()), slope, intercept)
+            low, high = min(low, frame_low), max(high, frame_high)
+    if not np.isfinite(low):
+        return None
+    return low, high
+
+
+@lru_cache(maxsize=64)
+def _window_lut(bits, signed, slope, intercept, low, high, invert):
+    """LUT uint8 cho mọi giá trị lưu trữ `bits`-bit: rescale -> cửa sổ tuyến tính -> [0, 255]."""
+    stored = np.arange(1 << bits, dtype=np.dtype(f"<u{bits // 8}"))
+    if signed:
+        stored = stored.view(np.dtype(f"<i{bits // 8}"))
+    modality = stored.astype(np.float64) * slope + intercept
+    scaled = np.clip((modality - low) / max(high - low, 1e-6), 0.0, 1.0)
+    if invert:
+        scaled = 1.0 - scaled
+    lut = np.rint(scaled * 255).astype(np.uint8)
+    lut.setflags(write=False)
+    return lut
+
+
+def apply_window(frame, slope, intercept, window, invert=False):
+    """Áp rescale + cửa sổ `window` (low, high) lên frame, trả về ảnh xám uint8; dùng LUT cache cho dữ liệu 8/16-bit."""
+    low, high = window
+    if frame.dtype.kind in "ui" and frame.dtype.itemsize <= 2:
+        bits = frame.dtype.itemsize * 8
+        lut = _window_lut(bits, frame.dtype.kind == "i", slope, intercept, float(low), float(high), bool(invert))
+        return lut[frame.view(np.dtype(f"<u{frame.dtype.itemsize}"))]
+
+    scaled = np.clip((frame.astype(np.float32) * slope + intercept - low) / max(high - low, 1e-6), 0.0, 1.0)
+    if invert:
+        scaled = 1.0 - scaled
+    return np.rint(scaled * 255).astype(np.uint8)
+
+
+def iter_frames(ds, mode="minmax", window=None, indices=None):
+    """
+    Sinh (frame_index, kind, image) cho các frame cần dùng của dataset, giải mã lười từng frame.
+    kind "frame": pixel gốc (engine tự min/max); "gray": ảnh xám uint8 đã áp cửa sổ; "image": ảnh màu BGR.
+    Với mode "study", `window` là cửa sổ chung của cả study (mặc định: cửa sổ của riêng dataset này).
+    """
+    if mode not in INTENSITY_MODES:
+        raise ValueError(f"Chế độ cường độ không hợp lệ: {mode}. Hỗ trợ: {', '.join(INTENSITY_MODES)}")
+    indices = range(number_of_frames(ds)) if indices is None else indices
+    color = int(ds.get("SamplesPerPixel", 1)) != 1
+
+    if not color and mode != "minmax":
+        slope, intercept = rescale_params(ds)
+        invert = ds.get("PhotometricInterpretation") == "MONOCHROME1"
+        if mode == "window":
+            window = header_window(ds)
+        elif window is None:
+            window = dataset_window([ds])
+
+    for index in indices:
+        frame = read_frame(ds, index)
+        if color:
+            yield index, "image", cv2.cvtColor(frame.astype(np.uint8, copy=False), cv2.COLOR_RGB2BGR)
+        elif mode == "minmax" or window is None:
+            # Không có cửa sổ trong header: quay về min/max từng frame
+            yield index, "frame", frame
+        else:
+            yield index, "gray", apply_window(frame, slope, intercept, window, invert)
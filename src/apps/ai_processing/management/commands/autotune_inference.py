@@ -0,0 +1,175 @@
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.ai_processing import services
+from apps.ai_processing.models import AIModel
+
+OBJECTIVES = ("latency", "throughput")
+
+
+def _powers_of_two(limit):
+    values = [n for n in (1, 2, 4, 8, 16, 32, 64) if n < limit]
+    return values + [limit]
+
+
+def measure(ai_model, batch_sizes, requests):
+    """Đo trong process hiện tại (thread đã được đặt): latency predict + Grad-CAM batch-of-one và throughput theo batch."""
+    model, grad_model = services.get_model_and_grad_model(ai_model)
+    explain = services.make_explainer(grad_model)
+    rng = np.random.default_rng(0)
+    size = services.IMG_SIZE
+    images = rng.integers(0, 256, size=(max(batch_sizes), size, size, 3)).astype(np.float32)
+
+    for _ in range(3):
+        services.run_explainer(explain, images[:1])
+    latencies = []
+    for i in range(requests):
+        start = time.perf_counter()
+        services.run_explainer(explain, images[i % len(images):][:1])
+        latencies.append(time.perf_counter() - start)
+
+    throughput = {}
+    for batch_size in batch_sizes:
+        batch = images[:batch_size]
+        model.predict_on_batch(batch)
+        repeats = max(3, 64 // batch_size)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model.predict_on_batch(batch)
+        throughput[str(batch_size)] = repeats * batch_size / (time.perf_counter() - start)
+
+    return {
+        "latency_p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "latency_p95_ms": float(np.percentile(latencies, 95) * 1000),
+        "throughput": throughput,
+    }
+
+
+def choose_profile(results, objective):
+    """Cấu hình tốt nhất theo `objective`; batch_size là batch cho throughput cao nhất của cấu hình đó."""
+    if objective == "latency":
+        best = min(results, key=lambda r: r["latency_p50_ms"])
+    else:
+        best = max(results, key=lambda r: max(r["throughput"].values()))
+    batch_size, images_per_second = max(best["throughput"].items(), key=lambda item: item[1])
+    return {
+        "intra_op": best["intra_op"],
+        "inter_op": best["inter_op"],
+        "omp_num_threads": best["omp_num_threads"],
+        "batch_size": int(batch_size),
+        "latency_p50_ms": best["latency_p50_ms"],
+        "throughput": images_per_second,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Dò số thread intra-op/inter-op của TensorFlow, OMP_NUM_THREADS và batch size trên máy hiện tại bằng input "
+        "224x224 giả qua model thật của get_model_and_grad_model; ghi profile tốt nhất ra AI_TUNING_PROFILE_PATH để "
+        "worker áp dụng khi khởi động."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model-id", help="Mặc định: model gốc đang dùng đầu tiên")
+        parser.add_argument("--objective", choices=OBJECTIVES, default="throughput")
+        parser.add_argument("--workers", type=int, default=1, help="Số process inference sẽ chạy song song trên máy")
+        parser.add_argument("--intra-op", type=int, nargs="+", help="Mặc định: 1, 2, 4... tới số core mỗi worker")
+        parser.add_argument("--inter-op", type=int, nargs="+", default=[1, 2])
+        parser.add_argument("--omp", nargs="+", default=["intra", "1"], help='Giá trị OMP_NUM_THREADS; "intra" = bằng intra-op')
+        parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+        parser.add_argument("--requests", type=int, default=20, help="Số request batch-of-one để đo latency")
+        parser.add_argument("--dry-run", action="store_true", help="Chỉ in kết quả, không ghi profile")
+        parser.add_argument("--child", help="(nội bộ) cấu hình JSON cần đo trong process này")
+
+    def handle(self, *args, **options):
+        if options["model_id"]:
+            ai_model = AIModel.objects.get(model_id=options["model_id"])
+        else:
+            ai_model = AIModel.objects.filter(is_active=True, base_model__isnull=True).order_by("model_name").first()
+        if ai_model is None:
+            raise CommandError("Không có AIModel nào để đo.")
+        if ai_model.base_model_id is not None:
+            # Biến thể lượng tử hoá chỉ có file .tflite; thread TensorFlow được đo trên model Keras gốc
+            ai_model = services._keras_model_obj(ai_model)
+            if not options["child"]:
+                self.stdout.write(f"Biến thể lượng tử hoá: đo model Keras gốc {ai_model}")
+
+        if options["child"]:
+            config = json.loads(options["child"])
+            # Phải đặt trước khi TensorFlow khởi tạo runtime, nên mỗi cấu hình chạy trong một process mới
+            services.configure_inference_threads(config["intra_op"], config["inter_op"], config["omp_num_threads"])
+            result = measure(ai_model, options["batch_sizes"], options["requests"])
+            self.stdout.write(json.dumps({**config, **result}))
+            return
+
+        per_worker = services.threads_per_worker(options["workers"])
+        intra_values = options["intra_op"] or _powers_of_two(per_worker)
+        results, seen = [], set()
+        for intra_op, inter_op, omp in itertools.product(intra_values, options["inter_op"], options["omp"]):
+            omp_threads = intra_op if omp == "intra" else int(omp)
+            if (intra_op, inter_op, omp_threads) in seen:
+                continue
+            seen.add((intra_op, inter_op, omp_threads))
+            config = {"intra_op": intra_op, "inter_op": inter_op, "omp_num_threads": omp_threads}
+            result = self._spawn(ai_model, config, options)
+            results.append(result)
+            best_batch, best_throughput = max(result["throughput"].items(), key=lambda item: item[1])
+            self.stdout.write(
+                f"intra={intra_op:<3} inter={inter_op:<2} omp={config['omp_num_threads']:<3} "
+                f"p50={result['latency_p50_ms']:7.1f} ms  p95={result['latency_p95_ms']:7.1f} ms  "
+                f"throughput={best_throughput:7.1f} img/s (batch {best_batch})"
+            )
+
+        profile = {
+            **choose_profile(results, options["objective"]),
+            "objective": options["objective"],
+            "workers": options["workers"],
+            "cpu_count": os.cpu_count(),
+            "host": platform.node(),
+            "model_id": str(ai_model.model_id),
+            "created_at": timezone.now().isoformat(),
+            "results": results,
+        }
+        self.stdout.write(self.style.SUCCESS(
+            f"Tốt nhất ({options['objective']}): intra={profile['intra_op']} inter={profile['inter_op']} "
+            f"omp={profile['omp_num_threads']} batch={profile['batch_size']} "
+            f"(p50 {profile['latency_p50_ms']:.1f} ms, {profile['throughput']:.1f} img/s)"
+        ))
+        if options["dry_run"] or not settings.AI_TUNING_PROFILE_PATH:
+            return
+
+        path = settings.AI_TUNING_PROFILE_PATH
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(profile, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        self.stdout.write(f"Đã ghi profile vào {path}; khởi động lại web/inference worker để áp dụng.")
+
+    def _spawn(self, ai_model, config, options):
+        command = [
+            sys.executable, "manage.py", "autotune_inference", "--model-id", str(ai_model.model_id),
+            "--child", json.dumps(config), "--requests", str(options["requests"]),
+            "--batch-sizes", *map(str, options["batch_sizes"]),
+        ]
+        # Profile cũ và biến môi trường thread không được ảnh hưởng tới cấu hình đang đo
+        env = {
+            key: value for key, value in os.environ.items()
+            if key not in ("AI_TF_INTRA_OP_THREADS", "AI_TF_INTER_OP_THREADS", "OMP_NUM_THREADS")
+        }
+        env["OMP_NUM_THREADS"] = str(config["omp_num_threads"])
+        env["AI_TUNING_PROFILE_PATH"] = ""
+        completed = subprocess.run(command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise CommandError(f"Đo cấu hình {config} thất bại:\n{completed.stderr[-2000:]}")
+        return json.loads(completed.stdout.strip().splitlines()[-1])
@@ -0,0 +1,113 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.ai_processing import backends, services
+from apps.ai_processing.models import AIModel
+
+
+def _rss_mb():
+    """(RSS hiện tại, RSS đỉnh) của process, MB."""
+    values = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                values[key] = int(value.split()[0]) / 1024
+    return values.get("VmRSS", 0.0), values.get("VmHWM", 0.0)
+
+
+def _load_runner(backend, weights_path):
+    if backend == "keras":
+        model, grad_model = services.build_model(weights_path)
+        explain = services.make_explainer(grad_model)
+        return backends.KerasBackend(model, lambda batch, class_index=None: services.run_explainer(explain, batch, class_index))
+    return backends.load_exported(backends.exported_path(weights_path, backend), threads=settings.AI_BACKEND_THREADS)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark backend inference của một AIModel (keras, onnx, tflite): latency batch-of-one của "
+        "predict + Grad-CAM, throughput theo batch và RSS; mỗi backend đo trong một process riêng."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model-id", required=True)
+        parser.add_argument("--backends", nargs="+", choices=backends.BACKENDS, default=list(backends.BACKENDS))
+        parser.add_argument("--requests", type=int, default=50, help="Số request batch-of-one để đo latency")
+        parser.add_argument("--batch-size", type=int, default=16)
+        parser.add_argument("--batches", type=int, default=10)
+        parser.add_argument("--child", choices=backends.BACKENDS, help="(nội bộ) đo một backend trong process này")
+
+    def handle(self, *args, **options):
+        ai_model = AIModel.objects.get(model_id=options["model_id"])
+        if ai_model.base_model_id is not None:
+            raise CommandError(f"{ai_model} là biến thể lượng tử hoá (file .tflite); hãy benchmark model gốc.")
+        weights_path = services._weights_path(ai_model)
+        if options["child"]:
+            self.stdout.write(json.dumps(self._measure(options["child"], weights_path, options)))
+            return
+
+        self.stdout.write(f"{ai_model}: latency {options['requests']} request x1, throughput {options['batches']} batch x{options['batch_size']}")
+        for backend in options["backends"]:
+            if not os.path.exists(backends.exported_path(weights_path, backend)):
+                self.stdout.write(f"{backend:<7} chưa export, bỏ qua")
+                continue
+            result = self._spawn(backend, options)
+            self.stdout.write(
+                f"{backend:<7} load {result['load_seconds']:6.2f}s  "
+                f"p50={result['p50_ms']:8.1f} ms  p99={result['p99_ms']:8.1f} ms  "
+                f"throughput={result['throughput']:7.1f} img/s  "
+                f"RSS {result['rss_mb']:7.1f} MB (đỉnh {result['peak_rss_mb']:7.1f} MB)"
+            )
+
+    def _spawn(self, backend, options):
+        # Process mới cho mỗi backend để RSS không lẫn TensorFlow hay session của backend khác
+        command = [
+            sys.executable, "manage.py", "bench_backends", "--model-id", options["model_id"], "--child", backend,
+            "--requests", str(options["requests"]), "--batch-size", str(options["batch_size"]),
+            "--batches", str(options["batches"]),
+        ]
+        completed = subprocess.run(command, cwd=settings.BASE_DIR, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise CommandError(f"Đo backend {backend} thất bại:\n{completed.stderr[-2000:]}")
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def _measure(self, backend, weights_path, options):
+        start = time.perf_counter()
+        runner = _load_runner(backend, weights_path)
+        load_seconds = time.perf_counter() - start
+
+        rng = np.random.default_rng(0)
+        size = services.IMG_SIZE
+        batch = rng.integers(0, 256, size=(options["batch_size"], size, size, 3)).astype(np.float32)
+        runner.explain(batch[:1])
+        runner.predict(batch)
+
+        latencies = []
+        for i in range(options["requests"]):
+            start = time.perf_counter()
+            probs, conv_output, grads = runner.explain(batch[i % len(batch):][:1])[0]
+            services.grad_cam_from_activations(conv_output, grads)
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in range(options["batches"]):
+            runner.predict(batch)
+        elapsed = time.perf_counter() - start
+
+        rss, peak = _rss_mb()
+        return {
+            "load_seconds": load_seconds,
+            "p50_ms": float(np.percentile(latencies, 50) * 1000),
+            "p99_ms": float(np.percentile(latencies, 99) * 1000),
+            "throughput": options["batches"] * len(batch) / elapsed,
+            "rss_mb": rss,
+            "peak_rss_mb": peak,
+        }
@@ -0,0 +1,47 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.ai_processing.colorize import COLORMAPS, colorize
+
+
+class Command(BaseCommand):
+    help = "So sánh tô màu heatmap bằng LUT với matplotlib (phải trùng ở độ chính xác uint8) và đo thời gian."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=512, help="Kích thước heatmap (pixel)")
+        parser.add_argument("--iterations", type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            from matplotlib import colormaps
+        except ImportError:
+            raise CommandError("Cần matplotlib để đối chiếu kết quả.")
+
+        rng = np.random.default_rng(0)
+        size = options["size"]
+        heatmap = rng.random((size, size))
+        # Các giá trị biên: 0, 1, đúng mốc k/256 và sát mốc
+        edges = np.concatenate([[0.0, 1.0], np.arange(257) / 256, np.nextafter(np.arange(1, 257) / 256, 0)])
+        heatmap.flat[:len(edges)] = edges
+
+        for name in COLORMAPS:
+            expected = np.uint8(colormaps[name](heatmap) * 255)
+            if not np.array_equal(colorize(heatmap, name), expected):
+                raise CommandError(f"Colormap {name} lệch so với matplotlib.")
+
+        cmap = colormaps["jet_r"]
+        start = time.perf_counter()
+        for _ in range(options["iterations"]):
+            np.uint8(cmap(heatmap) * 255)
+        mpl_s = (time.perf_counter() - start) / options["iterations"]
+
+        colorize(heatmap, "jet_r")
+        start = time.perf_counter()
+        for _ in range(options["iterations"]):
+            colorize(heatmap, "jet_r")
+        lut_s = (time.perf_counter() - start) / options["iterations"]
+
+        self.stdout.write(f"{len(COLORMAPS)} colormap trùng khớp với matplotlib ({size}x{size})")
+        self.stdout.write(f"matplotlib {mpl_s * 1000:8.3f} ms/lần, LUT {lut_s * 1000:8.3f} ms/lần")
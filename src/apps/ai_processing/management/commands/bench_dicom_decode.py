@@ -0,0 +1,109 @@
+import os
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+import numpy as np
+import pydicom
+from django.core.management.base import BaseCommand, CommandError
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+from apps.ai_processing import dicom_decode
+
+
+def _multiframe_dicom(frames, size, seed=0):
+    """DICOM nhiều frame không nén, pixel int16 có Rescale và Window trong header."""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(-1024, 3072, size=(frames, size, size), dtype=np.int16)
+
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.4.1"
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = Dataset()
+    ds.file_meta = file_meta
+    ds.SOPClassUID = file_meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    ds.Rows = ds.Columns = size
+    ds.NumberOfFrames = frames
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 1
+    ds.RescaleSlope, ds.RescaleIntercept = 1, -1024
+    ds.WindowCenter, ds.WindowWidth = 40, 400
+    ds.PixelData = pixels.tobytes()
+    ds.is_little_endian, ds.is_implicit_VR = True, False
+
+    buffer = BytesIO()
+    pydicom.dcmwrite(buffer, ds, write_like_original=False)
+    return buffer.getvalue()
+
+
+def _measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark lớp giải mã DICOM: lấy một frame từ object nhiều frame (ds.pixel_array vs read_frame, "
+        "bytes và memmap) và áp cửa sổ (phép tính float vs LUT cache)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--frames", type=int, default=200)
+        parser.add_argument("--size", type=int, default=512)
+
+    def handle(self, *args, **options):
+        payload = _multiframe_dicom(options["frames"], options["size"])
+        self.stdout.write(f"{options['frames']} frame {options['size']}x{options['size']} int16, {len(payload) / 2**20:.1f} MB")
+
+        legacy, legacy_s, legacy_peak = _measure(lambda: pydicom.dcmread(BytesIO(payload)).pixel_array[0])
+        self._report("pixel_array[0]", legacy_s, legacy_peak)
+
+        ds = dicom_decode.open_dataset(payload)
+        frame, lazy_s, lazy_peak = _measure(lambda: dicom_decode.read_frame(ds, 0))
+        self._report("read_frame (bytes)", lazy_s, lazy_peak)
+        if not np.array_equal(frame, legacy):
+            raise CommandError("read_frame trả về pixel khác ds.pixel_array.")
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "multiframe.dcm")
+            with open(path, "wb") as f:
+                f.write(payload)
+            _, mapped_s, mapped_peak = _measure(
+                lambda: np.array(dicom_decode.read_frame(dicom_decode.open_dataset(path), options["frames"] - 1))
+            )
+            self._report("read_frame (memmap)", mapped_s, mapped_peak)
+
+        slope, intercept = dicom_decode.rescale_params(ds)
+        window = dicom_decode.header_window(ds)
+        frames = [dicom_decode.read_frame(ds, i) for i in range(min(options["frames"], 50))]
+
+        start = time.perf_counter()
+        reference = [
+            np.rint(np.clip((f.astype(np.float64) * slope + intercept - window[0]) / (window[1] - window[0]), 0, 1) * 255).astype(np.uint8)
+            for f in frames
+        ]
+        float_s = (time.perf_counter() - start) / len(frames)
+
+        dicom_decode.apply_window(frames[0], slope, intercept, window)  # dựng LUT một lần
+        start = time.perf_counter()
+        windowed = [dicom_decode.apply_window(f, slope, intercept, window) for f in frames]
+        lut_s = (time.perf_counter() - start) / len(frames)
+
+        max_diff = max(int(np.max(np.abs(a.astype(np.int16) - b))) for a, b in zip(windowed, reference))
+        self.stdout.write(f"window float {float_s * 1000:7.3f} ms/frame, LUT {lut_s * 1000:7.3f} ms/frame (max|Δ| = {max_diff})")
+
+    def _report(self, name, seconds, peak):
+        self.stdout.write(f"{name:<20} {seconds * 1000:8.2f} ms, peak {peak / 2**20:7.1f} MB")
@@ -0,0 +1,45 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.ai_processing.interpolation import INTERPOLATION_MODES, upsample_cam
+from apps.ai_processing.services import IMG_SIZE
+
+
+def _normalize(heatmap):
+    heatmap = np.maximum(heatmap, 0)
+    return (heatmap - np.min(heatmap)) / (np.max(heatmap) - np.min(heatmap) + 1e-10)
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark nội suy Grad-CAM và kiểm tra độ sai lệch so với griddata(method='cubic')."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=50)
+        parser.add_argument("--cam-size", type=int, default=7, help="Kích thước feature map conv5 (mặc định 7x7)")
+        parser.add_argument("--tolerance", type=float, default=1e-4,
+                            help="Sai số tuyệt đối tối đa cho phép giữa chế độ 'cubic' và griddata")
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        n = options["cam_size"]
+        cams = [np.maximum(rng.normal(size=(n, n)), 0) for _ in range(options["iterations"])]
+
+        # Lần gọi đầu dựng kernel và được cache, không tính vào thời gian
+        for mode in INTERPOLATION_MODES:
+            upsample_cam(cams[0], IMG_SIZE, mode=mode)
+
+        reference = [_normalize(upsample_cam(cam, IMG_SIZE, mode="griddata")) for cam in cams]
+        cubic_error = None
+        for mode in INTERPOLATION_MODES:
+            start = time.perf_counter()
+            results = [upsample_cam(cam, IMG_SIZE, mode=mode) for cam in cams]
+            per_call = (time.perf_counter() - start) / len(cams)
+            error = max(np.max(np.abs(_normalize(r) - ref)) for r, ref in zip(results, reference))
+            if mode == "cubic":
+                cubic_error = error
+            self.stdout.write(f"{mode:<9} {per_call * 1000:8.3f} ms/lần  max|Δ| so với griddata = {error:.2e}")
+
+        if cubic_error > options["tolerance"]:
+            raise CommandError(f"Chế độ 'cubic' lệch {cubic_error:.2e} so với griddata (ngưỡng {options['tolerance']:.0e}).")
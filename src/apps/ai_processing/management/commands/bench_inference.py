@@ -0,0 +1,75 @@
+import threading
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from apps.ai_processing import services
+from apps.ai_processing.batching import BatchingInferenceEngine
+
+
+class Command(BaseCommand):
+    help = "Benchmark tải cho predict-frame: so sánh đường per-request với batching engine (throughput, p50/p99)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=64, help="Tổng số request giả lập")
+        parser.add_argument("--concurrency", type=int, default=8, help="Số client đồng thời")
+        parser.add_argument("--max-batch-size", type=int, default=8)
+        parser.add_argument("--max-wait-ms", type=float, default=10.0)
+
+    def handle(self, *args, **options):
+        model, grad_model = services.build_model()
+        explain = services.make_explainer(grad_model)
+        rng = np.random.default_rng(0)
+        images = rng.integers(0, 256, size=(options["requests"], 1, services.IMG_SIZE, services.IMG_SIZE, 3)).astype(np.float32)
+
+        # Warm-up để loại bỏ chi phí tracing khỏi số đo
+        model.predict(images[0], verbose=0)
+        services.get_grad_cam_plus_plus(grad_model, images[0], 0)
+        services.run_explainer(explain, np.concatenate(images[:options["max_batch_size"]]))
+
+        def per_request(img):
+            # Đường cũ: model.predict rồi forward thêm một lần cho Grad-CAM
+            probs = model.predict(img, verbose=0)[0]
+            return services.get_grad_cam_plus_plus(grad_model, img, int(np.argmax(probs)))
+
+        engine = BatchingInferenceEngine(options["max_batch_size"], options["max_wait_ms"])
+        # Engine chỉ ghép các request cùng runner nên mọi client dùng chung một callable
+        runner = lambda batch: services.run_explainer(explain, batch)  # noqa: E731
+
+        def batched(img):
+            probs, conv_output, grads = engine.infer("bench", img, runner)[0]
+            return services.grad_cam_from_activations(conv_output, grads)
+
+        for name, fn in (("per-request", per_request), ("batched", batched)):
+            latencies, elapsed = self._run(fn, images, options["concurrency"])
+            self.stdout.write(
+                f"{name:<12} throughput={len(images) / elapsed:7.2f} img/s  "
+                f"p50={np.percentile(latencies, 50) * 1000:8.1f} ms  "
+                f"p99={np.percentile(latencies, 99) * 1000:8.1f} ms"
+            )
+
+    def _run(self, fn, images, concurrency):
+        latencies = []
+        lock = threading.Lock()
+        cursor = iter(range(len(images)))
+
+        def client():
+            while True:
+                with lock:
+                    idx = next(cursor, None)
+                if idx is None:
+                    return
+                start = time.perf_counter()
+                fn(images[idx])
+                duration = time.perf_counter() - start
+                with lock:
+                    latencies.append(duration)
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return latencies, time.perf_counter() - start
@@ -0,0 +1,54 @@
+import base64
+import io
+import json
+import time
+
+import cv2
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from apps.ai_processing import services
+from apps.ai_processing.parsers import RawFrameParser, pack_raw_frame
+
+
+class Command(BaseCommand):
+    help = "So sánh kích thước request và thời gian decode phía server: JSON data URI (PNG) với raw frame nhị phân."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=512, help="Kích thước frame (size x size)")
+        parser.add_argument("--iterations", type=int, default=50)
+
+    def handle(self, *args, **options):
+        size = options["size"]
+        yy, xx = np.mgrid[0:size, 0:size]
+        phantom = np.hypot(yy - size / 2, xx - size / 2)
+        frame = np.where(phantom < size * 0.4, 1200 - phantom * 2, 0).astype(np.uint16)
+        frame += np.random.default_rng(0).integers(0, 50, frame.shape, dtype=np.uint16)
+
+        # Đường cũ: viewer render canvas 8-bit RGBA rồi gửi PNG base64 trong JSON
+        canvas = cv2.cvtColor(cv2.normalize(frame, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U), cv2.COLOR_GRAY2BGRA)
+        _, png = cv2.imencode(".png", canvas)
+        json_body = json.dumps({
+            "imageData": "data:image/png;base64," + base64.b64encode(png.tobytes()).decode(),
+            "studyInstanceUID": "1.2.3",
+            "modelId": "00000000-0000-0000-0000-000000000000",
+        }).encode()
+
+        raw_body = pack_raw_frame(frame)
+        parser = RawFrameParser()
+
+        def decode_json():
+            data = json.loads(json_body)
+            _, encoded = data["imageData"].split(",", 1)
+            return services.decode_image_bytes(base64.b64decode(encoded))
+
+        def decode_raw():
+            return services.decode_raw_pixels(parser.parse(io.BytesIO(raw_body))["pixels"])
+
+        for name, body, fn in (("json+base64", json_body, decode_json), ("raw-frame", raw_body, decode_raw)):
+            fn()
+            start = time.perf_counter()
+            for _ in range(options["iterations"]):
+                fn()
+            per_call = (time.perf_counter() - start) / options["iterations"]
+            self.stdout.write(f"{name:<12} request={len(body) / 1024:9.1f} KB  decode={per_call * 1000:7.3f} ms")
@@ -0,0 +1,87 @@
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+import pydicom
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.ai_processing.preprocessing import PreprocessingEngine
+from apps.ai_processing.services import IMG_SIZE, create_advanced_brain_mask_full, preprocess_dcm_frame
+
+
+def _synthetic_series(count, size, seed=0):
+    """Series MRI giả lập: đầu hình elip thay đổi theo lát, nền nhiễu, pixel uint16 12-bit."""
+    rng = np.random.default_rng(seed)
+    series = np.empty((count, size, size), dtype=np.uint16)
+    for i in range(count):
+        frame = rng.normal(40, 15, size=(size, size))
+        radius = 0.25 + 0.15 * np.sin(np.pi * (i + 1) / (count + 1))
+        axes = (int(size * radius), int(size * (radius + 0.05)))
+        head = np.zeros((size, size), dtype=np.uint8)
+        cv2.ellipse(head, (size // 2, size // 2), axes, 0, 0, 360, 1, -1)
+        frame += head * rng.normal(1800, 400, size=(size, size))
+        series[i] = np.clip(frame, 0, 4095)
+    return series
+
+
+def _load_series(directory):
+    frames = []
+    for path in sorted(glob.glob(os.path.join(directory, "*"))):
+        try:
+            pixels = pydicom.dcmread(path).pixel_array
+        except (pydicom.errors.InvalidDicomError, AttributeError, IsADirectoryError):
+            continue
+        frames.extend(pixels if pixels.ndim == 3 else [pixels])
+    if not frames:
+        raise CommandError(f"Không đọc được frame DICOM nào trong {directory}.")
+    return frames
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark tiền xử lý một series: đường cũ (preprocess_dcm_frame + create_advanced_brain_mask_full) "
+        "so với PreprocessingEngine, kiểm tra kết quả trùng khớp và in thời gian từng stage."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--slices", type=int, default=64)
+        parser.add_argument("--size", type=int, default=512, help="Kích thước lát giả lập (pixel)")
+        parser.add_argument("--dicom-dir", help="Dùng các file DICOM trong thư mục này thay cho series giả lập")
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        frames = _load_series(options["dicom_dir"]) if options["dicom_dir"] else _synthetic_series(options["slices"], options["size"])
+        self.stdout.write(f"{len(frames)} lát, {frames[0].shape[1]}x{frames[0].shape[0]} {frames[0].dtype}")
+
+        legacy_seconds = []
+        for _ in range(options["repeat"]):
+            start = time.perf_counter()
+            legacy = [preprocess_dcm_frame(frame) for frame in frames]
+            legacy_batch = np.concatenate([result[0] for result in legacy])
+            legacy_masks = [create_advanced_brain_mask_full(result[2]) for result in legacy]
+            legacy_seconds.append(time.perf_counter() - start)
+
+        engine = PreprocessingEngine(target_size=IMG_SIZE, capacity=len(frames))
+        engine_seconds = []
+        for _ in range(options["repeat"]):
+            engine.reset_timings()
+            start = time.perf_counter()
+            batch, infos = engine.preprocess_stack(frames)
+            masks = [engine.brain_mask(info) for info in infos]
+            engine_seconds.append(time.perf_counter() - start)
+
+        if not np.array_equal(batch, legacy_batch.astype(np.float32)):
+            raise CommandError(f"Batch lệch so với đường cũ: max|Δ| = {np.max(np.abs(batch - legacy_batch)):.1f}")
+        if any(info["bbox"] != result[3] for info, result in zip(infos, legacy)):
+            raise CommandError("bbox lệch so với đường cũ.")
+        if any(not np.array_equal(a, b) for a, b in zip(masks, legacy_masks)):
+            raise CommandError("Mask não lệch so với đường cũ.")
+
+        for name, seconds in (("cũ", legacy_seconds), ("engine", engine_seconds)):
+            best = min(seconds)
+            self.stdout.write(f"{name:<7} {best * 1000 / len(frames):7.3f} ms/lát  ({len(frames) / best:8.1f} lát/s)")
+        self.stdout.write(f"batch {batch.shape} {batch.dtype}, kết quả trùng khớp với đường cũ")
+        for stage, ms in engine.timing_report().items():
+            self.stdout.write(f"  {stage:<10} {ms:7.3f} ms/lát")
@@ -0,0 +1,94 @@
+import multiprocessing
+import os
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from apps.ai_processing import services
+from apps.ai_processing.models import AIModel
+
+
+def _memory_mb():
+    """(RSS, PSS) của process hiện tại, MB. PSS chia đều các trang dùng chung nên phản ánh phần copy-on-write."""
+    values = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("Rss", "Pss"):
+                values[key] = int(value.split()[0]) / 1024
+    return values.get("Rss", 0.0), values.get("Pss", 0.0)
+
+
+def _serve(ai_model, threads, requests, ready, start, results):
+    """Một worker giống worker gunicorn/Celery sau fork: đặt số thread, warm-up rồi xử lý request batch-of-one."""
+    services.configure_inference_threads(threads)
+    explain = services.get_explainer(ai_model)
+    image = np.random.default_rng(os.getpid()).integers(0, 256, size=(1, services.IMG_SIZE, services.IMG_SIZE, 3))
+    image = image.astype(np.float32)
+    explain(image)
+    ready.put(os.getpid())
+    start.wait()
+
+    began = time.perf_counter()
+    for _ in range(requests):
+        _, conv_output, grads = explain(image)[0]
+        services.grad_cam_from_activations(conv_output, grads)
+    elapsed = time.perf_counter() - began
+    rss, pss = _memory_mb()
+    results.put({"elapsed": elapsed, "rss": rss, "pss": pss})
+
+
+class Command(BaseCommand):
+    help = (
+        "Đo chế độ serving prefork: master nạp sẵn file model rồi fork N worker (mỗi worker cores/N thread), "
+        "báo throughput tổng và RSS/PSS mỗi worker khi số worker tăng."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model-id", help="Mặc định: model đang dùng đầu tiên")
+        parser.add_argument("--workers", type=int, nargs="+", help="Các mức số worker (mặc định 1, 2, 4... tới số core)")
+        parser.add_argument("--requests", type=int, default=20, help="Số request mỗi worker")
+        parser.add_argument("--no-preload", action="store_true", help="Không nạp sẵn file model trong master")
+
+    def handle(self, *args, **options):
+        if options["model_id"]:
+            ai_model = AIModel.objects.get(model_id=options["model_id"])
+        else:
+            ai_model = AIModel.objects.filter(is_active=True).order_by("model_name").first()
+        if ai_model is None:
+            raise CommandError("Không có AIModel nào để đo.")
+
+        cores = os.cpu_count() or 1
+        levels = options["workers"] or [n for n in (1, 2, 4, 8, 16, 32, 64) if n <= cores]
+        if not options["no_preload"]:
+            nbytes = services.preload_model_files([ai_model])
+            self.stdout.write(f"Master nạp sẵn {nbytes / 2**20:.1f} MB ({ai_model.backend})")
+        connections.close_all()
+
+        self.stdout.write(f"{ai_model}: {cores} core, {options['requests']} request/worker")
+        context = multiprocessing.get_context("fork")
+        for workers in levels:
+            threads = services.threads_per_worker(workers)
+            ready, results, start = context.Queue(), context.Queue(), context.Event()
+            processes = [
+                context.Process(target=_serve, args=(ai_model, threads, options["requests"], ready, start, results))
+                for _ in range(workers)
+            ]
+            for process in processes:
+                process.start()
+            for _ in processes:
+                ready.get()
+            start.set()
+            stats = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+
+            elapsed = max(s["elapsed"] for s in stats)
+            self.stdout.write(
+                f"{workers:>3} worker x {threads:>2} thread: {workers * options['requests'] / elapsed:7.2f} img/s  "
+                f"RSS/worker {np.mean([s['rss'] for s in stats]):7.1f} MB  "
+                f"PSS/worker {np.mean([s['pss'] for s in stats]):7.1f} MB  "
+                f"PSS tổng {sum(s['pss'] for s in stats):8.1f} MB"
+            )
@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Chạy `manage.py check` trong process con; "eager" import TensorFlow trước như khi services.py còn import ở đầu module
+_CHECK = (
+    "import sys\n"
+    "{preload}"
+    "from django.core.management import execute_from_command_line\n"
+    "execute_from_command_line(['manage.py', 'check'])\n"
+    "print('tensorflow loaded:', 'tensorflow' in sys.modules, file=sys.stderr)\n"
+)
+_PRELOAD = "import tensorflow, tensorflow.keras.applications\n"
+
+
+class Command(BaseCommand):
+    help = (
+        "Đo thời gian và RSS tối đa của `manage.py check` trong process mới: import lười (hiện tại) "
+        "so với import TensorFlow ngay khi khởi động (như trước)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=3)
+        parser.add_argument("--skip-eager", action="store_true", help="Chỉ đo cấu hình hiện tại")
+
+    def handle(self, *args, **options):
+        variants = [("lazy", "")]
+        if not options["skip_eager"]:
+            variants.append(("eager", _PRELOAD))
+
+        for name, preload in variants:
+            results = [self._run(_CHECK.format(preload=preload)) for _ in range(options["runs"])]
+            seconds = sorted(r[0] for r in results)[len(results) // 2]
+            rss_mb = max(r[1] for r in results) / 1024
+            self.stdout.write(f"{name:<6} check {seconds:6.2f}s (median), RSS tối đa {rss_mb:8.1f} MB  [{results[-1][2]}]")
+
+    def _run(self, code):
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": os.environ.get("DJANGO_SETTINGS_MODULE", "config.settings")}
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-c", code], cwd=settings.BASE_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        )
+        # Đọc hết stderr trước (log của TF có thể làm đầy pipe), sau đó wait4 lấy rusage của riêng process con
+        # này (ru_maxrss tính bằng KB trên Linux)
+        stderr = process.stderr.read().strip().splitlines()
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        elapsed = time.perf_counter() - start
+        return elapsed, usage.ru_maxrss, stderr[-1] if stderr else ""
@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.ai_processing import backends, services
+from apps.ai_processing.models import AIModel
+
+
+class Command(BaseCommand):
+    help = (
+        "Đối chiếu backend đã export (ONNX/TFLite) với đường Keras: xác suất từng lớp, lớp dự đoán và heatmap "
+        "Grad-CAM. Với --activate, chuyển AIModel sang backend đó khi đạt ngưỡng."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model-id", required=True)
+        parser.add_argument("--backend", choices=sorted(backends.EXPORT_SUFFIXES), required=True)
+        parser.add_argument("--samples", type=int, default=16)
+        parser.add_argument("--atol", type=float, default=1e-4, help="Sai lệch tối đa của xác suất")
+        parser.add_argument("--heatmap-atol", type=float, default=1e-2, help="Sai lệch tối đa của heatmap [0, 1]")
+        parser.add_argument("--activate", action="store_true", help="Đặt AIModel.backend khi kiểm tra đạt")
+
+    def handle(self, *args, **options):
+        ai_model = AIModel.objects.get(model_id=options["model_id"])
+        if ai_model.base_model_id is not None:
+            raise CommandError(f"{ai_model} là biến thể lượng tử hoá (file .tflite); hãy đối chiếu model gốc.")
+        weights_path = services._weights_path(ai_model)
+        exported = backends.exported_path(weights_path, options["backend"])
+        if not os.path.exists(exported):
+            raise CommandError(f"Chưa có {exported}; chạy export_models --format {options['backend']} trước.")
+
+        _, grad_model = services.build_model(weights_path)
+        explain = services.make_explainer(grad_model)
+        runner = backends.load_exported(exported, threads=settings.AI_BACKEND_THREADS)
+
+        rng = np.random.default_rng(0)
+        size = services.IMG_SIZE
+        images = rng.integers(0, 256, size=(options["samples"], size, size, 3)).astype(np.float32)
+
+        reference = services.run_explainer(explain, images)
+        candidate = runner.explain(images)
+        predicted = runner.predict(images)
+
+        agree = 0
+        max_prob_diff = max_heatmap_diff = 0.0
+        per_class = np.zeros(len(services.CLASS_NAMES))
+        for (ref_probs, ref_conv, ref_grads), (probs, conv, grads) in zip(reference, candidate):
+            agree += int(np.argmax(probs) == np.argmax(ref_probs))
+            diff = np.abs(probs - ref_probs)
+            per_class = np.maximum(per_class, diff)
+            max_prob_diff = max(max_prob_diff, float(diff.max()))
+            ref_heatmap = services.grad_cam_from_activations(ref_conv, ref_grads)
+            heatmap = services.grad_cam_from_activations(conv, grads)
+            max_heatmap_diff = max(max_heatmap_diff, float(np.max(np.abs(heatmap - ref_heatmap))))
+        max_prob_diff = max(max_prob_diff, float(np.max(np.abs(predicted - np.stack([r[0] for r in reference])))))
+
+        n = len(images)
+        for name, diff in zip(services.CLASS_NAMES, per_class):
+            self.stdout.write(f"  {name:<20} max|Δprob| = {diff:.2e}")
+        self.stdout.write(
+            f"{options['backend']}: top-1 khớp {agree}/{n}, max|Δprob| = {max_prob_diff:.2e}, "
+            f"max|Δheatmap| = {max_heatmap_diff:.2e}"
+        )
+        if agree != n or max_prob_diff > options["atol"] or max_heatmap_diff > options["heatmap_atol"]:
+            raise CommandError(
+                f"Backend {options['backend']} lệch khỏi Keras (atol={options['atol']:.0e}, "
+                f"heatmap-atol={options['heatmap_atol']:.0e})."
+            )
+
+        if options["activate"]:
+            ai_model.backend = options["backend"]
+            ai_model.save(update_fields=["backend"])
+            self.stdout.write(self.style.SUCCESS(f"{ai_model} chuyển sang backend {ai_model.backend}."))
@@ -0,0 +1,54 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.ai_processing import services
+from apps.ai_processing.models import AIModel
+
+
+class Command(BaseCommand):
+    help = "Đối chiếu explainer một lượt với đường model.predict + Grad-CAM hai lượt (xác suất và heatmap)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model-id", help="AIModel cần kiểm tra; bỏ trống để dùng trọng số ngẫu nhiên")
+        parser.add_argument("--samples", type=int, default=8)
+        parser.add_argument("--atol", type=float, default=1e-4)
+
+    def handle(self, *args, **options):
+        if options["model_id"]:
+            ai_model = AIModel.objects.get(model_id=options["model_id"])
+            if ai_model.base_model_id is not None:
+                self.stdout.write(f"Biến thể lượng tử hoá: kiểm tra model Keras gốc {ai_model.base_model}")
+            model, grad_model = services.get_model_and_grad_model(ai_model)
+        else:
+            model, grad_model = services.build_model()
+        explain = services.make_explainer(grad_model)
+
+        rng = np.random.default_rng(0)
+        size = services.IMG_SIZE
+        images = rng.integers(0, 256, size=(options["samples"], 1, size, size, 3)).astype(np.uint8)
+
+        legacy_time = fused_time = 0.0
+        max_prob_diff = max_heatmap_diff = 0.0
+        for img in images:
+            start = time.perf_counter()
+            legacy_probs = model.predict(img, verbose=0)[0]
+            legacy_heatmap = services.get_grad_cam_plus_plus(grad_model, img, int(np.argmax(legacy_probs)))
+            legacy_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            probs, conv_output, grads = services.run_explainer(explain, img)[0]
+            heatmap = services.grad_cam_from_activations(conv_output, grads)
+            fused_time += time.perf_counter() - start
+
+            if int(np.argmax(probs)) != int(np.argmax(legacy_probs)):
+                raise CommandError("Lớp dự đoán của explainer khác với model.predict.")
+            max_prob_diff = max(max_prob_diff, float(np.max(np.abs(probs - legacy_probs))))
+            max_heatmap_diff = max(max_heatmap_diff, float(np.max(np.abs(heatmap - legacy_heatmap))))
+
+        n = len(images)
+        self.stdout.write(f"two-pass: {legacy_time / n * 1000:.1f} ms/ảnh   fused: {fused_time / n * 1000:.1f} ms/ảnh")
+        self.stdout.write(f"max|Δprob| = {max_prob_diff:.2e}   max|Δheatmap| = {max_heatmap_diff:.2e}")
+        if max_prob_diff > options["atol"] or max_heatmap_diff > options["atol"]:
+            raise CommandError(f"Sai lệch vượt ngưỡng atol={options['atol']:.0e}.")
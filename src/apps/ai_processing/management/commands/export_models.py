@@ -0,0 +1,95 @@
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.ai_processing import backends, services
+from apps.ai_processing.models import AIModel
+
+
+def _write_atomic(path, payload):
+    # Registry theo dõi mtime của file model nên chỉ thay file khi đã ghi xong
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+def save_cam_head(model, path):
+    """Lưu trọng số dense_hidden/dense_output để backend export tự tính gradient Grad-CAM (backends.CamHead)."""
+    w1, b1 = model.get_layer("dense_hidden").get_weights()
+    w2, b2 = model.get_layer("dense_output").get_weights()
+    tmp_path = f"{path}.tmp.npz"
+    backends.CamHead(w1, b1, w2, b2).save(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def export_onnx(grad_model, path, opset=17):
+    import tensorflow as tf
+    try:
+        import tf2onnx
+    except ImportError as exc:
+        raise CommandError("Export ONNX cần cài tf2onnx (chỉ cần trên máy export, không cần khi chạy).") from exc
+
+    spec = (tf.TensorSpec((None, services.IMG_SIZE, services.IMG_SIZE, 3), tf.float32, name="input"),)
+    model_proto, _ = tf2onnx.convert.from_keras(grad_model, input_signature=spec, opset=opset)
+    _write_atomic(path, model_proto.SerializeToString())
+
+
+def export_tflite(grad_model, path, quantization=None, representative_dataset=None):
+    """
+    `quantization`: None (float32), "fp16" (trọng số float16) hoặc "int8" (dynamic range: trọng số int8,
+    activations float). Có `representative_dataset` thì activations int8 cũng được hiệu chuẩn; input/output vẫn float32.
+    """
+    import tensorflow as tf
+
+    with tempfile.TemporaryDirectory() as saved_model_dir:
+        # Keras 3 (tensorflow 2.16): from_keras_model làm converter abort cả process ở BatchNormalization,
+        # nên đi qua SavedModel do Model.export ghi ra
+        grad_model.export(saved_model_dir, verbose=False)
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+        if quantization is not None:
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if quantization == "fp16":
+            converter.target_spec.supported_types = [tf.float16]
+        elif quantization == "int8" and representative_dataset is not None:
+            converter.representative_dataset = representative_dataset
+        payload = converter.convert()
+    _write_atomic(path, payload)
+
+
+class Command(BaseCommand):
+    help = (
+        "Export trọng số của từng AIModel sang ONNX và/hoặc TFLite (output: conv5_block3_out và xác suất) "
+        "kèm file .head.npz để tính Grad-CAM; file được ghi cạnh file trọng số Keras."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model-id", help="Chỉ export model này; bỏ trống để export mọi AIModel")
+        parser.add_argument("--format", nargs="+", choices=sorted(backends.EXPORT_SUFFIXES), default=["onnx", "tflite"])
+        parser.add_argument("--opset", type=int, default=17, help="ONNX opset")
+
+    def handle(self, *args, **options):
+        ai_models = AIModel.objects.filter(base_model__isnull=True)
+        if options["model_id"]:
+            ai_models = ai_models.filter(model_id=options["model_id"])
+        if not ai_models:
+            raise CommandError("Không có AIModel nào để export.")
+
+        for ai_model in ai_models:
+            weights_path = services._weights_path(ai_model)
+            if not os.path.exists(weights_path):
+                self.stderr.write(f"{ai_model}: không tìm thấy {weights_path}, bỏ qua")
+                continue
+
+            model, grad_model = services.build_model(weights_path)
+            save_cam_head(model, backends.head_path(weights_path))
+            for backend in options["format"]:
+                path = backends.exported_path(weights_path, backend)
+                if backend == "onnx":
+                    export_onnx(grad_model, path, options["opset"])
+                else:
+                    export_tflite(grad_model, path)
+                self.stdout.write(f"{ai_model}: {backend} -> {path} ({os.path.getsize(path) / 2**20:.1f} MB)")
+
+        self.stdout.write("Chạy check_backend_parity --activate để kiểm tra và chuyển backend cho model.")
@@ -0,0 +1,162 @@
+import os
+import time
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Exists, OuterRef
+
+from apps.ai_processing import backends, dicom_decode, services
+from apps.ai_processing.management.commands.export_models import export_tflite, save_cam_head
+from apps.ai_processing.models import AIModel
+from apps.ai_processing.preprocessing import PreprocessingEngine
+from apps.uploads.models import DICOMInstance, DICOMStudy
+
+QUANTIZATIONS = ("fp16", "int8")
+
+
+def calibration_slices(studies, max_slices, slices_per_study):
+    """Lấy mẫu các lát (đã tiền xử lý như lúc dự đoán) từ các study đã lưu trên Orthanc, trải đều qua từng study."""
+    engine = PreprocessingEngine(target_size=services.IMG_SIZE, margin=10)
+    mode = settings.AI_DICOM_INTENSITY_MODE
+    samples = []
+    for study in studies:
+        instances = list(study.instances.order_by("created_at").values_list("instance_uid", flat=True))
+        frames = (
+            (kind, image)
+            for _, ds, window in services._iter_study_datasets(instances, mode)
+            for _, kind, image in dicom_decode.iter_frames(ds, mode, window)
+        )
+        for kind, image in islice(frames, min(slices_per_study, max_slices - len(samples))):
+            batch, _ = engine.preprocess(kind, image)
+            samples.append(batch[0].copy())
+        if len(samples) >= max_slices:
+            break
+    return np.stack(samples) if samples else np.zeros((0, services.IMG_SIZE, services.IMG_SIZE, 3), dtype=np.float32)
+
+
+def _predict_in_batches(predict, images, batch_size):
+    outputs, elapsed = [], 0.0
+    for i in range(0, len(images), batch_size):
+        start = time.perf_counter()
+        outputs.append(np.asarray(predict(images[i:i + batch_size])))
+        elapsed += time.perf_counter() - start
+    return np.concatenate(outputs), elapsed
+
+
+def evaluate_variant(reference, candidate):
+    """Độ lệch xác suất theo từng lớp trong CLASS_NAMES và tỉ lệ trùng lớp top-1 của bản lượng tử hoá so với bản gốc."""
+    drift = candidate - reference
+    per_class = {
+        name: {
+            "mean_drift": float(drift[:, i].mean()),
+            "mean_abs_drift": float(np.abs(drift[:, i]).mean()),
+            "max_abs_drift": float(np.abs(drift[:, i]).max()),
+        }
+        for i, name in enumerate(services.CLASS_NAMES)
+    }
+    agreement = float(np.mean(np.argmax(candidate, axis=1) == np.argmax(reference, axis=1)))
+    return {"samples": len(reference), "top1_agreement": agreement, "per_class": per_class}
+
+
+class Command(BaseCommand):
+    help = (
+        "Tạo bản lượng tử hoá float16 / INT8 (dynamic range) của một AIModel dưới dạng TFLite, đánh giá độ lệch "
+        "xác suất trên mẫu lát từ các study đã lưu và đăng ký thành AIModel biến thể (chỉ kích hoạt khi đạt ngưỡng top-1)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model-id", required=True, help="AIModel gốc (fp32)")
+        parser.add_argument("--quantization", nargs="+", choices=QUANTIZATIONS, default=list(QUANTIZATIONS))
+        parser.add_argument("--studies", type=int, default=20, help="Số study lấy mẫu hiệu chuẩn/đánh giá")
+        parser.add_argument("--slices-per-study", type=int, default=16)
+        parser.add_argument("--max-slices", type=int, default=256)
+        parser.add_argument("--batch-size", type=int, default=16)
+        parser.add_argument("--min-agreement", type=float, default=0.98, help="Tỉ lệ trùng top-1 tối thiểu để kích hoạt")
+        parser.add_argument(
+            "--calibrate-activations", action="store_true",
+            help="Dùng mẫu lát làm representative dataset để lượng tử hoá cả activations của bản INT8",
+        )
+        parser.add_argument("--activate", action="store_true", help="Kích hoạt biến thể khi đạt ngưỡng")
+
+    def handle(self, *args, **options):
+        base = AIModel.objects.get(model_id=options["model_id"])
+        if base.base_model_id is not None:
+            raise CommandError(f"{base} đã là một biến thể; hãy lượng tử hoá từ model gốc.")
+        weights_path = services._weights_path(base)
+        if not os.path.exists(weights_path):
+            raise CommandError(f"Không tìm thấy file trọng số {weights_path}.")
+
+        # Exists thay cho join + distinct(): trên PostgreSQL DISTINCT không gộp được khi ORDER BY RANDOM()
+        # được thêm vào SELECT, nên mỗi study lặp lại theo số instance
+        has_instances = Exists(DICOMInstance.objects.filter(study=OuterRef("pk")))
+        studies = DICOMStudy.objects.filter(ready=True).filter(has_instances).order_by("?")[:options["studies"]]
+        images = calibration_slices(studies, options["max_slices"], options["slices_per_study"])
+        if not len(images):
+            raise CommandError("Không có study nào đã lưu để lấy mẫu hiệu chuẩn.")
+        self.stdout.write(f"Mẫu hiệu chuẩn: {len(images)} lát từ {len(studies)} study")
+
+        model, grad_model = services.build_model(weights_path)
+        reference, reference_s = _predict_in_batches(model.predict_on_batch, images, options["batch_size"])
+
+        refused = []
+        root = backends.export_root(weights_path)
+        for quantization in options["quantization"]:
+            path = f"{root}.{quantization}.tflite"
+            representative = None
+            if quantization == "int8" and options["calibrate_activations"]:
+                def representative():
+                    for image in images:
+                        yield [image[np.newaxis]]
+            export_tflite(grad_model, path, quantization, representative)
+            save_cam_head(model, backends.head_path(path))
+
+            runner = backends.TFLiteBackend(path, backends.CamHead.load(backends.head_path(path)), settings.AI_BACKEND_THREADS)
+            candidate, candidate_s = _predict_in_batches(runner.predict, images, options["batch_size"])
+            evaluation = evaluate_variant(reference, candidate)
+            evaluation.update({
+                "min_agreement": options["min_agreement"],
+                "calibrated_activations": representative is not None,
+                "speedup": reference_s / max(candidate_s, 1e-9),
+                "size_mb": os.path.getsize(path) / 2**20,
+            })
+            passed = evaluation["top1_agreement"] >= options["min_agreement"]
+
+            defaults = {
+                "model_name": f"{base.model_name} [{quantization}]",
+                "model_version": base.model_version,
+                "description": f"Bản lượng tử hoá {quantization} của {base.model_name}",
+                "model_path": path.lstrip("/"),
+                "backend": AIModel.Backend.TFLITE,
+                "evaluation": evaluation,
+            }
+            # Biến thể mới luôn bắt đầu ở trạng thái chưa kích hoạt; không đạt ngưỡng thì tắt cả biến thể đang chạy
+            if options["activate"] or not passed:
+                defaults["is_active"] = options["activate"] and passed
+            variant, _ = AIModel.objects.update_or_create(
+                base_model=base,
+                variant=quantization,
+                defaults=defaults,
+                create_defaults={**defaults, "is_active": options["activate"] and passed},
+            )
+            self._report(variant, evaluation)
+            if options["activate"] and not passed:
+                refused.append(quantization)
+
+        if refused:
+            raise CommandError(
+                f"Không kích hoạt {', '.join(refused)}: top-1 khớp dưới ngưỡng {options['min_agreement']:.2%}."
+            )
+
+    def _report(self, variant, evaluation):
+        self.stdout.write(
+            f"{variant.model_name}: top-1 khớp {evaluation['top1_agreement']:.2%}, "
+            f"nhanh hơn {evaluation['speedup']:.2f}x, {evaluation['size_mb']:.1f} MB, "
+            f"{'đang dùng' if variant.is_active else 'chưa kích hoạt'}"
+        )
+        for name, drift in evaluation["per_class"].items():
+            self.stdout.write(
+                f"  {name:<20} drift TB {drift['mean_drift']:+.4f}  |drift| TB {drift['mean_abs_drift']:.4f}  "
+                f"max {drift['max_abs_drift']:.4f}"
+            )
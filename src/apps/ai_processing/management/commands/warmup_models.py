@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from apps.ai_processing import services
+
+
+class Command(BaseCommand):
+    help = "Nạp sẵn toàn bộ AIModel, chạy inference giả và in thời gian nạp của từng model."
+
+    def handle(self, *args, **options):
+        stats = services.warm_up_models()
+        for model_id, metric in stats["per_model"].items():
+            load = metric["last_load_seconds"]
+            warmup = metric["warmup_seconds"]
+            self.stdout.write(
+                f"{model_id}: load={load or 0:.2f}s warmup={warmup or 0:.2f}s size={metric['nbytes'] / 2**20:.1f} MB"
+            )
+        self.stdout.write(f"Tổng: {stats['models']} model, {stats['total_bytes'] / 2**20:.1f} MB")
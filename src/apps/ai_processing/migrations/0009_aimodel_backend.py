@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_processing', '0008_reviewsession_annotated_regions_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aimodel',
+            name='backend',
+            field=models.CharField(choices=[('keras', 'Keras (TensorFlow)'), ('onnx', 'ONNX Runtime'), ('tflite', 'TensorFlow Lite')], default='keras', help_text='Backend inference; onnx/tflite dùng file đã export cạnh file trọng số (lệnh export_models)', max_length=20),
+        ),
+    ]
@@ -0,0 +1,32 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_processing', '0009_aimodel_backend'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aimodel',
+            name='variant',
+            field=models.CharField(choices=[('fp32', 'Float32 (gốc)'), ('fp16', 'Float16'), ('int8', 'INT8 (dynamic range)')], default='fp32', help_text='Độ chính xác số của trọng số', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='aimodel',
+            name='base_model',
+            field=models.ForeignKey(blank=True, help_text='Model gốc mà bản lượng tử hoá này được tạo từ (lệnh quantize_model)', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='ai_processing.aimodel'),
+        ),
+        migrations.AddField(
+            model_name='aimodel',
+            name='is_active',
+            field=models.BooleanField(default=True, help_text='Hiển thị trong danh sách model để dự đoán'),
+        ),
+        migrations.AddField(
+            model_name='aimodel',
+            name='evaluation',
+            field=models.JSONField(blank=True, help_text='Kết quả đánh giá so với model gốc (độ lệch, top-1)', null=True),
+        ),
+    ]
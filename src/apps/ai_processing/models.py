@@ -4,11 +4,32 @@ from django.conf import settings
 from apps.uploads.models import DICOMStudy
 
 class AIModel(models.Model):
+    class Backend(models.TextChoices):
+        KERAS = "keras", "Keras (TensorFlow)"
+        ONNX = "onnx", "ONNX Runtime"
+        TFLITE = "tflite", "TensorFlow Lite"
+
+    class Variant(models.TextChoices):
+        FP32 = "fp32", "Float32 (gốc)"
+        FP16 = "fp16", "Float16"
+        INT8 = "int8", "INT8 (dynamic range)"
+
     model_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     model_name = models.CharField(max_length=255, unique=True, help_text="Tên định danh cho mô hình")
     model_version = models.CharField(max_length=50, help_text="Phiên bản hiện tại của mô hình")
     description = models.TextField(blank=True, help_text="Mô tả chi tiết về mô hình")
     model_path = models.CharField(max_length=1024, help_text="Đường dẫn tương đối đến file trọng số")
+    backend = models.CharField(
+        max_length=20, choices=Backend.choices, default=Backend.KERAS,
+        help_text="Backend inference; onnx/tflite dùng file đã export cạnh file trọng số (lệnh export_models)",
+    )
+    variant = models.CharField(max_length=10, choices=Variant.choices, default=Variant.FP32, help_text="Độ chính xác số của trọng số")
+    base_model = models.ForeignKey(
+        "self", on_delete=models.CASCADE, null=True, blank=True, related_name="variants",
+        help_text="Model gốc mà bản lượng tử hoá này được tạo từ (lệnh quantize_model)",
+    )
+    is_active = models.BooleanField(default=True, help_text="Hiển thị trong danh sách model để dự đoán")
+    evaluation = models.JSONField(null=True, blank=True, help_text="Kết quả đánh giá so với model gốc (độ lệch, top-1)")
     created_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
@@ -0,0 +1,74 @@
+import struct
+
+import numpy as np
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+# Header 16 byte (little-endian) đứng trước buffer pixel của application/x-raw-frame:
+# magic "AIPX" | version (uint8) | dtype code (uint8) | channels (uint16) | rows (uint32) | cols (uint32)
+RAW_FRAME_MAGIC = b"AIPX"
+RAW_FRAME_VERSION = 1
+RAW_FRAME_HEADER = struct.Struct("<4sBBHII")
+RAW_FRAME_DTYPES = {
+    1: np.dtype("<u1"),
+    2: np.dtype("<u2"),
+    3: np.dtype("<i2"),
+    4: np.dtype("<f4"),
+}
+
+
+def pack_raw_frame(pixels):
+    """Đóng gói mảng (rows, cols) hoặc (rows, cols, channels) thành body application/x-raw-frame."""
+    pixels = np.ascontiguousarray(pixels)
+    codes = {dtype: code for code, dtype in RAW_FRAME_DTYPES.items()}
+    code = codes.get(pixels.dtype.newbyteorder("<"))
+    if code is None:
+        raise ValueError(f"dtype không được hỗ trợ: {pixels.dtype}")
+    rows, cols = pixels.shape[:2]
+    channels = pixels.shape[2] if pixels.ndim == 3 else 1
+    header = RAW_FRAME_HEADER.pack(RAW_FRAME_MAGIC, RAW_FRAME_VERSION, code, channels, rows, cols)
+    return header + pixels.astype(RAW_FRAME_DTYPES[code], copy=False).tobytes()
+
+
+def unpack_raw_frame(body):
+    """Mảng pixel từ body application/x-raw-frame (view trên chính `body`, không sao chép); ValueError nếu sai định dạng."""
+    if len(body) < RAW_FRAME_HEADER.size:
+        raise ValueError("Body quá ngắn, thiếu header raw frame.")
+
+    magic, version, code, channels, rows, cols = RAW_FRAME_HEADER.unpack_from(body)
+    if magic != RAW_FRAME_MAGIC or version != RAW_FRAME_VERSION:
+        raise ValueError("Header raw frame không hợp lệ.")
+    dtype = RAW_FRAME_DTYPES.get(code)
+    if dtype is None:
+        raise ValueError(f"Mã dtype không hợp lệ: {code}")
+
+    count = rows * cols * channels
+    if len(body) - RAW_FRAME_HEADER.size != count * dtype.itemsize:
+        raise ValueError("Kích thước buffer không khớp với shape trong header.")
+
+    pixels = np.frombuffer(body, dtype=dtype, count=count, offset=RAW_FRAME_HEADER.size)
+    shape = (rows, cols) if channels == 1 else (rows, cols, channels)
+    return pixels.reshape(shape)
+
+
+class RawFrameParser(BaseParser):
+    """
+    Nhận buffer pixel thô (ví dụ uint16 lấy thẳng từ viewer) kèm header nhỏ mô tả shape/dtype.
+    Pixel được đọc bằng np.frombuffer trên chính body request, không qua base64 hay decode ảnh.
+    """
+    media_type = "application/x-raw-frame"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        body = stream.read() if stream is not None else b""
+        try:
+            return {"pixels": unpack_raw_frame(body)}
+        except ValueError as e:
+            raise ParseError(str(e))
+
+
+class OctetStreamParser(BaseParser):
+    """Nhận nguyên file DICOM/PNG/JPG trong body (application/octet-stream)."""
+    media_type = "application/octet-stream"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return {"image_bytes": stream.read() if stream is not None else b""}
@@ -0,0 +1,154 @@
+import logging
+import time
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PREPROCESS_STAGES = ("normalize", "threshold", "crop", "resize", "mask")
+_MASK_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
+
+
+def otsu_threshold(gray):
+    """Ngưỡng Otsu của ảnh xám uint8; cùng một ảnh nhị phân này dùng cho cả crop lẫn mask."""
+    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return thresh
+
+
+def bbox_from_threshold(thresh, margin=10):
+    """bbox (x, y, w, h) quanh contour lớn nhất của ảnh ngưỡng, nới thêm `margin` (giống crop_brain_region_with_bbox)."""
+    rows, cols = thresh.shape[:2]
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return 0, 0, cols, rows
+    x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+    x0, y0 = max(x - margin, 0), max(y - margin, 0)
+    x2, y2 = min(x + w + margin * 2, cols), min(y + h + margin * 2, rows)
+    return x0, y0, x2 - x0, y2 - y0
+
+
+def brain_mask_from_threshold(thresh):
+    """Mask não kích thước gốc từ ảnh ngưỡng Otsu: đóng hình thái, lấy convex hull của contour lớn nhất."""
+    closed = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, _MASK_KERNEL, iterations=3)
+    contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    mask = np.zeros_like(thresh)
+    if not contours:
+        h, w = thresh.shape[:2]
+        center = (int(w / 2), int(h / 2))
+        axes = (int(w * 0.4), int(h * 0.45))
+        return cv2.ellipse(mask, center, axes, 0, 0, 360, 255, -1)
+    hull = cv2.convexHull(max(contours, key=cv2.contourArea))
+    cv2.drawContours(mask, [hull], -1, 255, thickness=cv2.FILLED)
+    return mask
+
+
+class PreprocessingEngine:
+    """
+    Tiền xử lý frame/ảnh thành input (N, size, size, 3) float32 của model, ghi thẳng vào buffer cấp phát sẵn.
+
+    Frame xám được xử lý một kênh từ đầu tới cuối (normalize -> Otsu -> crop -> resize), chỉ nhân ra
+    3 kênh khi ghi vào buffer; ảnh ngưỡng Otsu được giữ lại để dựng mask não mà không phải tính lại.
+    Kết quả trùng với preprocess_dcm_frame / preprocess_generic_image + create_advanced_brain_mask_full.
+    Buffer được dùng lại giữa các lần gọi nên mỗi thread cần một engine riêng và phải dùng xong batch
+    trước lần gọi kế tiếp.
+    """
+
+    def __init__(self, target_size=224, margin=10, capacity=1):
+        self.target_size = int(target_size)
+        self.margin = int(margin)
+        self._buffer = np.zeros((0, self.target_size, self.target_size, 3), dtype=np.float32)
+        self.timings = dict.fromkeys(PREPROCESS_STAGES, 0.0)
+        self.frames = 0
+        self.reserve(capacity)
+
+    def reserve(self, n):
+        """Đảm bảo buffer chứa được ít nhất `n` ảnh (chỉ cấp phát lại khi cần lớn hơn)."""
+        if n > len(self._buffer):
+            self._buffer = np.zeros((n, self.target_size, self.target_size, 3), dtype=np.float32)
+        return self._buffer
+
+    def batch(self, n):
+        """View (n, size, size, 3) của buffer; không copy."""
+        return self._buffer[:n]
+
+    def _tick(self, stage, start):
+        now = time.perf_counter()
+        self.timings[stage] += now - start
+        return now
+
+    def preprocess_into(self, index, kind, image):
+        """
+        Tiền xử lý một ảnh vào vị trí `index` của buffer. `kind`: "frame" (mảng 2D bất kỳ dtype, kéo giãn min/max),
+        "gray" (ảnh xám uint8 đã áp cửa sổ, dùng nguyên) hoặc "image" (BGR uint8).
+        Trả về info gồm ảnh xám uint8, ảnh ngưỡng, bbox, resize_info và kích thước ảnh gốc.
+        """
+        start = time.perf_counter()
+        if kind == "frame":
+            gray = cv2.normalize(image, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+            source = gray
+        elif kind == "gray":
+            gray = source = image
+        else:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            source = image
+        start = self._tick("normalize", start)
+
+        thresh = otsu_threshold(gray)
+        start = self._tick("threshold", start)
+
+        x, y, w, h = bbox_from_threshold(thresh, self.margin)
+        cropped = source[y:y + h, x:x + w]
+        start = self._tick("crop", start)
+
+        size = self.target_size
+        scale = size / max(h, w)
+        new_w, new_h = int(round(w * scale)), int(round(h * scale))
+        resized = cv2.resize(cropped, (new_w, new_h), interpolation=cv2.INTER_AREA)
+        left, top = (size - new_w) // 2, (size - new_h) // 2
+
+        slot = self.reserve(index + 1)[index]
+        slot.fill(0)
+        region = slot[top:top + new_h, left:left + new_w]
+        if resized.ndim == 2:
+            region[...] = resized[:, :, np.newaxis]
+        else:
+            region[...] = resized
+        self._tick("resize", start)
+        self.frames += 1
+
+        return {
+            "gray": gray,
+            "threshold": thresh,
+            "bbox": (x, y, w, h),
+            "resize_info": {"scale": scale, "left": left, "top": top, "new_w": new_w, "new_h": new_h},
+            "image_width": gray.shape[1],
+            "image_height": gray.shape[0],
+        }
+
+    def preprocess(self, kind, image):
+        """Một ảnh -> (batch (1, size, size, 3), info)."""
+        info = self.preprocess_into(0, kind, image)
+        return self.batch(1), info
+
+    def preprocess_stack(self, frames, kind="frame"):
+        """Stack N frame (N, rows, cols) hoặc list ảnh -> (batch (N, size, size, 3), list info)."""
+        self.reserve(len(frames))
+        infos = [self.preprocess_into(i, kind, frame) for i, frame in enumerate(frames)]
+        return self.batch(len(infos)), infos
+
+    def brain_mask(self, info):
+        """Mask não kích thước gốc, dựng từ ảnh ngưỡng đã tính ở bước crop."""
+        start = time.perf_counter()
+        mask = brain_mask_from_threshold(info["threshold"])
+        self._tick("mask", start)
+        return mask
+
+    def reset_timings(self):
+        self.timings = dict.fromkeys(PREPROCESS_STAGES, 0.0)
+        self.frames = 0
+
+    def timing_report(self):
+        """Thời gian trung bình (ms/frame) của từng stage kể từ lần reset gần nhất."""
+        frames = max(self.frames, 1)
+        return {stage: seconds * 1000 / frames for stage, seconds in self.timings.items()}
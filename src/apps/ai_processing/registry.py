@@ -0,0 +1,221 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+RELOAD_CHECKS = ("mtime", "checksum", "none")
+
+
+def _file_fingerprint(path, reload_check):
+    if reload_check == "none":
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if reload_check == "mtime":
+        return (stat.st_mtime_ns, stat.st_size)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelRegistry:
+    """
+    Cache model theo model_id với chính sách LRU giới hạn bộ nhớ và tự nạp lại khi file trọng số thay đổi.
+
+    `loader(weights_path)` trả về dict entry (ít nhất có "nbytes"), `warmup(entry)` chạy một lần
+    inference giả để trace graph. Mọi entry được trả về dưới dạng dict nên code cũ dùng
+    `_model_cache[key]["main"]` vẫn chạy được.
+
+    Lock chỉ bảo vệ các dict trạng thái: việc nạp model và băm file chạy ngoài lock, nên một lần nạp chậm không
+    chặn tra cứu các model khác. Các request đồng thời cho cùng một key đang nạp chờ chung một Future.
+    """
+
+    def __init__(self, loader, warmup=None, max_bytes=0, reload_check="mtime", reload_interval=5.0):
+        if reload_check not in RELOAD_CHECKS:
+            raise ValueError(f"reload_check không hợp lệ: {reload_check}. Hỗ trợ: {', '.join(RELOAD_CHECKS)}")
+        self._loader = loader
+        self._warmup = warmup
+        self.max_bytes = int(max_bytes)
+        self.reload_check = reload_check
+        self.reload_interval = float(reload_interval)
+        self._entries = OrderedDict()
+        self._meta = {}
+        self._loading = {}
+        self._lock = threading.RLock()
+        self.metrics = {}
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __getitem__(self, key):
+        return self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        return sum(entry.get("nbytes", 0) for entry in self._entries.values())
+
+    def _metric(self, key):
+        return self.metrics.setdefault(key, {
+            "loads": 0,
+            "reloads": 0,
+            "evictions": 0,
+            "hits": 0,
+            "misses": 0,
+            "last_load_seconds": None,
+            "total_load_seconds": 0.0,
+            "warmup_seconds": None,
+            "nbytes": 0,
+        })
+
+    def _check_due(self, meta, weights_path):
+        """Entry cần kiểm tra lại file không; gọi trong lock, việc băm file để cho caller làm ngoài lock."""
+        if meta["weights_path"] != weights_path:
+            return True
+        if self.reload_check == "none":
+            return False
+        now = time.monotonic()
+        if now - meta["checked_at"] < self.reload_interval:
+            return False
+        meta["checked_at"] = now
+        return True
+
+    def _is_stale(self, meta, weights_path):
+        if meta["weights_path"] != weights_path:
+            return True
+        return _file_fingerprint(weights_path, self.reload_check) != meta["fingerprint"]
+
+    def get(self, key, weights_path):
+        with self._lock:
+            metric = self._metric(key)
+            meta = self._meta.get(key)
+            if meta is not None and not self._check_due(meta, weights_path):
+                self._entries.move_to_end(key)
+                metric["hits"] += 1
+                return self._entries[key]
+
+        if meta is not None and not self._is_stale(meta, weights_path):
+            with self._lock:
+                # Entry có thể đã bị giải phóng hoặc nạp lại trong lúc băm file
+                if self._meta.get(key) is meta:
+                    self._entries.move_to_end(key)
+                    metric["hits"] += 1
+                    return self._entries[key]
+            meta = None
+        return self._load_once(key, weights_path, stale=meta)
+
+    def _load_once(self, key, weights_path, stale=None):
+        """Nạp `key` một lần cho mọi thread đang cần; `stale` là meta của entry cũ cần thay (nếu có)."""
+        with self._lock:
+            metric = self._metric(key)
+            meta = self._meta.get(key)
+            if meta is not None and meta is not stale and meta["weights_path"] == weights_path:
+                # Thread khác vừa nạp xong
+                self._entries.move_to_end(key)
+                metric["hits"] += 1
+                return self._entries[key]
+            pending = self._loading.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._loading[key] = Future()
+                pending.weights_path = weights_path
+                metric["misses"] += 1
+                if stale is not None:
+                    logger.info(f"[AI REGISTRY] Trọng số của model {key} đã thay đổi, nạp lại từ {weights_path}")
+                    metric["reloads"] += 1
+
+        if not owner:
+            entry = pending.result()
+            if pending.weights_path != weights_path:
+                return self.get(key, weights_path)
+            return entry
+
+        try:
+            entry = self._load(key, weights_path)
+        except BaseException as exc:
+            with self._lock:
+                self._loading.pop(key, None)
+            pending.set_exception(exc)
+            raise
+        with self._lock:
+            self._loading.pop(key, None)
+        pending.set_result(entry)
+        return entry
+
+    def _load(self, key, weights_path):
+        fingerprint = _file_fingerprint(weights_path, self.reload_check)
+        start = time.perf_counter()
+        entry = self._loader(weights_path)
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            metric = self._metric(key)
+            metric["loads"] += 1
+            metric["last_load_seconds"] = elapsed
+            metric["total_load_seconds"] += elapsed
+            metric["nbytes"] = entry.get("nbytes", 0)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._meta[key] = {"weights_path": weights_path, "fingerprint": fingerprint, "checked_at": time.monotonic()}
+            self._evict_over_budget(keep=key)
+        logger.info(f"[AI REGISTRY] Nạp model {key} trong {elapsed:.2f}s ({metric['nbytes'] / 2**20:.1f} MB)")
+        return entry
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        self._meta.pop(key, None)
+
+    def _evict_over_budget(self, keep):
+        if self.max_bytes <= 0:
+            return
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                break
+            logger.info(f"[AI REGISTRY] Vượt ngân sách bộ nhớ, giải phóng model {oldest}")
+            self._metric(oldest)["evictions"] += 1
+            self._drop(oldest)
+
+    def fingerprint(self, key):
+        """Fingerprint (mtime/size hoặc sha256 theo reload_check) của file đang nạp cho `key`; None nếu chưa nạp."""
+        with self._lock:
+            meta = self._meta.get(key)
+            return None if meta is None else meta["fingerprint"]
+
+    def evict(self, key):
+        with self._lock:
+            self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._meta.clear()
+
+    def warm_up(self, key, weights_path):
+        """Nạp model và chạy một inference giả để trace graph trước request đầu tiên."""
+        entry = self.get(key, weights_path)
+        if self._warmup is not None:
+            start = time.perf_counter()
+            self._warmup(entry)
+            self._metric(key)["warmup_seconds"] = time.perf_counter() - start
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {
+                "models": len(self._entries),
+                "total_bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "per_model": {key: dict(metric) for key, metric in self.metrics.items()},
+            }
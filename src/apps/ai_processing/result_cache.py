@@ -0,0 +1,171 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import redis
+
+logger = logging.getLogger(__name__)
+
+_STATS_KEY = "ai:prediction_cache:stats"
+
+
+class PredictionResultCache:
+    """
+    Cache kết quả dự đoán theo nội dung: khoá = (sha256 dữ liệu pixel đã giải mã, model_id, model_version).
+
+    Dùng Redis (cùng instance với Celery broker) làm kho chính; khi Redis không truy cập được thì
+    ghi/đọc file JSON trong `disk_dir`. Sau một lỗi Redis, cache bỏ qua Redis trong `redis_backoff` giây để
+    mỗi request không phải chờ timeout trong lúc Redis gián đoạn. Số lần hit/miss được đếm trong process và
+    cộng dồn lên Redis theo lô (mỗi `stats_flush_every` lần tra cứu) để xem hit-rate của toàn hệ thống.
+    """
+
+    def __init__(self, redis_url=None, disk_dir=None, ttl=7 * 24 * 3600, redis_backoff=30.0, stats_flush_every=100):
+        self.ttl = int(ttl)
+        self.disk_dir = disk_dir
+        self.redis_backoff = float(redis_backoff)
+        self.stats_flush_every = max(1, int(stats_flush_every))
+        self._redis = redis.Redis.from_url(redis_url, socket_timeout=0.5, socket_connect_timeout=0.5) if redis_url else None
+        self._redis_retry_at = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Số hit/miss chưa cộng lên Redis
+        self._unflushed = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def make_key(pixels, ai_model_obj, *variant):
+        """`variant`: các tham số khác ảnh hưởng tới kết quả lưu (ví dụ định dạng heatmap)."""
+        pixels = np.ascontiguousarray(pixels)
+        digest = hashlib.sha256()
+        digest.update(f"{pixels.dtype.str}{pixels.shape}".encode())
+        digest.update(memoryview(pixels).cast("B"))
+        suffix = "".join(f":{v}" for v in variant)
+        return f"ai:prediction:{ai_model_obj.model_id}:{ai_model_obj.model_version}:{digest.hexdigest()}{suffix}"
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, payload):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        os.makedirs(self.disk_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+    def _redis_available(self):
+        return self._redis is not None and time.monotonic() >= self._redis_retry_at
+
+    def _redis_failed(self, exc, action):
+        self._redis_retry_at = time.monotonic() + self.redis_backoff
+        logger.warning(f"[AI CACHE] Redis lỗi khi {action}, bỏ qua Redis trong {self.redis_backoff:.0f}s: {exc}")
+
+    def get(self, key, validate=None):
+        """
+        Giá trị đã cache hoặc None. `validate(value)` trả về False khi entry không còn dùng được (ví dụ file
+        heatmap đã bị xoá): entry bị xoá khỏi cache và được tính là miss.
+        """
+        value = None
+        if self._redis_available():
+            try:
+                raw = self._redis.get(key)
+                value = json.loads(raw) if raw else None
+            except redis.RedisError as exc:
+                self._redis_failed(exc, "đọc cache (dùng cache trên đĩa)")
+        if value is None:
+            # Các entry được ghi ra đĩa trong lúc Redis gián đoạn
+            value = self._read_disk(key)
+        if value is not None and validate is not None and not validate(value):
+            logger.info(f"[AI CACHE] Entry {key} không còn hợp lệ, xoá khỏi cache")
+            self.delete(key)
+            value = None
+
+        self._record(hit=value is not None)
+        return value
+
+    def delete(self, key):
+        if self._redis_available():
+            try:
+                self._redis.delete(key)
+            except redis.RedisError as exc:
+                self._redis_failed(exc, f"xoá {key}")
+        if self.disk_dir:
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def set(self, key, value):
+        payload = json.dumps(value)
+        if self._redis_available():
+            try:
+                self._redis.set(key, payload, ex=self.ttl)
+                return
+            except redis.RedisError as exc:
+                self._redis_failed(exc, "ghi cache (ghi ra đĩa)")
+        self._write_disk(key, payload)
+
+    def _record(self, hit):
+        field = "hits" if hit else "misses"
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+            self._unflushed[field] += 1
+            due = sum(self._unflushed.values()) >= self.stats_flush_every
+        logger.debug(f"[AI CACHE] {field[:-1]} (hit-rate process: {self.hit_rate:.1%})")
+        if due:
+            self._flush_stats()
+
+    def _flush_stats(self):
+        """Cộng số hit/miss chưa ghi lên Redis trong một round trip; giữ lại để lần sau nếu Redis lỗi."""
+        if not self._redis_available():
+            return
+        with self._lock:
+            pending, self._unflushed = self._unflushed, {"hits": 0, "misses": 0}
+        if not any(pending.values()):
+            return
+        try:
+            pipeline = self._redis.pipeline(transaction=False)
+            for field, count in pending.items():
+                if count:
+                    pipeline.hincrby(_STATS_KEY, field, count)
+            pipeline.execute()
+        except redis.RedisError as exc:
+            with self._lock:
+                for field, count in pending.items():
+                    self._unflushed[field] += count
+            self._redis_failed(exc, "ghi thống kê")
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        stats = {"process": {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate}}
+        self._flush_stats()
+        if self._redis_available():
+            try:
+                shared = {k.decode(): int(v) for k, v in self._redis.hgetall(_STATS_KEY).items()}
+                total = shared.get("hits", 0) + shared.get("misses", 0)
+                stats["global"] = {**shared, "hit_rate": shared.get("hits", 0) / total if total else 0.0}
+            except redis.RedisError as exc:
+                self._redis_failed(exc, "đọc thống kê")
+        return stats
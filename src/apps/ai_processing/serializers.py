@@ -9,7 +9,9 @@ class AIModelSerializer(serializers.ModelSerializer):
             'model_id',
             'model_name',
             'model_version',
-            'description'
+            'description',
+            'backend',
+            'variant'
         ]
 
 class AIReportSerializer(serializers.ModelSerializer):
@@ -1,17 +1,27 @@
 import cv2
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras.models import Model
-from tensorflow.keras.layers import Input, GlobalAveragePooling2D, Dropout, Dense
-from tensorflow.keras.applications import ResNet50
 import pydicom
-from io import BytesIO
 import base64
-from matplotlib import cm
-from scipy.interpolate import griddata
+import json
 import logging
-
-from .models import AIModel
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from django.conf import settings
+
+from config import metrics
+from . import backends, dicom_decode
+from .models import AIModel, AIReport
+from apps.uploads import orthanc
+from .batching import BatchingInferenceEngine
+from .colorize import colorize
+from .interpolation import upsample_cam
+from .preprocessing import PreprocessingEngine, bbox_from_threshold, brain_mask_from_threshold, otsu_threshold
+from .registry import ModelRegistry
+from .result_cache import PredictionResultCache
 
 # --- Logger ---
 logger = logging.getLogger(__name__)
@@ -19,7 +29,22 @@ logger = logging.getLogger(__name__)
 # --- Config ---
 IMG_SIZE = 224
 CLASS_NAMES = ["Mild_Dementia", "Moderate_Dementia", "Non_Dementia", "Very_mild_Dementia"]
-_model_cache = {}
+STUDY_POOLING_MODES = ("mean", "max", "topk")
+# Định dạng heatmap: (đuôi file, MIME type). "gray" là heatmap uint8 một kênh, viewer tự tô màu.
+HEATMAP_FORMATS = {
+    "png": (".png", "image/png"),
+    "webp": (".webp", "image/webp"),
+    "gray": (".png", "image/png"),
+}
+_batching_engine = None
+_batching_engine_lock = threading.Lock()
+_preprocessing = threading.local()
+# Nội dung file .tflite đọc sẵn trong process master trước khi fork: path -> (mtime_ns, size, bytes)
+_preloaded_models = {}
+_backend_threads = 0
+_tuning_profile = None
+# Số process inference chạy song song, do configure_inference_threads ghi lại để đối chiếu với profile autotune
+_inference_workers = 1
 
 
 def crop_brain_region_with_bbox(image, margin=10):
@@ -28,17 +53,8 @@ def crop_brain_region_with_bbox(image, margin=10):
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     else:
         gray = image
-    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    if not contours:
-        h, w = image.shape[:2]
-        return image, (0, 0, w, h)
-    largest_contour = max(contours, key=cv2.contourArea)
-    x, y, w, h = cv2.boundingRect(largest_contour)
-    x0, y0 = max(x - margin, 0), max(y - margin, 0)
-    x2, y2 = min(x + w + margin * 2, image.shape[1]), min(y + h + margin * 2, image.shape[0])
-    cropped = image[y0:y2, x0:x2]
-    return cropped, (x0, y0, x2 - x0, y2 - y0)
+    x, y, w, h = bbox_from_threshold(otsu_threshold(gray), margin)
+    return image[y:y + h, x:x + w], (x, y, w, h)
 
 
 def resize_and_pad_with_info(image, target_size=IMG_SIZE):
@@ -85,27 +101,25 @@ def create_advanced_brain_mask_full(image_array):
         gray = cv2.cvtColor(image_array, cv2.COLOR_BGR2GRAY)
     else:
         gray = image_array.astype(np.uint8)
-    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
-    closed = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=3)
-    contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    if not contours:
-        mask = np.zeros_like(gray)
-        h, w = gray.shape[:2]
-        center = (int(w / 2), int(h / 2))
-        axes = (int(w * 0.4), int(h * 0.45))
-        return cv2.ellipse(mask, center, axes, 0, 0, 360, 255, -1)
-    largest_contour = max(contours, key=cv2.contourArea)
-    hull = cv2.convexHull(largest_contour)
-    mask = np.zeros_like(gray)
-    cv2.drawContours(mask, [hull], -1, 255, thickness=cv2.FILLED)
-    return mask
+    return brain_mask_from_threshold(otsu_threshold(gray))
 
 
-def get_model_and_grad_model(ai_model_obj: AIModel):
-    model_key = str(ai_model_obj.model_id)
-    if model_key in _model_cache:
-        return _model_cache[model_key]["main"], _model_cache[model_key]["grad"]
+def get_preprocessing_engine():
+    """PreprocessingEngine riêng cho mỗi thread (buffer batch được dùng lại giữa các request)."""
+    engine = getattr(_preprocessing, "engine", None)
+    if engine is None:
+        engine = _preprocessing.engine = PreprocessingEngine(target_size=IMG_SIZE, margin=10)
+    return engine
+
+
+def build_model(weights_path=None):
+    """Dựng ResNet50 classifier; nạp trọng số nếu có `weights_path`."""
+    # TensorFlow chỉ được import khi nạp model lần đầu (hoặc lúc warm-up trên inference worker),
+    # web/upload worker và các lệnh manage.py không phải trả chi phí import
+    import tensorflow as tf
+    from tensorflow.keras.applications import ResNet50
+    from tensorflow.keras.layers import Dense, Dropout, GlobalAveragePooling2D, Input
+    from tensorflow.keras.models import Model
 
     inputs = Input(shape=(IMG_SIZE, IMG_SIZE, 3))
     preprocessed_input = tf.keras.applications.resnet50.preprocess_input(inputs)
@@ -117,84 +131,437 @@ def get_model_and_grad_model(ai_model_obj: AIModel):
     outputs = Dense(len(CLASS_NAMES), activation="softmax", name="dense_output")(x)
     model = Model(inputs=inputs, outputs=outputs)
 
-    weights_path = f"/{ai_model_obj.model_path}"
-    model.load_weights(weights_path)
+    if weights_path:
+        model.load_weights(weights_path)
 
     grad_model = Model([model.inputs], [model.get_layer("conv5_block3_out").output, model.output])
-    _model_cache[model_key] = {"main": model, "grad": grad_model}
     return model, grad_model
 
 
-def get_grad_cam_plus_plus(grad_model, img_array, class_index):
-    with tf.GradientTape() as tape:
-        conv_outputs, predictions = grad_model(img_array)
-        loss = predictions[:, class_index]
-    grads = tape.gradient(loss, conv_outputs)
-    guided_grads = (tf.cast(conv_outputs > 0, "float32") * tf.cast(grads > 0, "float32") * grads)
-    weights = tf.reduce_mean(guided_grads, axis=(0, 1, 2))
-    cam = np.dot(conv_outputs[0], weights)
-    cam = np.maximum(cam, 0)
+def make_explainer(grad_model):
+    """
+    Dự đoán và Grad-CAM trong cùng một forward pass.
+    Trả về (probabilities, conv5 activations, gradients theo conv5) cho cả batch; gradient lấy theo lớp
+    `class_index[i]` của từng ảnh, hoặc lớp dự đoán khi giá trị âm (xem run_explainer).
+    """
+    import tensorflow as tf
+
+    @tf.function(input_signature=[
+        tf.TensorSpec([None, IMG_SIZE, IMG_SIZE, 3], tf.float32),
+        tf.TensorSpec([None], tf.int64),
+    ])
+    def explain(img_batch, class_index):
+        with tf.GradientTape() as tape:
+            conv_outputs, predictions = grad_model(img_batch, training=False)
+            class_index = tf.where(class_index < 0, tf.argmax(predictions, axis=-1), class_index)
+            loss = tf.gather(predictions, class_index, axis=1, batch_dims=1)
+        grads = tape.gradient(loss, conv_outputs)
+        return predictions, conv_outputs, grads
+
+    return explain
+
+
+def _model_nbytes(model):
+    return sum(int(np.prod(w.shape)) * np.dtype(getattr(w.dtype, "name", w.dtype)).itemsize for w in model.weights)
+
+
+def load_tuning_profile():
+    """Profile do lệnh autotune_inference ghi ra (dict rỗng nếu chưa chạy autotune hoặc AI_TUNING_PROFILE_PATH rỗng)."""
+    global _tuning_profile
+    if _tuning_profile is None:
+        _tuning_profile = {}
+        if settings.AI_TUNING_PROFILE_PATH:
+            try:
+                with open(settings.AI_TUNING_PROFILE_PATH, "r", encoding="utf-8") as f:
+                    _tuning_profile = json.load(f)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError):
+                logger.warning(f"[AI] Không đọc được profile {settings.AI_TUNING_PROFILE_PATH}, bỏ qua")
+    return _tuning_profile
+
+
+def _profile_matches(profile, workers):
+    """Profile chỉ đúng với cấu hình đã đo: cùng số worker song song và cùng số core."""
+    return profile.get("workers", 1) == workers and profile.get("cpu_count", os.cpu_count()) == os.cpu_count()
+
+
+def configure_inference_threads(intra_op=None, inter_op=None, omp_threads=None, workers=1):
+    """
+    Số thread cho process inference hiện tại. Thứ tự ưu tiên: tham số truyền vào, AI_TF_*_THREADS trong settings,
+    profile của autotune_inference (chỉ khi được đo với cùng số worker và số core), cuối cùng chia đều số core
+    cho `workers` (0 = để runtime tự chọn). TensorFlow đọc TF_NUM_INTRAOP_THREADS/TF_NUM_INTEROP_THREADS khi
+    khởi tạo runtime nên chỉ cần đặt biến môi trường, không phải import TensorFlow; gọi trong mỗi worker sau
+    khi fork, trước inference đầu tiên.
+    """
+    global _backend_threads, _inference_workers
+    _inference_workers = workers
+    profile = load_tuning_profile()
+    if profile and not _profile_matches(profile, workers):
+        logger.warning(
+            f"[AI] Profile autotune được đo với {profile.get('workers', 1)} worker / {profile.get('cpu_count')} core, "
+            f"đang chạy {workers} worker / {os.cpu_count()} core; bỏ qua profile"
+        )
+        profile = {}
+    if intra_op is None:
+        intra_op = settings.AI_TF_INTRA_OP_THREADS or profile.get("intra_op") or (threads_per_worker(workers) if workers > 1 else 0)
+    if inter_op is None:
+        inter_op = settings.AI_TF_INTER_OP_THREADS or profile.get("inter_op") or 0
+    if omp_threads is None:
+        omp_threads = profile.get("omp_num_threads") or intra_op
+
+    if intra_op:
+        os.environ["TF_NUM_INTRAOP_THREADS"] = str(intra_op)
+        _backend_threads = intra_op
+    if inter_op:
+        os.environ["TF_NUM_INTEROP_THREADS"] = str(inter_op)
+    if omp_threads:
+        # OMP_NUM_THREADS đặt sẵn trong môi trường (docker-compose, autotune) được giữ nguyên
+        os.environ.setdefault("OMP_NUM_THREADS", str(omp_threads))
+
+    if "tensorflow" in sys.modules and (intra_op or inter_op):
+        tf = sys.modules["tensorflow"]
+        try:
+            if intra_op:
+                tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+            if inter_op:
+                tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+        except RuntimeError:
+            logger.warning("[AI] TensorFlow đã khởi tạo runtime, không đổi được số thread intra/inter-op")
+    return intra_op, inter_op
+
+
+def study_batch_size():
+    """
+    Số lát mỗi batch khi dự đoán study: AI_STUDY_BATCH_SIZE nếu đặt, không thì theo profile autotune khi profile
+    khớp số worker/số core của process (mặc định 16).
+    """
+    if settings.AI_STUDY_BATCH_SIZE:
+        return settings.AI_STUDY_BATCH_SIZE
+    profile = load_tuning_profile()
+    return (profile.get("batch_size") if _profile_matches(profile, _inference_workers) else None) or 16
+
+
+def threads_per_worker(workers):
+    """Chia đều số core cho `workers` process inference chạy song song."""
+    return max(1, (os.cpu_count() or 1) // max(int(workers), 1))
+
+
+def preload_model_files(ai_models=None):
+    """
+    Đọc sẵn file .tflite của các model đang dùng vào bộ nhớ của process hiện tại (master gunicorn / Celery) để
+    các worker fork ra dùng chung copy-on-write. Model Keras và ONNX không được nạp trước: runtime TensorFlow
+    không an toàn khi fork và ONNX Runtime luôn sao chép trọng số vào session.
+    """
+    if ai_models is None:
+        ai_models = AIModel.objects.filter(is_active=True)
+    for ai_model_obj in ai_models:
+        path = _model_source(ai_model_obj)
+        if backends.backend_for_path(path) != "tflite":
+            continue
+        try:
+            stat = os.stat(path)
+            with open(path, "rb") as f:
+                _preloaded_models[path] = (stat.st_mtime_ns, stat.st_size, f.read())
+        except OSError:
+            logger.warning(f"[AI REGISTRY] Không đọc được {path} để nạp trước")
+    return sum(len(content) for _, _, content in _preloaded_models.values())
+
+
+def _preloaded_content(model_path):
+    """Nội dung nạp sẵn của file, chỉ khi file trên đĩa chưa thay đổi kể từ lúc nạp."""
+    preloaded = _preloaded_models.get(model_path)
+    if preloaded is None:
+        return None
+    try:
+        stat = os.stat(model_path)
+    except OSError:
+        return None
+    mtime_ns, size, content = preloaded
+    return content if (stat.st_mtime_ns, stat.st_size) == (mtime_ns, size) else None
+
+
+def _load_model_entry(model_path):
+    """Entry của registry; "backend" là runner chung (predict/explain) của Keras, ONNX Runtime hoặc TFLite."""
+    if backends.backend_for_path(model_path) != "keras":
+        runner = backends.load_exported(
+            model_path,
+            threads=settings.AI_BACKEND_THREADS or _backend_threads,
+            content=_preloaded_content(model_path),
+        )
+        return {"backend": runner, "nbytes": runner.nbytes}
+
+    model, grad_model = build_model(model_path)
+    explain = make_explainer(grad_model)
+    runner = backends.KerasBackend(
+        model, lambda batch, class_index=None: run_explainer(explain, batch, class_index), nbytes=_model_nbytes(model)
+    )
+    return {"main": model, "grad": grad_model, "explain": explain, "backend": runner, "nbytes": runner.nbytes}
+
+
+def _warm_up_entry(entry):
+    entry["backend"].explain(np.zeros((1, IMG_SIZE, IMG_SIZE, 3), dtype=np.float32))
+
+
+_model_cache = ModelRegistry(
+    _load_model_entry,
+    warmup=_warm_up_entry,
+    max_bytes=settings.AI_MODEL_CACHE_MAX_MB * 2**20,
+    reload_check=settings.AI_MODEL_RELOAD_CHECK,
+    reload_interval=settings.AI_MODEL_RELOAD_INTERVAL,
+)
+
+
+_result_cache = PredictionResultCache(
+    redis_url=settings.AI_RESULT_CACHE_URL,
+    disk_dir=settings.AI_RESULT_CACHE_DIR,
+    ttl=settings.AI_RESULT_CACHE_TTL,
+    redis_backoff=settings.AI_RESULT_CACHE_REDIS_BACKOFF,
+) if settings.AI_RESULT_CACHE_ENABLED else None
+
+
+def _weights_path(ai_model_obj: AIModel):
+    return f"/{ai_model_obj.model_path}"
+
+
+def _model_source(ai_model_obj: AIModel):
+    """File registry nạp cho model: trọng số Keras hoặc file đã export theo `backend`; đổi backend sẽ nạp lại."""
+    return backends.exported_path(_weights_path(ai_model_obj), ai_model_obj.backend)
+
 
-    h, w = cam.shape
-    points = np.array([(i, j) for i in range(h) for j in range(w)])
-    values = cam.flatten()
-    grid_x, grid_y = np.mgrid[0:h - 1:IMG_SIZE * 1j, 0:w - 1:IMG_SIZE * 1j]
+def _weights_fingerprint(ai_model_obj: AIModel):
+    """Fingerprint registry của file model đang nạp ("mtime-size" hoặc sha256), dùng trong khoá cache kết quả."""
+    fingerprint = _model_cache.fingerprint(str(ai_model_obj.model_id))
+    if isinstance(fingerprint, tuple):
+        return "-".join(str(part) for part in fingerprint)
+    return fingerprint or "none"
 
-    smooth_heatmap = griddata(points, values, (grid_x, grid_y), method="cubic", fill_value=0)
+
+def model_cache_stats():
+    return _model_cache.stats()
+
+
+def _keras_model_obj(ai_model_obj: AIModel):
+    """AIModel giữ trọng số Keras: model gốc với biến thể lượng tử hoá (model_path của biến thể là file .tflite)."""
+    return ai_model_obj.base_model if ai_model_obj.base_model_id is not None else ai_model_obj
+
+
+def get_model_and_grad_model(ai_model_obj: AIModel):
+    """
+    Model Keras (main, grad) của đường TensorFlow, không phụ thuộc backend đang chọn cho model;
+    biến thể lượng tử hoá dùng chung model Keras của model gốc.
+    """
+    keras_obj = _keras_model_obj(ai_model_obj)
+    key = str(keras_obj.model_id)
+    if keras_obj.backend != "keras":
+        key = f"{key}:keras"
+    entry = _model_cache.get(key, _weights_path(keras_obj))
+    return entry["main"], entry["grad"]
+
+
+def get_backend(ai_model_obj: AIModel):
+    return _model_cache.get(str(ai_model_obj.model_id), _model_source(ai_model_obj))["backend"]
+
+
+def get_explainer(ai_model_obj: AIModel):
+    """Hàm explain(img_batch, class_index=None) -> list (probabilities, conv_output, grads) của backend đang chọn."""
+    return get_backend(ai_model_obj).explain
+
+
+def warm_up_models(ai_models=None):
+    """Nạp sẵn các model trong bảng AIModel và trace graph bằng một inference giả."""
+    if ai_models is None:
+        ai_models = AIModel.objects.filter(is_active=True)
+    for ai_model_obj in ai_models:
+        try:
+            _model_cache.warm_up(str(ai_model_obj.model_id), _model_source(ai_model_obj))
+        except Exception:
+            logger.exception(f"[AI REGISTRY] Không thể warm-up model {ai_model_obj}")
+    return _model_cache.stats()
+
+
+def get_batching_engine():
+    global _batching_engine
+    if _batching_engine is None:
+        with _batching_engine_lock:
+            if _batching_engine is None:
+                _batching_engine = BatchingInferenceEngine(
+                    max_batch_size=settings.AI_BATCH_MAX_SIZE,
+                    max_wait_ms=settings.AI_BATCH_MAX_WAIT_MS,
+                )
+    return _batching_engine
+
+
+def run_explainer(explain, img_batch, class_index=None):
+    """
+    Chạy explainer trên một batch, trả về list (probabilities, conv_output, grads) theo từng ảnh.
+    `class_index`: lớp cần giải thích cho từng ảnh (int hoặc mảng); None = lớp dự đoán của mỗi ảnh.
+    """
+    import tensorflow as tf
+
+    class_index = np.broadcast_to(np.asarray(-1 if class_index is None else class_index, dtype=np.int64), (len(img_batch),))
+    predictions, conv_outputs, grads = explain(
+        tf.convert_to_tensor(img_batch, dtype=tf.float32), tf.convert_to_tensor(class_index)
+    )
+    return list(zip(predictions.numpy(), conv_outputs.numpy(), grads.numpy()))
+
+
+def explain_and_predict(ai_model_obj: AIModel, img_batch, class_index=None):
+    """
+    Trả về list (probabilities, conv_output, grads) cho từng ảnh trong `img_batch`; gradient theo
+    `class_index` nếu có, không thì theo lớp dự đoán. Khi bật AI_BATCHING_ENABLED, các request đồng thời
+    cho cùng model được gom vào một forward pass (trừ request chỉ định lớp, chạy riêng).
+    """
+    explain = get_explainer(ai_model_obj)
+    if class_index is not None:
+        return explain(img_batch, class_index)
+    if not settings.AI_BATCHING_ENABLED:
+        return explain(img_batch)
+
+    return get_batching_engine().infer(str(ai_model_obj.model_id), img_batch, explain)
+
+
+def raw_grad_cam(conv_output, grads):
+    """Bản đồ Grad-CAM++ kích thước lưới conv5 (h, w) từ activations và gradients của một ảnh."""
+    guided_grads = (conv_output > 0).astype("float32") * (grads > 0).astype("float32") * grads
+    weights = np.mean(guided_grads, axis=(0, 1))
+    cam = np.dot(conv_output, weights)
+    return np.maximum(cam, 0)
+
+
+def upsample_heatmap(cam, interpolation=None):
+    """Nội suy CAM lên IMG_SIZE x IMG_SIZE và chuẩn hoá về [0, 1]."""
+    smooth_heatmap = upsample_cam(cam, IMG_SIZE, mode=interpolation or settings.AI_GRADCAM_INTERPOLATION)
     smooth_heatmap = np.maximum(smooth_heatmap, 0)
     heatmap = (smooth_heatmap - np.min(smooth_heatmap)) / (np.max(smooth_heatmap) - np.min(smooth_heatmap) + 1e-10)
     return heatmap
 
 
-def run_prediction_from_file_bytes(model_id, image_bytes):
-    ai_model_obj = AIModel.objects.get(model_id=model_id)
+def grad_cam_from_activations(conv_output, grads, interpolation=None):
+    """Grad-CAM++ từ activations conv5 (h, w, c) và gradients tương ứng của một ảnh."""
+    return upsample_heatmap(raw_grad_cam(conv_output, grads), interpolation)
 
-    try:
-        ds = pydicom.dcmread(BytesIO(image_bytes))
-        pixel_array = ds.pixel_array
-        image_2d = pixel_array[0] if len(pixel_array.shape) > 2 else pixel_array
-        preprocessed_img_batch, _, original_bgr, bbox, _ = preprocess_dcm_frame(image_2d)
-    except pydicom.errors.InvalidDicomError:
-        image_np = np.frombuffer(image_bytes, np.uint8)
-        image_bgr = cv2.imdecode(image_np, cv2.IMREAD_COLOR)
-        preprocessed_img_batch, _, original_bgr, bbox, _ = preprocess_generic_image(image_bgr)
-
-    model, grad_model = get_model_and_grad_model(ai_model_obj)
-    prediction = model.predict(preprocessed_img_batch)[0]
-    pred_index = int(np.argmax(prediction))
-
-    rows, cols = original_bgr.shape[:2]
-    x, y, w_bbox, h_bbox = bbox
 
-    logger.info(f"[AI DEBUG] Original size: {cols}x{rows}")
-    logger.info(f"[AI DEBUG] BBox: {bbox}")
-    logger.info(f"[AI DEBUG] GradCAM input: {preprocessed_img_batch.shape}")
+def get_grad_cam_plus_plus(grad_model, img_array, class_index, interpolation=None):
+    """Đường hai lượt cũ (forward riêng cho Grad-CAM), giữ lại để đối chiếu với explainer."""
+    import tensorflow as tf
 
-    brain_mask_full = create_advanced_brain_mask_full(original_bgr)
+    with tf.GradientTape() as tape:
+        conv_outputs, predictions = grad_model(img_array)
+        loss = predictions[:, class_index]
+    grads = tape.gradient(loss, conv_outputs)
+    return grad_cam_from_activations(conv_outputs[0].numpy(), grads[0].numpy(), interpolation)
+
+
+def decode_image_bytes(image_bytes):
+    """
+    Giải mã bytes upload: với DICOM chỉ giải mã frame đầu tiên, trả về (kind, image) theo
+    dicom_decode.iter_frames với AI_DICOM_INTENSITY_MODE; ảnh thường trả về ("image", ảnh BGR).
+    """
+    with metrics.stage("decode"):
+        try:
+            ds = dicom_decode.open_dataset(image_bytes)
+            _, kind, image = next(dicom_decode.iter_frames(ds, settings.AI_DICOM_INTENSITY_MODE, indices=[0]))
+            return kind, image
+        except pydicom.errors.InvalidDicomError:
+            image_np = np.frombuffer(image_bytes, np.uint8)
+            image_bgr = cv2.imdecode(image_np, cv2.IMREAD_COLOR)
+            return "image", image_bgr
+
+
+def decode_raw_pixels(pixels):
+    """Pixel thô từ client: mảng 2D (ví dụ uint16) là frame xám, mảng 3 kênh là ảnh BGR."""
+    if pixels.ndim == 2:
+        return "frame", pixels
+    if pixels.ndim == 3 and pixels.shape[2] == 1:
+        return "frame", pixels[:, :, 0]
+    if pixels.ndim == 3 and pixels.shape[2] in (3, 4):
+        image = pixels.astype(np.uint8, copy=False)
+        code = cv2.COLOR_RGBA2BGR if pixels.shape[2] == 4 else cv2.COLOR_RGB2BGR
+        return "image", cv2.cvtColor(image, code)
+    raise ValueError(f"Shape pixel không được hỗ trợ: {pixels.shape}")
+
+
+def run_prediction_from_file_bytes(model_id, image_bytes, heatmap_format=None):
+    ai_model_obj = AIModel.objects.get(model_id=model_id)
+    with metrics.prediction("file", model_id):
+        kind, image = decode_image_bytes(image_bytes)
+        result = run_prediction_on_image(ai_model_obj, kind, image, heatmap_format)
+    _update_metrics_gauges()
+    return result
+
+
+def encode_heatmap(heatmap_on_brain, brain_mask_full, heatmap_format, colormap=None):
+    """Mã hoá heatmap đã mask thành bytes theo `heatmap_format` trong HEATMAP_FORMATS, tô màu bằng LUT của `colormap`."""
+    if heatmap_format == "gray":
+        heatmap_gray = np.uint8(np.clip(heatmap_on_brain, 0, 1) * 255)
+        with metrics.stage("encode"):
+            _, img_encoded = cv2.imencode(".png", heatmap_gray)
+        return img_encoded.tobytes()
+
+    with metrics.stage("colorize"):
+        heatmap_colored_rgba = colorize(heatmap_on_brain, colormap or settings.AI_HEATMAP_COLORMAP)
+        heatmap_colored_rgba[brain_mask_full == 0, 3] = 0
+
+    with metrics.stage("encode"):
+        if heatmap_format == "webp":
+            # Chất lượng > 100 bật chế độ lossless của encoder WebP trong OpenCV
+            _, img_encoded = cv2.imencode(".webp", heatmap_colored_rgba, [cv2.IMWRITE_WEBP_QUALITY, 101])
+        else:
+            _, img_encoded = cv2.imencode(".png", heatmap_colored_rgba)
+    return img_encoded.tobytes()
+
+
+def run_prediction_on_image(ai_model_obj: AIModel, kind, image, heatmap_format=None, class_index=None):
+    """
+    Dự đoán + heatmap cho ảnh đã giải mã bởi decode_image_bytes. Heatmap giải thích lớp `class_index`
+    nếu được chỉ định (ví dụ lớp đã gộp của cả study), không thì lớp dự đoán của chính ảnh này.
+    """
+    heatmap_format = heatmap_format or settings.AI_HEATMAP_FORMAT
+    if heatmap_format not in HEATMAP_FORMATS:
+        raise ValueError(f"Định dạng heatmap không hợp lệ: {heatmap_format}. Hỗ trợ: {', '.join(HEATMAP_FORMATS)}")
+
+    engine = get_preprocessing_engine()
+    with metrics.stage("preprocess"):
+        preprocessed_img_batch, preprocess_info = engine.preprocess(kind, image)
+    bbox = preprocess_info["bbox"]
+
+    with metrics.stage("inference"):
+        prediction, conv_output, grads = explain_and_predict(ai_model_obj, preprocessed_img_batch, class_index)[0]
+    pred_index = int(np.argmax(prediction)) if class_index is None else int(class_index)
+
+    rows, cols = preprocess_info["image_height"], preprocess_info["image_width"]
+    x, y, w_bbox, h_bbox = bbox
 
-    grad_cam_heatmap = get_grad_cam_plus_plus(grad_model, preprocessed_img_batch, pred_index)
+    logger.debug(f"[AI DEBUG] Original size: {cols}x{rows}")
+    logger.debug(f"[AI DEBUG] BBox: {bbox}")
+    logger.debug(f"[AI DEBUG] GradCAM input: {preprocessed_img_batch.shape}")
 
-    # Resize heatmap trực tiếp về bbox
-    if w_bbox <= 0 or h_bbox <= 0:
-        w_bbox, h_bbox = cols, rows
-        x, y = 0, 0
-    resized_heatmap = cv2.resize(grad_cam_heatmap, (w_bbox, h_bbox), interpolation=cv2.INTER_CUBIC)
+    # Mask dựng lại từ ảnh ngưỡng Otsu của bước crop, không threshold lại ảnh gốc
+    with metrics.stage("mask"):
+        brain_mask_full = engine.brain_mask(preprocess_info)
 
-    heatmap_full = np.zeros((rows, cols), dtype=np.float32)
-    x2, y2 = min(x + w_bbox, cols), min(y + h_bbox, rows)
-    heatmap_full[y:y2, x:x2] = resized_heatmap[:y2 - y, :x2 - x]
+    with metrics.stage("gradcam"):
+        cam = raw_grad_cam(conv_output, grads)
+    with metrics.stage("upsample"):
+        grad_cam_heatmap = upsample_heatmap(cam)
 
-    logger.info(f"[AI DEBUG] Heatmap resized to bbox: {w_bbox}x{h_bbox}")
-    logger.info(f"[AI DEBUG] Heatmap pasted at: ({x},{y}) → ({x2},{y2}) on {cols}x{rows}")
+    with metrics.stage("paste"):
+        # Resize heatmap trực tiếp về bbox
+        if w_bbox <= 0 or h_bbox <= 0:
+            w_bbox, h_bbox = cols, rows
+            x, y = 0, 0
+        resized_heatmap = cv2.resize(grad_cam_heatmap, (w_bbox, h_bbox), interpolation=cv2.INTER_CUBIC)
 
-    heatmap_on_brain = heatmap_full * (brain_mask_full / 255.0)
+        heatmap_full = np.zeros((rows, cols), dtype=np.float32)
+        x2, y2 = min(x + w_bbox, cols), min(y + h_bbox, rows)
+        heatmap_full[y:y2, x:x2] = resized_heatmap[:y2 - y, :x2 - x]
+        heatmap_on_brain = heatmap_full * (brain_mask_full / 255.0)
 
-    jet_colormap = cm.get_cmap("jet_r")
-    heatmap_colored_rgba = np.uint8(jet_colormap(heatmap_on_brain) * 255)
-    heatmap_colored_rgba[brain_mask_full == 0, 3] = 0
+    logger.debug(f"[AI DEBUG] Heatmap resized to bbox: {w_bbox}x{h_bbox}")
+    logger.debug(f"[AI DEBUG] Heatmap pasted at: ({x},{y}) → ({x2},{y2}) on {cols}x{rows}")
 
-    _, img_encoded = cv2.imencode(".png", heatmap_colored_rgba)
-    heatmap_base64 = base64.b64encode(img_encoded).decode("utf-8")
+    heatmap_bytes = encode_heatmap(heatmap_on_brain, brain_mask_full, heatmap_format)
 
     prediction_result = {
         "class_index": pred_index,
@@ -206,8 +573,234 @@ def run_prediction_from_file_bytes(model_id, image_bytes):
 
     return {
         "prediction_result": prediction_result,
-        "heatmap_url": f"data:image/png;base64,{heatmap_base64}",
+        "heatmap_bytes": heatmap_bytes,
+        "heatmap_format": heatmap_format,
         "bbox": [int(x), int(y), int(w_bbox), int(h_bbox)],
         "image_width": cols,
         "image_height": rows,
     }
+
+
+def save_prediction_report(study, ai_model_obj: AIModel, service_result):
+    """Ghi heatmap (một lần, dạng bytes) vào MEDIA_ROOT và tạo AIReport cho kết quả của run_prediction_on_image."""
+    extension, _ = HEATMAP_FORMATS[service_result["heatmap_format"]]
+    heatmap_filename = f"heatmaps/{study.study_id}/{uuid.uuid4()}{extension}"
+    heatmap_path = os.path.join(settings.MEDIA_ROOT, heatmap_filename)
+
+    with metrics.stage("write"):
+        os.makedirs(os.path.dirname(heatmap_path), exist_ok=True)
+        with open(heatmap_path, "wb") as f:
+            f.write(service_result["heatmap_bytes"])
+
+    return AIReport.objects.create(
+        study=study,
+        model=ai_model_obj,
+        prediction_result=service_result["prediction_result"],
+        heatmap_image_path=heatmap_filename,
+    )
+
+
+def heatmap_data_uri(heatmap_format, heatmap_bytes=None, heatmap_image_path=None):
+    """Data URI base64 cho heatmap, chỉ dùng khi client yêu cầu trả heatmap inline."""
+    if heatmap_bytes is None:
+        with open(os.path.join(settings.MEDIA_ROOT, heatmap_image_path), "rb") as f:
+            heatmap_bytes = f.read()
+    _, mime_type = HEATMAP_FORMATS[heatmap_format]
+    return f"data:{mime_type};base64,{base64.b64encode(heatmap_bytes).decode('utf-8')}"
+
+
+def _update_metrics_gauges():
+    # Nhiều process: mỗi process tự ghi gauge của mình; một process thì /metrics cập nhật lúc scrape
+    if metrics.MULTIPROCESS:
+        metrics.update_process_gauges(_model_cache.stats())
+
+
+def predict_and_save(study, ai_model_obj: AIModel, kind, image, heatmap_format=None):
+    """
+    Dự đoán (ảnh đã giải mã bởi decode_image_bytes/decode_raw_pixels) rồi lưu AIReport, dùng lại kết quả
+    đã cache nếu cùng dữ liệu pixel đã được chạy với cùng model/version.
+    Trả về (report, service_result); service_result["cached"] cho biết có trúng cache hay không.
+    """
+    with metrics.prediction("frame", ai_model_obj.model_id):
+        result = _predict_and_save(study, ai_model_obj, kind, image, heatmap_format)
+    _update_metrics_gauges()
+    return result
+
+
+def _predict_and_save(study, ai_model_obj: AIModel, kind, image, heatmap_format=None):
+    heatmap_format = heatmap_format or settings.AI_HEATMAP_FORMAT
+
+    cache_key = None
+    if _result_cache is not None:
+        # Nạp (hoặc kiểm tra lại) model trước để khoá gắn với đúng file trọng số đang phục vụ: thay file tại chỗ
+        # thì registry nạp lại và fingerprint đổi theo
+        get_backend(ai_model_obj)
+        cache_key = _result_cache.make_key(
+            image, ai_model_obj, heatmap_format, kind, settings.AI_HEATMAP_COLORMAP, ai_model_obj.backend,
+            settings.AI_GRADCAM_INTERPOLATION, _weights_fingerprint(ai_model_obj),
+        )
+        # Entry trỏ tới file heatmap đã bị xoá được bỏ khỏi cache và tính là miss
+        cached = _result_cache.get(
+            cache_key, validate=lambda value: os.path.exists(os.path.join(settings.MEDIA_ROOT, value["heatmap_image_path"]))
+        )
+        metrics.RESULT_CACHE.labels("hit" if cached else "miss").inc()
+        if cached:
+            report = AIReport.objects.create(
+                study=study,
+                model=ai_model_obj,
+                prediction_result=cached["prediction_result"],
+                heatmap_image_path=cached["heatmap_image_path"],
+            )
+            return report, {**cached, "heatmap_format": heatmap_format, "cached": True}
+
+    service_result = run_prediction_on_image(ai_model_obj, kind, image, heatmap_format)
+    report = save_prediction_report(study, ai_model_obj, service_result)
+
+    if cache_key is not None:
+        _result_cache.set(cache_key, {
+            "prediction_result": service_result["prediction_result"],
+            "bbox": service_result["bbox"],
+            "image_width": service_result["image_width"],
+            "image_height": service_result["image_height"],
+            "heatmap_image_path": report.heatmap_image_path,
+        })
+    return report, {**service_result, "cached": False}
+
+
+def pool_slice_probabilities(probabilities, pooling="mean", top_k=5):
+    """Gộp xác suất từng lát (n, n_classes) thành xác suất của cả study."""
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    if pooling == "mean":
+        pooled = probabilities.mean(axis=0)
+    elif pooling == "max":
+        pooled = probabilities.max(axis=0)
+    elif pooling == "topk":
+        k = max(1, min(int(top_k), len(probabilities)))
+        most_confident = np.argsort(probabilities.max(axis=1))[::-1][:k]
+        pooled = probabilities[most_confident].mean(axis=0)
+    else:
+        raise ValueError(f"Pooling không hợp lệ: {pooling}. Hỗ trợ: {', '.join(STUDY_POOLING_MODES)}")
+    return pooled / pooled.sum()
+
+
+def _iter_study_datasets(instances, intensity_mode):
+    """
+    Sinh (sop_uid, dataset, window) cho từng instance, đọc lần lượt từng instance. Ở chế độ "study" cần cửa sổ
+    cường độ chung trước khi duyệt lát: lượt đầu tải từng instance xuống file tạm và chỉ giữ min/max, lượt hai
+    đọc lại từ đĩa (PixelData không nén được memory-map), nên bộ nhớ không tăng theo số instance của study.
+    """
+    if intensity_mode != "study":
+        for sop_uid in instances:
+            yield sop_uid, dicom_decode.open_dataset(orthanc.fetch_instance_file(sop_uid)), None
+        return
+
+    with tempfile.TemporaryDirectory(prefix="ai-study-") as directory:
+        paths = [os.path.join(directory, f"{i:05d}.dcm") for i in range(len(instances))]
+
+        def spool():
+            for sop_uid, path in zip(instances, paths):
+                with open(path, "wb") as f:
+                    f.write(orthanc.fetch_instance_file(sop_uid))
+                yield dicom_decode.open_dataset(path)
+
+        window = dicom_decode.dataset_window(spool())
+        logger.info(f"[AI STUDY] Cửa sổ cường độ chung của study: {window}")
+        for sop_uid, path in zip(instances, paths):
+            yield sop_uid, dicom_decode.open_dataset(path), window
+
+
+def run_study_prediction(study, ai_model_obj: AIModel, pooling=None, top_k=None, heatmap_format=None, progress=None):
+    """
+    Dự đoán cho toàn bộ study: duyệt mọi DICOMInstance và mọi frame, đưa các lát qua model theo batch,
+    gộp kết quả theo `pooling` và lưu một AIReport duy nhất (kèm kết quả từng lát).
+    Heatmap được tạo cho lát tự tin nhất của lớp được chọn và giải thích chính lớp đó.
+    `progress(done, total)` được gọi sau mỗi instance.
+    """
+    with metrics.prediction("study", ai_model_obj.model_id):
+        result = _run_study_prediction(study, ai_model_obj, pooling, top_k, heatmap_format, progress)
+    _update_metrics_gauges()
+    return result
+
+
+def _run_study_prediction(study, ai_model_obj: AIModel, pooling, top_k, heatmap_format, progress):
+    intensity_mode = settings.AI_DICOM_INTENSITY_MODE
+    pooling = pooling or settings.AI_STUDY_POOLING
+    top_k = top_k or settings.AI_STUDY_TOP_K
+    if pooling not in STUDY_POOLING_MODES:
+        raise ValueError(f"Pooling không hợp lệ: {pooling}. Hỗ trợ: {', '.join(STUDY_POOLING_MODES)}")
+
+    backend = get_backend(ai_model_obj)
+    batch_size = study_batch_size()
+    instances = list(study.instances.order_by("created_at").values_list("instance_uid", flat=True))
+    if not instances:
+        raise ValueError(f"Study {study.study_instance_uid} chưa có instance nào.")
+
+    slices, probabilities = [], []
+    best_per_class = {}
+    pending_meta = []
+    # Các lát được tiền xử lý thẳng vào buffer batch của engine, không np.concatenate
+    engine = get_preprocessing_engine()
+    engine.reserve(batch_size)
+    engine.reset_timings()
+
+    def flush():
+        with metrics.stage("inference_batch"):
+            batch_probs = backend.predict(engine.batch(len(pending_meta)))
+        for (sop_uid, frame_idx, kind, image), probs in zip(pending_meta, batch_probs):
+            slices.append({"sop_instance_uid": sop_uid, "frame": frame_idx})
+            probabilities.append(probs)
+            for class_index, score in enumerate(probs):
+                if score > best_per_class.get(class_index, (-1.0,))[0]:
+                    best_per_class[class_index] = (float(score), kind, image, len(slices) - 1)
+        pending_meta.clear()
+
+    start = time.perf_counter()
+    for done, (sop_uid, ds, window) in enumerate(_iter_study_datasets(instances, intensity_mode), start=1):
+        for frame_idx, kind, image in dicom_decode.iter_frames(ds, intensity_mode, window):
+            with metrics.stage("preprocess"):
+                engine.preprocess_into(len(pending_meta), kind, image)
+            pending_meta.append((sop_uid, frame_idx, kind, image))
+            if len(pending_meta) >= batch_size:
+                flush()
+        if progress is not None:
+            progress(done, len(instances))
+    if pending_meta:
+        flush()
+    elapsed = time.perf_counter() - start
+    stage_ms = ", ".join(f"{stage} {ms:.2f}" for stage, ms in engine.timing_report().items())
+    logger.info(f"[AI STUDY] Tiền xử lý (ms/lát): {stage_ms}")
+
+    pooled = pool_slice_probabilities(probabilities, pooling, top_k)
+    pred_index = int(np.argmax(pooled))
+    _, rep_kind, rep_image, rep_slice = best_per_class[pred_index]
+    representative = run_prediction_on_image(ai_model_obj, rep_kind, rep_image, heatmap_format, class_index=pred_index)
+
+    slices_per_second = len(slices) / elapsed if elapsed > 0 else 0.0
+    logger.info(f"[AI STUDY] {len(slices)} lát từ {len(instances)} instance trong {elapsed:.2f}s ({slices_per_second:.1f} lát/s)")
+
+    prediction_result = {
+        "level": "study",
+        "pooling": pooling,
+        "intensity_mode": intensity_mode,
+        "top_k": top_k if pooling == "topk" else None,
+        "class_index": pred_index,
+        "class_name": CLASS_NAMES[pred_index],
+        "confidence": float(pooled[pred_index]),
+        "all_probabilities": {name: float(prob) for name, prob in zip(CLASS_NAMES, pooled)},
+        "bbox": representative["bbox"],
+        "num_instances": len(instances),
+        "num_slices": len(slices),
+        "slices_per_second": slices_per_second,
+        "representative_slice": slices[rep_slice],
+        "per_slice": [
+            {
+                **slice_info,
+                "class_index": int(np.argmax(probs)),
+                "confidence": float(np.max(probs)),
+                "probabilities": [float(p) for p in probs],
+            }
+            for slice_info, probs in zip(slices, probabilities)
+        ],
+    }
+    report = save_prediction_report(study, ai_model_obj, {**representative, "prediction_result": prediction_result})
+    return report, {**representative, "prediction_result": prediction_result}
@@ -0,0 +1,47 @@
+import logging
+import os
+
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
+from django.conf import settings
+
+from config import metrics
+
+logger = logging.getLogger(__name__)
+
+# Số process con của pool prefork, ghi lại trong process chính trước khi fork
+_pool_size = 1
+
+
+@worker_init.connect
+def preload_models_in_worker_main(sender=None, **kwargs):
+    """Process chính của Celery worker: đọc sẵn file model để các process con dùng chung copy-on-write."""
+    global _pool_size
+    _pool_size = getattr(sender, "concurrency", None) or 1
+    metrics.start_worker_server(settings.METRICS_WORKER_PORT)
+    if not settings.AI_WARMUP_ON_START:
+        return
+    from django.db import connections
+
+    from . import services
+
+    nbytes = services.preload_model_files()
+    connections.close_all()
+    logger.info(f"[AI REGISTRY] Nạp sẵn {nbytes / 2**20:.1f} MB file model trước khi fork {_pool_size} process")
+
+
+@worker_process_init.connect
+def warm_up_models_on_worker_start(**kwargs):
+    """Đặt số thread inference cho process con rồi nạp sẵn các AIModel khi bật AI_WARMUP_ON_START."""
+    from . import services
+
+    services.configure_inference_threads(workers=_pool_size)
+    if not settings.AI_WARMUP_ON_START:
+        return
+
+    stats = services.warm_up_models()
+    logger.info(f"[AI REGISTRY] Warm-up xong {stats['models']} model ({stats['total_bytes'] / 2**20:.1f} MB)")
+
+
+@worker_process_shutdown.connect
+def mark_metrics_process_dead(pid=None, **kwargs):
+    metrics.mark_process_dead(pid or os.getpid())
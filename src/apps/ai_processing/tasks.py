@@ -0,0 +1,91 @@
+# src/apps/ai_processing/tasks.py
+
+import os
+
+from celery import shared_task
+from apps.uploads import orthanc, progress, staging
+from apps.uploads.models import DICOMStudy
+from .models import AIModel
+from .parsers import RAW_FRAME_MAGIC, unpack_raw_frame
+
+
+def _decode_source(source):
+    """(kind, image) từ tham chiếu của views._request_image_source; file staging được xoá sau khi đọc."""
+    from . import services
+
+    if "sop_instance_uid" in source:
+        return services.decode_raw_pixels(orthanc.fetch_frame(source["sop_instance_uid"], source.get("frame", 0)))
+
+    try:
+        with open(staging.staged_path(source["staged_path"]), "rb") as f:
+            body = f.read()
+    finally:
+        staging.release_session(os.path.dirname(source["staged_path"]))
+    if body.startswith(RAW_FRAME_MAGIC):
+        return services.decode_raw_pixels(unpack_raw_frame(body))
+    return services.decode_image_bytes(body)
+
+
+@shared_task(bind=True, track_started=True)
+def run_prediction_task(self, model_id, study_instance_uid, source, heatmap_format=None):
+    """Chạy dự đoán trên inference worker (queue "inference") và lưu AIReport; `source` xem _decode_source."""
+    from . import services
+
+    job_id = self.request.id
+    progress.publish("job", job_id, status="PROCESSING")
+    try:
+        # Giải mã trước để file staging luôn được dọn, kể cả khi study/model không còn
+        kind, image = _decode_source(source)
+        study = DICOMStudy.objects.get(study_instance_uid=study_instance_uid)
+        ai_model = AIModel.objects.get(model_id=model_id)
+
+        report, service_result = services.predict_and_save(study, ai_model, kind, image, heatmap_format)
+    except Exception as exc:
+        progress.publish("job", job_id, status="FAILED", error=str(exc))
+        raise
+
+    result = {
+        "report_id": str(report.report_id),
+        "bbox": service_result.get("bbox"),
+        "image_width": service_result.get("image_width"),
+        "image_height": service_result.get("image_height"),
+        "heatmap_format": service_result["heatmap_format"],
+        "cached": service_result["cached"],
+    }
+    progress.publish("job", job_id, status="COMPLETED", **result)
+    return result
+
+
+@shared_task(bind=True, track_started=True)
+def run_study_prediction_task(self, model_id, study_instance_uid, pooling=None, top_k=None, heatmap_format=None):
+    """Dự đoán cho toàn bộ study (mọi instance, mọi frame) và lưu một AIReport gộp."""
+    from . import services
+
+    job_id = self.request.id
+    progress.publish("job", job_id, status="PROCESSING")
+
+    def report_progress(done, total):
+        self.update_state(state="PROGRESS", meta={"done": done, "total": total})
+        progress.publish("job", job_id, status="PROCESSING", done=done, total=total)
+
+    try:
+        study = DICOMStudy.objects.get(study_instance_uid=study_instance_uid)
+        ai_model = AIModel.objects.get(model_id=model_id)
+
+        report, service_result = services.run_study_prediction(
+            study, ai_model, pooling=pooling, top_k=top_k, heatmap_format=heatmap_format, progress=report_progress
+        )
+    except Exception as exc:
+        progress.publish("job", job_id, status="FAILED", error=str(exc))
+        raise
+
+    result = {
+        "report_id": str(report.report_id),
+        "bbox": service_result.get("bbox"),
+        "image_width": service_result.get("image_width"),
+        "image_height": service_result.get("image_height"),
+        "heatmap_format": service_result["heatmap_format"],
+        "cached": False,
+    }
+    progress.publish("job", job_id, status="COMPLETED", **result)
+    return result
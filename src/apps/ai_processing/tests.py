@@ -1,3 +1,655 @@
-from django.test import TestCase
+import importlib.util
+import os
+import re
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian
+
+from config import metrics
+
+from . import backends, dicom_decode, services
+from .batching import BatchingInferenceEngine
+from .colorize import COLORMAPS, LUT_SIZE, colorize, colormap_lut
+from .preprocessing import PreprocessingEngine
+from .interpolation import upsample_cam
+from .models import AIModel
+from .registry import ModelRegistry
+from .result_cache import PredictionResultCache
+
+
+def _normalize(heatmap):
+    heatmap = np.maximum(heatmap, 0)
+    return (heatmap - np.min(heatmap)) / (np.max(heatmap) - np.min(heatmap) + 1e-10)
+
+
+def _assert_close(actual, expected, rtol=1e-3):
+    """So sánh với sai số tương đối theo biên độ lớn nhất của `expected` (activations/gradients có thang đo khác nhau)."""
+    np.testing.assert_allclose(actual, expected, rtol=rtol, atol=rtol * float(np.max(np.abs(expected))) + 1e-12)
+
+
+class UpsampleCamTests(SimpleTestCase):
+    def test_cubic_matches_griddata(self):
+        """Ma trận Clough-Tocher tính sẵn cho cùng kết quả với griddata(method="cubic") trên CAM ngẫu nhiên."""
+        rng = np.random.default_rng(0)
+        for h, w in ((7, 7), (7, 7), (5, 9)):
+            cam = np.maximum(rng.normal(size=(h, w)), 0)
+            expected = _normalize(upsample_cam(cam, 224, mode="griddata"))
+            actual = _normalize(upsample_cam(cam, 224, mode="cubic"))
+            np.testing.assert_allclose(actual, expected, atol=1e-4)
+
+    def test_separable_modes_keep_shape_and_range(self):
+        cam = np.maximum(np.random.default_rng(1).normal(size=(7, 7)), 0)
+        for mode in ("bicubic", "linear"):
+            heatmap = upsample_cam(cam, 224, mode=mode)
+            self.assertEqual(heatmap.shape, (224, 224))
+            self.assertAlmostEqual(heatmap[0, 0], cam[0, 0])
+            self.assertAlmostEqual(heatmap[-1, -1], cam[-1, -1])
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            upsample_cam(np.zeros((7, 7)), 224, mode="nearest")
+
+
+def _has_module(name):
+    return importlib.util.find_spec(name) is not None
+
+
+
+@unittest.skipUnless(_has_module("matplotlib"), "cần matplotlib")
+class ColorizeTests(SimpleTestCase):
+    """LUT tự dựng phải trùng từng byte với np.uint8(matplotlib cmap(x) * 255), kể cả ở biên các bin."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from matplotlib import colormaps
+
+        cls.colormaps = colormaps
+        bins = np.arange(LUT_SIZE + 1) / LUT_SIZE
+        cls.values = np.concatenate([
+            bins,
+            np.nextafter(bins[1:], 0),
+            np.nextafter(bins[:-1], 1),
+            [-0.5, 1.5],
+            np.random.default_rng(0).random(4096),
+        ])
+
+    def test_lut_matches_matplotlib(self):
+        for name in COLORMAPS:
+            with self.subTest(colormap=name):
+                expected = np.uint8(self.colormaps[name](np.arange(LUT_SIZE)) * 255)
+                np.testing.assert_array_equal(colormap_lut(name), expected)
+
+    def test_colorize_matches_matplotlib_at_bin_edges(self):
+        values = self.values.reshape(-1, 1)
+        for name in COLORMAPS:
+            with self.subTest(colormap=name):
+                np.testing.assert_array_equal(colorize(values, name), np.uint8(self.colormaps[name](values) * 255))
+
+    def test_nan_and_float32_input(self):
+        values = self.values.astype(np.float32)
+        values[::7] = np.nan
+        cmap = self.colormaps["jet_r"]
+        np.testing.assert_array_equal(colorize(values, "jet_r"), np.uint8(cmap(values) * 255))
+
+    def test_invalid_colormap(self):
+        with self.assertRaises(ValueError):
+            colorize(np.zeros((2, 2)), "viridis")
+
+def _native_dataset(stored, bits_stored, signed):
+    """Dataset không nén một frame từ mảng giá trị lưu trữ `stored` (cả các bit cao ngoài BitsStored)."""
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.Rows, ds.Columns = stored.shape
+    ds.SamplesPerPixel = 1
+    ds.BitsAllocated = stored.dtype.itemsize * 8
+    ds.BitsStored = bits_stored
+    ds.HighBit = bits_stored - 1
+    ds.PixelRepresentation = int(signed)
+    ds.PixelData = stored.tobytes()
+    return ds
+
+
+class ReadFrameTests(SimpleTestCase):
+    def test_unsigned_masks_bits_above_bits_stored(self):
+        stored = np.array([[0x0FFF, 0xF123], [0x8000, 0x1001]], dtype=np.uint16)
+        frame = dicom_decode.read_frame(_native_dataset(stored, 12, signed=False))
+        np.testing.assert_array_equal(frame, [[0x0FFF, 0x0123], [0x0000, 0x0001]])
+
+    def test_signed_sign_extends_from_high_bit(self):
+        # 12 bit có dấu: 0x0800 là -2048, 0x0FFF là -1; bit rác phía trên bị bỏ qua
+        stored = np.array([[0x0800, 0x0FFF], [0x07FF, 0x7001]], dtype=np.uint16).view(np.int16)
+        frame = dicom_decode.read_frame(_native_dataset(stored, 12, signed=True))
+        np.testing.assert_array_equal(frame, [[-2048, -1], [2047, 1]])
+
+    def test_full_width_frame_is_not_copied(self):
+        stored = np.arange(4, dtype=np.uint16).reshape(2, 2)
+        frame = dicom_decode.read_frame(_native_dataset(stored, 16, signed=False))
+        self.assertFalse(frame.flags.owndata)
+        np.testing.assert_array_equal(frame, stored)
+
+    def test_window_uses_bits_stored_values(self):
+        stored = np.array([[0xF000, 0xF0FF]], dtype=np.uint16)
+        ds = _native_dataset(stored, 12, signed=False)
+        gray = dicom_decode.apply_window(dicom_decode.read_frame(ds), 1.0, 0.0, (0, 255))
+        np.testing.assert_array_equal(gray, [[0, 255]])
+
+
+def _legacy_preprocess(image_bgr, margin=10, target_size=services.IMG_SIZE):
+    """Đường tiền xử lý trước PreprocessingEngine (crop Otsu trên ảnh BGR, resize + copyMakeBorder), chép nguyên văn."""
+    gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
+    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        h, w = image_bgr.shape[:2]
+        cropped, bbox = image_bgr, (0, 0, w, h)
+    else:
+        x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+        x0, y0 = max(x - margin, 0), max(y - margin, 0)
+        x2, y2 = min(x + w + margin * 2, image_bgr.shape[1]), min(y + h + margin * 2, image_bgr.shape[0])
+        cropped, bbox = image_bgr[y0:y2, x0:x2], (x0, y0, x2 - x0, y2 - y0)
+
+    h, w = cropped.shape[:2]
+    scale = target_size / max(h, w)
+    new_w, new_h = int(round(w * scale)), int(round(h * scale))
+    resized = cv2.resize(cropped, (new_w, new_h), interpolation=cv2.INTER_AREA)
+    left, top = (target_size - new_w) // 2, (target_size - new_h) // 2
+    padded = cv2.copyMakeBorder(
+        resized, top, target_size - new_h - top, left, target_size - new_w - left, cv2.BORDER_CONSTANT, value=[0, 0, 0]
+    )
+    return padded[np.newaxis], bbox, {"scale": scale, "left": left, "top": top, "new_w": new_w, "new_h": new_h}
+
+
+def _legacy_brain_mask(image_bgr):
+    gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
+    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    closed = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7)), iterations=3)
+    contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    mask = np.zeros_like(gray)
+    if not contours:
+        h, w = gray.shape[:2]
+        return cv2.ellipse(mask, (int(w / 2), int(h / 2)), (int(w * 0.4), int(h * 0.45)), 0, 0, 360, 255, -1)
+    cv2.drawContours(mask, [cv2.convexHull(max(contours, key=cv2.contourArea))], -1, 255, thickness=cv2.FILLED)
+    return mask
+
+
+def _synthetic_frames():
+    """Frame giả lập có các trường hợp mà ngưỡng Otsu quyết định crop/mask."""
+    rng = np.random.default_rng(0)
+    size = 160
+
+    def head(center, axes, value, shape=(size, size)):
+        img = np.zeros(shape, dtype=np.uint8)
+        cv2.ellipse(img, center, axes, 0, 0, 360, 1, -1)
+        return img * value
+
+    def uint12(values):
+        return np.clip(rng.normal(40, 15, size=(size, size)) + values, 0, 4095).astype(np.uint16)
+
+    frames = {
+        # Đầu hình elip 12-bit trên nền nhiễu
+        "uint16_head": uint12(head((80, 80), (50, 60), 1800) * rng.uniform(0.7, 1.3, (size, size))),
+        # Hai vùng sáng: contour lớn nhất quyết định bbox
+        "two_blobs": uint12(head((50, 60), (30, 35), 1500) + head((125, 110), (15, 20), 2500)),
+        # Vùng sáng chạm biên: margin bị cắt theo kích thước ảnh
+        "touches_edge": uint12(head((10, 80), (40, 70), 2000)),
+        # Có dấu, giá trị âm; ảnh chữ nhật
+        "int16_signed": (rng.normal(-800, 50, size=(120, 200)) + head((100, 60), (70, 45), 2400, (120, 200))).astype(np.int16),
+        # Ảnh hằng: không có contour, bbox cả ảnh và mask elip mặc định
+        "constant": np.full((size, size), 500, dtype=np.uint16),
+    }
+    return frames
+
+
+class PreprocessingEngineParityTests(SimpleTestCase):
+    """PreprocessingEngine cho cùng batch, bbox, resize_info và mask não như đường tiền xử lý cũ."""
+
+    def _assert_matches_legacy(self, engine, kind, image, legacy_bgr):
+        batch, info = engine.preprocess(kind, image)
+        expected_batch, expected_bbox, expected_resize = _legacy_preprocess(legacy_bgr)
+        np.testing.assert_array_equal(batch, expected_batch.astype(np.float32))
+        self.assertEqual(info["bbox"], expected_bbox)
+        self.assertEqual(info["resize_info"], expected_resize)
+        np.testing.assert_array_equal(engine.brain_mask(info), _legacy_brain_mask(legacy_bgr))
+
+    def test_frames_match_legacy(self):
+        engine = PreprocessingEngine(target_size=services.IMG_SIZE, margin=10)
+        for name, frame in _synthetic_frames().items():
+            with self.subTest(frame=name):
+                normalized = cv2.normalize(frame, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+                self._assert_matches_legacy(engine, "frame", frame, cv2.cvtColor(normalized, cv2.COLOR_GRAY2BGR))
+
+    def test_windowed_gray_and_color_images_match_legacy(self):
+        engine = PreprocessingEngine(target_size=services.IMG_SIZE, margin=10)
+        frame = _synthetic_frames()["two_blobs"]
+        gray = cv2.normalize(frame, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+        self._assert_matches_legacy(engine, "gray", gray, cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR))
+
+        color = np.random.default_rng(1).integers(0, 40, size=(140, 180, 3)).astype(np.uint8)
+        cv2.ellipse(color, (90, 70), (60, 50), 0, 0, 360, (200, 150, 90), -1)
+        self._assert_matches_legacy(engine, "image", color, color)
+
+    def test_stack_matches_single_frames(self):
+        frames = list(_synthetic_frames().values())[:3]
+        engine = PreprocessingEngine(target_size=services.IMG_SIZE, margin=10)
+        batch, infos = engine.preprocess_stack(frames)
+        for frame, row, info in zip(frames, batch, infos):
+            normalized = cv2.normalize(frame, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+            expected_batch, expected_bbox, _ = _legacy_preprocess(cv2.cvtColor(normalized, cv2.COLOR_GRAY2BGR))
+            np.testing.assert_array_equal(row, expected_batch[0].astype(np.float32))
+            self.assertEqual(info["bbox"], expected_bbox)
+
+
+class ExplainerParityTests(SimpleTestCase):
+    """make_explainer (tf.function một lượt) so với đường GradientTape eager cũ, trên ResNet50 trọng số ngẫu nhiên."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.model, cls.grad_model = services.build_model()
+        # staticmethod: tf.function có __get__ nên gán thẳng lên class sẽ bị bind `self`
+        cls.explain = staticmethod(services.make_explainer(cls.grad_model))
+        size = services.IMG_SIZE
+        cls.images = np.random.default_rng(0).integers(0, 256, size=(4, size, size, 3)).astype(np.float32)
+
+    def _eager(self, img, class_index=None):
+        import tensorflow as tf
+
+        with tf.GradientTape() as tape:
+            conv_outputs, predictions = self.grad_model(img[np.newaxis])
+            loss = predictions[:, int(np.argmax(predictions[0])) if class_index is None else class_index]
+        grads = tape.gradient(loss, conv_outputs)
+        return predictions[0].numpy(), conv_outputs[0].numpy(), grads[0].numpy()
+
+    def test_batch_matches_eager_path(self):
+        results = services.run_explainer(self.explain, self.images)
+        self.assertEqual(len(results), len(self.images))
+        for img, (probs, conv_output, grads) in zip(self.images, results):
+            expected_probs, expected_conv, expected_grads = self._eager(img)
+            np.testing.assert_allclose(probs, expected_probs, atol=1e-5)
+            self.assertEqual(int(np.argmax(probs)), int(np.argmax(expected_probs)))
+            _assert_close(conv_output, expected_conv)
+            _assert_close(grads, expected_grads)
+
+    def test_explicit_class_index(self):
+        """Gradient theo lớp được chỉ định (ví dụ lớp gộp của study) thay vì lớp dự đoán của từng ảnh."""
+        class_index = np.arange(len(self.images)) % len(services.CLASS_NAMES)
+        results = services.run_explainer(self.explain, self.images, class_index)
+        for img, index, (_, _, grads) in zip(self.images, class_index, results):
+            _assert_close(grads, self._eager(img, int(index))[2])
+
+    def test_probabilities_match_model_predict(self):
+        probs = np.stack([p for p, _, _ in services.run_explainer(self.explain, self.images)])
+        np.testing.assert_allclose(probs, self.model.predict_on_batch(self.images), atol=1e-5)
+
+
+class CamHeadTests(SimpleTestCase):
+    """Gradient numpy của CamHead so với tf.GradientTape trên phần đầu GAP -> Dense(relu) -> Dense(softmax) nhỏ."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = np.random.default_rng(0)
+        channels, hidden, classes = 16, 8, 4
+        cls.weights = (
+            rng.normal(size=(channels, hidden)).astype(np.float32),
+            rng.normal(size=hidden).astype(np.float32),
+            rng.normal(size=(hidden, classes)).astype(np.float32),
+            rng.normal(size=classes).astype(np.float32),
+        )
+        cls.conv = rng.normal(size=(3, 5, 5, channels)).astype(np.float32)
+
+    def _tape(self, class_index=None):
+        import tensorflow as tf
+
+        w1, b1, w2, b2 = (tf.constant(w) for w in self.weights)
+        conv = tf.constant(self.conv)
+        with tf.GradientTape() as tape:
+            tape.watch(conv)
+            hidden = tf.nn.relu(tf.reduce_mean(conv, axis=(1, 2)) @ w1 + b1)
+            probs = tf.nn.softmax(hidden @ w2 + b2)
+            if class_index is None:
+                class_index = tf.argmax(probs, axis=-1)
+            loss = tf.gather(probs, class_index, axis=1, batch_dims=1)
+        return probs.numpy(), tape.gradient(loss, conv).numpy()
+
+    def test_gradients_match_gradient_tape(self):
+        probs, expected = self._tape()
+        _assert_close(backends.CamHead(*self.weights).gradients(self.conv, probs), expected)
+
+    def test_gradients_for_explicit_class(self):
+        class_index = np.array([0, 2, 3])
+        probs, expected = self._tape(class_index)
+        _assert_close(backends.CamHead(*self.weights).gradients(self.conv, probs, class_index), expected)
+
+    def test_save_load_roundtrip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "model.head.npz")
+            backends.CamHead(*self.weights).save(path)
+            head = backends.CamHead.load(path)
+        probs, expected = self._tape()
+        _assert_close(head.gradients(self.conv, probs), expected)
+
+
+class ExportedBackendParityTests(SimpleTestCase):
+    """
+    Backend export (ONNX/TFLite) so với đường Keras trên ResNet50 trọng số ngẫu nhiên, cùng ngưỡng mặc định
+    của check_backend_parity. Bỏ qua khi thiếu runtime/converter tương ứng.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from .management.commands.export_models import save_cam_head
+
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.weights_path = os.path.join(cls.tmp.name, "model.weights.h5")
+        cls.model, cls.grad_model = services.build_model()
+        save_cam_head(cls.model, backends.head_path(cls.weights_path))
+        size = services.IMG_SIZE
+        cls.images = np.random.default_rng(0).integers(0, 256, size=(3, size, size, 3)).astype(np.float32)
+        cls.reference = services.run_explainer(services.make_explainer(cls.grad_model), cls.images)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+        super().tearDownClass()
+
+    def _assert_matches_keras(self, backend):
+        runner = backends.load_exported(backends.exported_path(self.weights_path, backend))
+        candidate = runner.explain(self.images)
+        np.testing.assert_allclose(runner.predict(self.images), np.stack([r[0] for r in self.reference]), atol=1e-4)
+        for (ref_probs, ref_conv, ref_grads), (probs, conv, grads) in zip(self.reference, candidate):
+            np.testing.assert_allclose(probs, ref_probs, atol=1e-4)
+            self.assertEqual(int(np.argmax(probs)), int(np.argmax(ref_probs)))
+            np.testing.assert_allclose(
+                services.grad_cam_from_activations(conv, grads),
+                services.grad_cam_from_activations(ref_conv, ref_grads),
+                atol=1e-2,
+            )
+
+    @unittest.skipUnless(_has_module("tflite_runtime") or _has_module("tensorflow"), "cần tflite-runtime hoặc tensorflow")
+    def test_tflite_matches_keras(self):
+        from .management.commands.export_models import export_tflite
+
+        export_tflite(self.grad_model, backends.exported_path(self.weights_path, "tflite"))
+        self._assert_matches_keras("tflite")
+
+    @unittest.skipUnless(_has_module("onnxruntime") and _has_module("tf2onnx"), "cần onnxruntime và tf2onnx")
+    def test_onnx_matches_keras(self):
+        from .management.commands.export_models import export_onnx
+
+        export_onnx(self.grad_model, backends.exported_path(self.weights_path, "onnx"))
+        self._assert_matches_keras("onnx")
+
+
+@override_settings(AI_TF_INTRA_OP_THREADS=0, AI_TF_INTER_OP_THREADS=0, AI_STUDY_BATCH_SIZE=0)
+class TuningProfileTests(SimpleTestCase):
+    profile = {"intra_op": 3, "inter_op": 2, "omp_num_threads": 3, "batch_size": 24, "workers": 2, "cpu_count": 8}
+
+    def setUp(self):
+        for patcher in (
+            mock.patch.dict(os.environ),
+            mock.patch.object(services, "_tuning_profile", dict(self.profile)),
+            mock.patch.object(services, "_inference_workers", 1),
+            mock.patch.object(services, "_backend_threads", 0),
+            mock.patch.object(services.os, "cpu_count", return_value=8),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_matching_profile_is_applied(self):
+        self.assertEqual(services.configure_inference_threads(workers=2), (3, 2))
+        self.assertEqual(services.study_batch_size(), 24)
+
+    def test_profile_from_other_worker_count_is_ignored(self):
+        with self.assertLogs("apps.ai_processing.services", "WARNING"):
+            self.assertEqual(services.configure_inference_threads(workers=4), (2, 0))
+        self.assertEqual(services.study_batch_size(), 16)
+
+    def test_profile_from_other_core_count_is_ignored(self):
+        services.os.cpu_count.return_value = 16
+        with self.assertLogs("apps.ai_processing.services", "WARNING"):
+            self.assertEqual(services.configure_inference_threads(workers=2), (8, 0))
+        self.assertEqual(services.study_batch_size(), 16)
+
+    @override_settings(AI_TF_INTRA_OP_THREADS=5, AI_STUDY_BATCH_SIZE=12)
+    def test_explicit_settings_override_mismatched_profile(self):
+        with self.assertLogs("apps.ai_processing.services", "WARNING"):
+            self.assertEqual(services.configure_inference_threads(workers=4), (5, 0))
+        self.assertEqual(services.study_batch_size(), 12)
+        self.assertEqual(services.configure_inference_threads(intra_op=6, inter_op=1, workers=4), (6, 1))
+
+
+class _RecordingRunner:
+    """Runner giả: nhân đôi từng dòng và ghi lại kích thước các batch đã chạy."""
+
+    def __init__(self, factor=2):
+        self.factor = factor
+        self.batches = []
+
+    def __call__(self, batch):
+        self.batches.append(len(batch))
+        return list(batch * self.factor)
+
+
+class BatchingEngineTests(SimpleTestCase):
+    def _submit_all(self, engine, requests):
+        # max_wait đủ dài để mọi request vào hàng đợi trước khi worker chốt batch đầu tiên
+        futures = [engine.submit("m", inputs, runner) for inputs, runner in requests]
+        return [future.result(5) for future in futures]
+
+    def test_results_are_scattered_in_request_order(self):
+        engine = BatchingInferenceEngine(max_batch_size=8, max_wait_ms=200)
+        runner = _RecordingRunner()
+        inputs = [np.arange(n, dtype=np.float32)[:, None] + 10 * i for i, n in enumerate((1, 3, 2))]
+        results = self._submit_all(engine, [(x, runner) for x in inputs])
+        self.assertEqual(runner.batches, [6])
+        for x, result in zip(inputs, results):
+            np.testing.assert_array_equal(np.stack(result), x * 2)
+
+    def test_request_that_does_not_fit_waits_for_next_batch(self):
+        engine = BatchingInferenceEngine(max_batch_size=4, max_wait_ms=200)
+        runner = _RecordingRunner()
+        inputs = [np.full((n, 1), n, dtype=np.float32) for n in (3, 2, 1)]
+        results = self._submit_all(engine, [(x, runner) for x in inputs])
+        self.assertEqual(runner.batches, [4, 2])
+        for x, result in zip(inputs, results):
+            np.testing.assert_array_equal(np.stack(result), x * 2)
+
+    def test_oversized_request_is_split(self):
+        engine = BatchingInferenceEngine(max_batch_size=4, max_wait_ms=0)
+        runner = _RecordingRunner()
+        x = np.arange(10, dtype=np.float32)[:, None]
+        np.testing.assert_array_equal(np.stack(engine.infer("m", x, runner, timeout=5)), x * 2)
+        self.assertEqual(runner.batches, [4, 4, 2])
+
+    def test_requests_run_on_their_own_runner(self):
+        engine = BatchingInferenceEngine(max_batch_size=8, max_wait_ms=200)
+        double, triple = _RecordingRunner(2), _RecordingRunner(3)
+        x = np.ones((1, 1), dtype=np.float32)
+        results = self._submit_all(engine, [(x, double), (x, triple), (x, double)])
+        self.assertEqual([float(r[0][0]) for r in results], [2.0, 3.0, 2.0])
+        self.assertEqual(double.batches, [2])
+        self.assertEqual(triple.batches, [1])
+
+    def test_errors_fan_out_to_every_request_in_batch(self):
+        engine = BatchingInferenceEngine(max_batch_size=8, max_wait_ms=200)
+
+        def failing(batch):
+            raise RuntimeError("boom")
+
+        with self.assertLogs("apps.ai_processing.batching", "ERROR"):
+            futures = [engine.submit("m", np.zeros((1, 1)), failing) for _ in range(3)]
+            for future in futures:
+                with self.assertRaisesMessage(RuntimeError, "boom"):
+                    future.result(5)
+        # Worker vẫn chạy tiếp sau lỗi
+        self.assertEqual(len(engine.infer("m", np.zeros((2, 1)), _RecordingRunner(), timeout=5)), 2)
+
+
+class PredictionResultCacheTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache = PredictionResultCache(redis_url="redis://localhost:6379/0", disk_dir=tmp.name, stats_flush_every=3)
+        self.cache._redis = mock.MagicMock()
+
+    def test_redis_is_skipped_after_error(self):
+        import redis
+
+        self.cache._redis.get.side_effect = redis.ConnectionError("down")
+        with self.assertLogs("apps.ai_processing.result_cache", "WARNING"):
+            self.assertIsNone(self.cache.get("k"))
+        self.cache.set("k", {"v": 1})
+        self.assertEqual(self.cache.get("k"), {"v": 1})
+        for _ in range(3):
+            self.cache.get("k")
+        # Chỉ một round trip Redis (lần lỗi đầu tiên) trong cả chuỗi get/set/thống kê
+        self.assertEqual(self.cache._redis.get.call_count, 1)
+        self.cache._redis.set.assert_not_called()
+        self.cache._redis.pipeline.assert_not_called()
+
+        self.cache._redis_retry_at = 0.0
+        self.cache._redis.get.side_effect = None
+        self.cache._redis.get.return_value = b'{"v": 2}'
+        self.assertEqual(self.cache.get("k"), {"v": 2})
+
+    def test_stats_are_flushed_in_batches(self):
+        self.cache._redis.get.return_value = None
+        self.cache.get("a")
+        self.cache.get("b")
+        self.cache._redis.pipeline.assert_not_called()
+        self.cache.get("c")
+        pipeline = self.cache._redis.pipeline.return_value
+        pipeline.hincrby.assert_called_once_with("ai:prediction_cache:stats", "misses", 3)
+        pipeline.execute.assert_called_once()
+        self.cache._redis.hincrby.assert_not_called()
+
+    def test_key_changes_with_variant(self):
+        pixels = np.zeros((4, 4), dtype=np.uint8)
+        model = mock.Mock(model_id="m", model_version="1")
+        keys = {
+            PredictionResultCache.make_key(pixels, model, "png", "cubic", "1-2"),
+            PredictionResultCache.make_key(pixels, model, "png", "linear", "1-2"),
+            PredictionResultCache.make_key(pixels, model, "png", "cubic", "3-2"),
+        }
+        self.assertEqual(len(keys), 3)
+
+
+class ModelRegistryTests(SimpleTestCase):
+    def test_concurrent_gets_load_once(self):
+        calls = []
+        release = threading.Event()
+
+        def loader(path):
+            calls.append(path)
+            release.wait(5)
+            return {"path": path, "nbytes": 1}
+
+        registry = ModelRegistry(loader, reload_check="none")
+        with ThreadPoolExecutor(4) as pool:
+            futures = [pool.submit(registry.get, "a", "/a") for _ in range(4)]
+            release.set()
+            entries = [f.result(5) for f in futures]
+        self.assertEqual(calls, ["/a"])
+        self.assertTrue(all(entry is entries[0] for entry in entries))
+
+    def test_slow_load_does_not_block_other_models(self):
+        started, release = threading.Event(), threading.Event()
+
+        def loader(path):
+            if path == "/slow":
+                started.set()
+                release.wait(5)
+            return {"path": path, "nbytes": 1}
+
+        registry = ModelRegistry(loader, reload_check="none")
+        with ThreadPoolExecutor(1) as pool:
+            slow = pool.submit(registry.get, "slow", "/slow")
+            self.assertTrue(started.wait(5))
+            self.assertEqual(registry.get("fast", "/fast")["path"], "/fast")
+            release.set()
+            self.assertEqual(slow.result(5)["path"], "/slow")
+
+    def test_fingerprint_follows_loaded_file(self):
+        with tempfile.NamedTemporaryFile() as f:
+            registry = ModelRegistry(lambda path: {"path": path, "nbytes": 1}, reload_check="mtime", reload_interval=0)
+            self.assertIsNone(registry.fingerprint("a"))
+            registry.get("a", f.name)
+            before = registry.fingerprint("a")
+            f.write(b"new weights")
+            f.flush()
+            registry.get("a", f.name)
+            self.assertNotEqual(registry.fingerprint("a"), before)
+
+    def test_path_change_reloads(self):
+        registry = ModelRegistry(lambda path: {"path": path, "nbytes": 1}, reload_check="none")
+        self.assertEqual(registry.get("a", "/v1")["path"], "/v1")
+        self.assertEqual(registry.get("a", "/v2")["path"], "/v2")
+        self.assertEqual(registry.stats()["per_model"]["a"]["reloads"], 1)
+
+    def test_failed_load_propagates_to_waiters(self):
+        release = threading.Event()
+
+        def loader(path):
+            release.wait(5)
+            raise OSError("missing")
+
+        registry = ModelRegistry(loader, reload_check="none")
+        with ThreadPoolExecutor(2) as pool:
+            futures = [pool.submit(registry.get, "a", "/a") for _ in range(2)]
+            release.set()
+            for future in futures:
+                with self.assertRaises(OSError):
+                    future.result(5)
+        self.assertNotIn("a", registry)
+
+
+class KerasModelResolutionTests(SimpleTestCase):
+    """Biến thể lượng tử hoá (model_path là .tflite) phải lấy model Keras từ trọng số của model gốc."""
+
+    def setUp(self):
+        self.base = AIModel(model_name="base", model_path="models/base.keras", backend=AIModel.Backend.ONNX)
+        self.variant = AIModel(
+            model_name="base [int8]", model_path="models/base.int8.tflite", backend=AIModel.Backend.TFLITE,
+            variant=AIModel.Variant.INT8, base_model=self.base,
+        )
+        self.registry = mock.Mock()
+        self.registry.get.return_value = {"main": "main", "grad": "grad"}
+
+    def test_variant_uses_base_weights(self):
+        with mock.patch.object(services, "_model_cache", self.registry):
+            self.assertEqual(services.get_model_and_grad_model(self.variant), ("main", "grad"))
+            services.get_model_and_grad_model(self.base)
+        # Cùng khoá và file với model gốc: biến thể không nạp thêm bản Keras thứ hai
+        self.assertEqual(
+            self.registry.get.call_args_list,
+            [mock.call(f"{self.base.model_id}:keras", "/models/base.keras")] * 2,
+        )
+
+    def test_plain_model_keeps_own_weights(self):
+        self.base.backend = AIModel.Backend.KERAS
+        with mock.patch.object(services, "_model_cache", self.registry):
+            services.get_model_and_grad_model(self.base)
+        self.registry.get.assert_called_once_with(str(self.base.model_id), "/models/base.keras")
+
+
+class MetricsStageTests(SimpleTestCase):
+    def test_pipeline_stages_are_declared(self):
+        """Mọi stage("...") trong services đều nằm trong PREDICTION_STAGES, tên lạ bị từ chối."""
+        with open(services.__file__) as f:
+            used = set(re.findall(r'stage\("(\w+)"\)', f.read()))
+        self.assertTrue(used)
+        self.assertLessEqual(used, set(metrics.PREDICTION_STAGES))
+        with self.assertRaises(ValueError):
+            metrics.stage("infer")
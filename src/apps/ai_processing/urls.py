@@ -3,7 +3,10 @@ from . import views
 from .views import (
     api_test_page,
     ai_model_list_api,
-    predict_from_frame_api
+    predict_from_frame_api,
+    predict_study_api,
+    prediction_events,
+    prediction_status,
 )
 
 app_name = 'ai_processing'
@@ -15,6 +18,15 @@ urlpatterns = [
     # API endpoint để nhận frame ảnh từ OHIF và dự đoán
     path('predict-frame/', predict_from_frame_api, name='predict_frame'),
 
+    # API endpoint dự đoán cho cả study (mọi instance/frame), chạy bất đồng bộ trên inference worker
+    path('predict-study/', predict_study_api, name='predict_study'),
+
+    # API endpoint kiểm tra trạng thái job dự đoán bất đồng bộ (predict-frame với async=true)
+    path('predict-frame/status/<uuid:job_id>/', prediction_status, name='prediction_status'),
+
+    # Server-Sent Events: tiến độ job dự đoán được đẩy qua Redis pub/sub thay cho việc poll
+    path('predict-frame/status/<uuid:job_id>/events/', prediction_events, name='prediction_events'),
+
     # URL cho trang test (nếu bạn vẫn cần)
     path('test/', api_test_page, name='api_test_page'),
     path("ai/save-review/", views.save_review, name="save_review"),
@@ -1,8 +1,13 @@
 import base64
 import uuid
-import os
+
+import requests
+from celery.result import AsyncResult
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
 from django.shortcuts import render
+from django.urls import reverse
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -12,54 +17,150 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import api_view, permission_classes
 
 from . import services
+from .parsers import OctetStreamParser, RawFrameParser, pack_raw_frame
+from .tasks import run_prediction_task, run_study_prediction_task
 from .serializers import AIReportSerializer, AIModelSerializer, ReviewSessionSerializer
 from .models import AIModel, AIReport, ReviewSession
+from apps.uploads import orthanc, progress, staging
 from apps.uploads.models import DICOMStudy
 
 
+def _param(request, key):
+    """Tham số lấy từ body (JSON/multipart) hoặc query string (khi body là dữ liệu nhị phân)."""
+    value = request.data.get(key) if hasattr(request.data, "get") else None
+    return value or request.query_params.get(key)
+
+
+def _decode_request_image(request):
+    """
+    Trả về (kind, image) từ một trong các kiểu ingestion:
+    `sopInstanceUID` (+ `frameNumber`, đánh số từ 0) để server tự lấy frame từ Orthanc,
+    application/x-raw-frame (pixel thô + header), application/octet-stream hoặc multipart `imageFile`
+    (file DICOM/PNG), hoặc JSON `imageData` (data URI base64). Trả về None nếu request không có ảnh.
+    """
+    sop_instance_uid = _param(request, "sopInstanceUID")
+    if sop_instance_uid:
+        frame_number = int(_param(request, "frameNumber") or 0)
+        return services.decode_raw_pixels(orthanc.fetch_frame(sop_instance_uid, frame_number))
+
+    data = request.data
+    if "pixels" in data:
+        return services.decode_raw_pixels(data["pixels"])
+    if "image_bytes" in data:
+        return services.decode_image_bytes(data["image_bytes"])
+    image_file = request.FILES.get("imageFile")
+    if image_file is not None:
+        return services.decode_image_bytes(image_file.read())
+    image_data_uri = data.get("imageData")
+    if image_data_uri:
+        header, encoded = image_data_uri.split(",", 1)
+        return services.decode_image_bytes(base64.b64decode(encoded))
+    return None
+
+
+def _has_request_image(request):
+    data = request.data
+    return bool(_param(request, "sopInstanceUID") or request.FILES.get("imageFile") or data.get("imageData")) or (
+        "pixels" in data or "image_bytes" in data
+    )
+
+
+def _request_image_source(request):
+    """
+    Tham chiếu tới ảnh của request cho job bất đồng bộ, để message Celery không phải mang pixel đã giải mã:
+    frame trên Orthanc ({"sop_instance_uid", "frame"}) hoặc body ảnh ghi vào thư mục staging ({"staged_path"}).
+    Inference worker tự lấy và giải mã (tasks._decode_source).
+    """
+    sop_instance_uid = _param(request, "sopInstanceUID")
+    if sop_instance_uid:
+        return {"sop_instance_uid": sop_instance_uid, "frame": int(_param(request, "frameNumber") or 0)}
+
+    data = request.data
+    if "pixels" in data:
+        content = ContentFile(pack_raw_frame(data["pixels"]))
+    elif "image_bytes" in data:
+        content = ContentFile(data["image_bytes"])
+    elif request.FILES.get("imageFile") is not None:
+        content = request.FILES["imageFile"]
+    else:
+        header, encoded = data["imageData"].split(",", 1)
+        content = ContentFile(base64.b64decode(encoded))
+    # Mỗi job một thư mục riêng: file staging đặt tên theo nội dung nên hai job cùng ảnh không xoá file của nhau
+    return {"staged_path": staging.stage_upload(content, f"predict-{uuid.uuid4()}")}
+
+
+def _request_flag(request, body_key, query_key):
+    flag = _param(request, body_key) or request.query_params.get(query_key, False)
+    return str(flag).lower() in ("true", "1", "t")
+
+
+def _is_async_request(request):
+    """Chế độ bất đồng bộ: `"async": true` trong body hoặc `?async=1` trên URL."""
+    return _request_flag(request, "async", "async")
+
+
+def _wants_inline_heatmap(request):
+    """Trả thêm heatmap dạng data URI base64: `"inlineHeatmap": true` hoặc `?inline=1`. Mặc định chỉ trả URL."""
+    return _request_flag(request, "inlineHeatmap", "inline")
+
+
 # --- API CHO OHIF ---
 class PredictFromFrameAPIView(APIView):
-    parser_classes = [JSONParser]
+    parser_classes = [JSONParser, MultiPartParser, RawFrameParser, OctetStreamParser]
 
     def post(self, request, *args, **kwargs):
-        data = request.data
-        image_data_uri = data.get('imageData')
-        study_instance_uid = data.get('studyInstanceUID')
-        model_id = data.get('modelId')
+        study_instance_uid = _param(request, 'studyInstanceUID')
+        model_id = _param(request, 'modelId')
+        heatmap_format = _param(request, 'heatmapFormat') or settings.AI_HEATMAP_FORMAT
 
-        if not all([image_data_uri, study_instance_uid, model_id]):
+        if heatmap_format not in services.HEATMAP_FORMATS:
             return Response(
-                {"error": "Thiếu imageData, studyInstanceUID hoặc modelId."},
+                {"error": f"heatmapFormat không hợp lệ. Hỗ trợ: {', '.join(services.HEATMAP_FORMATS)}"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        async_mode = _is_async_request(request)
         try:
-            header, encoded = image_data_uri.split(",", 1)
-            image_bytes = base64.b64decode(encoded)
+            # Chế độ bất đồng bộ: inference worker tự lấy/giải mã ảnh, web không giải mã
+            decoded = None if async_mode else _decode_request_image(request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except (orthanc.OrthancError, requests.RequestException) as e:
+            return Response(
+                {"error": "Không lấy được frame từ Orthanc.", "details": str(e)},
+                status=status.HTTP_502_BAD_GATEWAY,
+            )
 
-            service_result = services.run_prediction_from_file_bytes(model_id, image_bytes)
-            prediction_result = service_result["prediction_result"]
-            heatmap_base64_uri = service_result["heatmap_url"]
+        has_image = _has_request_image(request) if async_mode else decoded is not None
+        if not has_image or not all([study_instance_uid, model_id]):
+            return Response(
+                {"error": "Thiếu imageData (hoặc sopInstanceUID / body ảnh nhị phân), studyInstanceUID hoặc modelId."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
+        try:
             study = DICOMStudy.objects.get(study_instance_uid=study_instance_uid)
             ai_model = AIModel.objects.get(model_id=model_id)
 
-            _, heatmap_encoded = heatmap_base64_uri.split(",", 1)
-            heatmap_data = base64.b64decode(heatmap_encoded)
-
-            heatmap_filename = f"heatmaps/{study.study_id}/{uuid.uuid4()}.png"
-            heatmap_path = os.path.join(settings.MEDIA_ROOT, heatmap_filename)
-
-            os.makedirs(os.path.dirname(heatmap_path), exist_ok=True)
-            with open(heatmap_path, "wb") as f:
-                f.write(heatmap_data)
-
-            report = AIReport.objects.create(
-                study=study,
-                model=ai_model,
-                prediction_result=prediction_result,
-                heatmap_image_path=heatmap_filename,
-            )
+            if async_mode:
+                source = _request_image_source(request)
+                job = run_prediction_task.delay(str(model_id), study_instance_uid, source, heatmap_format)
+                return Response(
+                    {
+                        "job_id": job.id,
+                        "status": "PENDING",
+                        "status_url": request.build_absolute_uri(
+                            reverse("ai_processing:prediction_status", args=[job.id])
+                        ),
+                        "events_url": request.build_absolute_uri(
+                            reverse("ai_processing:prediction_events", args=[job.id])
+                        ),
+                    },
+                    status=status.HTTP_202_ACCEPTED,
+                )
+
+            kind, image = decoded
+            report, service_result = services.predict_and_save(study, ai_model, kind, image, heatmap_format)
 
             serializer = AIReportSerializer(report, context={"request": request})
             response_data = serializer.data
@@ -67,8 +168,15 @@ class PredictFromFrameAPIView(APIView):
                 "bbox": service_result.get("bbox"),
                 "image_width": service_result.get("image_width"),
                 "image_height": service_result.get("image_height"),
-                "heatmap_url": heatmap_base64_uri,
+                "heatmap_format": heatmap_format,
+                "cached": service_result["cached"],
             })
+            if _wants_inline_heatmap(request):
+                response_data["heatmap_data_uri"] = services.heatmap_data_uri(
+                    heatmap_format,
+                    heatmap_bytes=service_result.get("heatmap_bytes"),
+                    heatmap_image_path=report.heatmap_image_path,
+                )
 
             return Response(response_data, status=status.HTTP_200_OK)
 
@@ -82,6 +190,8 @@ class PredictFromFrameAPIView(APIView):
                 {"error": f"Không tìm thấy Model với ID: {model_id}"},
                 status=status.HTTP_404_NOT_FOUND,
             )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             import traceback; traceback.print_exc()
             return Response(
@@ -93,10 +203,111 @@ class PredictFromFrameAPIView(APIView):
 predict_from_frame_api = PredictFromFrameAPIView.as_view()
 
 
+@api_view(["GET"])
+def prediction_status(request, job_id):
+    """Trạng thái của một job dự đoán bất đồng bộ: PENDING, PROCESSING, COMPLETED hoặc FAILED."""
+    result = AsyncResult(str(job_id))
+
+    if result.state == "SUCCESS":
+        task_result = result.result
+        try:
+            report = AIReport.objects.get(report_id=task_result["report_id"])
+        except (AIReport.DoesNotExist, ValidationError, KeyError, TypeError):
+            return Response(
+                {"error": f"Không tìm thấy AIReport của job {job_id} (đã bị xoá hoặc không hợp lệ)."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        response_data = AIReportSerializer(report, context={"request": request}).data
+        response_data.update({
+            "status": "COMPLETED",
+            "bbox": task_result.get("bbox"),
+            "image_width": task_result.get("image_width"),
+            "image_height": task_result.get("image_height"),
+            "heatmap_format": task_result.get("heatmap_format"),
+            "cached": task_result.get("cached", False),
+        })
+        if _wants_inline_heatmap(request):
+            response_data["heatmap_data_uri"] = services.heatmap_data_uri(
+                task_result.get("heatmap_format"), heatmap_image_path=report.heatmap_image_path
+            )
+        return Response(response_data, status=status.HTTP_200_OK)
+
+    if result.state == "FAILURE":
+        return Response({"status": "FAILED", "error": str(result.result)}, status=status.HTTP_200_OK)
+
+    if result.state in ("STARTED", "RETRY", "PROGRESS"):
+        response_data = {"status": "PROCESSING"}
+        if result.state == "PROGRESS" and isinstance(result.info, dict):
+            response_data["progress"] = result.info
+        return Response(response_data, status=status.HTTP_200_OK)
+
+    return Response({"status": "PENDING"}, status=status.HTTP_200_OK)
+
+
+async def prediction_events(request, job_id):
+    """Stream tiến độ job dự đoán dạng Server-Sent Events (PROCESSING/done/total, rồi COMPLETED hoặc FAILED)."""
+    return progress.event_stream_response("job", job_id)
+
+
+# --- API DỰ ĐOÁN CẢ STUDY ---
+class PredictStudyAPIView(APIView):
+    parser_classes = [JSONParser]
+
+    def post(self, request, *args, **kwargs):
+        study_instance_uid = request.data.get('studyInstanceUID')
+        model_id = request.data.get('modelId')
+        pooling = request.data.get('pooling') or settings.AI_STUDY_POOLING
+        top_k = request.data.get('topK')
+        heatmap_format = request.data.get('heatmapFormat') or settings.AI_HEATMAP_FORMAT
+
+        if not all([study_instance_uid, model_id]):
+            return Response({"error": "Thiếu studyInstanceUID hoặc modelId."}, status=status.HTTP_400_BAD_REQUEST)
+        if pooling not in services.STUDY_POOLING_MODES:
+            return Response(
+                {"error": f"pooling không hợp lệ. Hỗ trợ: {', '.join(services.STUDY_POOLING_MODES)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if heatmap_format not in services.HEATMAP_FORMATS:
+            return Response(
+                {"error": f"heatmapFormat không hợp lệ. Hỗ trợ: {', '.join(services.HEATMAP_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            study = DICOMStudy.objects.get(study_instance_uid=study_instance_uid)
+            AIModel.objects.get(model_id=model_id)
+        except DICOMStudy.DoesNotExist:
+            return Response(
+                {"error": f"Không tìm thấy Study với UID: {study_instance_uid}"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        except AIModel.DoesNotExist:
+            return Response(
+                {"error": f"Không tìm thấy Model với ID: {model_id}"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        job = run_study_prediction_task.delay(
+            str(model_id), study.study_instance_uid, pooling, int(top_k) if top_k else None, heatmap_format
+        )
+        return Response(
+            {
+                "job_id": job.id,
+                "status": "PENDING",
+                "status_url": request.build_absolute_uri(reverse("ai_processing:prediction_status", args=[job.id])),
+                "events_url": request.build_absolute_uri(reverse("ai_processing:prediction_events", args=[job.id])),
+            },
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+
+predict_study_api = PredictStudyAPIView.as_view()
+
+
 # --- API LẤY DANH SÁCH MODEL ---
 class AIModelListView(APIView):
     def get(self, request, *args, **kwargs):
-        models = AIModel.objects.all().order_by("model_name")
+        models = AIModel.objects.filter(is_active=True).order_by("model_name")
         serializer = AIModelSerializer(models, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -121,6 +332,11 @@ class RunPredictionFromFileAPIView(APIView):
         try:
             image_bytes = image_file.read()
             service_result = services.run_prediction_from_file_bytes(model_id, image_bytes)
+            # Trang test hiển thị heatmap trực tiếp nên trả về dạng data URI
+            heatmap_bytes = service_result.pop("heatmap_bytes")
+            service_result["heatmap_url"] = services.heatmap_data_uri(
+                service_result["heatmap_format"], heatmap_bytes=heatmap_bytes
+            )
 
             return Response(service_result, status=status.HTTP_200_OK)
 
@@ -153,6 +369,6 @@ def save_review(request):
     return Response(serializer.errors, status=400)
 
 def api_test_page(request):
-    all_models = AIModel.objects.all()
+    all_models = AIModel.objects.filter(is_active=True)
     context = {"models": all_models}
     return render(request, "ai_processing/api_test.html", context)
\ No newline at end of file
@@ -73,4 +73,35 @@ def create_dicom_from_image(image_bytes, patient, study_uid, series_uid, instanc
 
     except Exception as e:
         print(f"Lỗi khi tạo file DICOM từ ảnh trong bộ nhớ: {e}")
-        raise
\ No newline at end of file
+        raise
+
+# Các tag cần cho việc chống trùng và tạo DICOMStudy; chỉ đọc đúng các tag này, không đọc pixel
+HEADER_TAGS = {
+    'sop_instance_uid': 'SOPInstanceUID',
+    'study_instance_uid': 'StudyInstanceUID',
+    'series_instance_uid': 'SeriesInstanceUID',
+    'study_description': 'StudyDescription',
+    'study_date': 'StudyDate',
+    'study_time': 'StudyTime',
+}
+
+
+def read_dicom_header(fileobj):
+    """
+    Đọc một lần header của file DICOM (file-like hoặc đường dẫn) và trả về dict các UID/metadata
+    trong HEADER_TAGS (giá trị str, có thể gửi qua Celery bằng JSON). Trả về None nếu không phải DICOM.
+    """
+    try:
+        ds = pydicom.dcmread(
+            fileobj,
+            stop_before_pixels=True,
+            defer_size='1 KB',
+            specific_tags=list(HEADER_TAGS.values()),
+        )
+        header = {key: str(ds.get(keyword, '')) for key, keyword in HEADER_TAGS.items()}
+    except (pydicom.errors.InvalidDicomError, AttributeError):
+        return None
+    finally:
+        if hasattr(fileobj, 'seek'):
+            fileobj.seek(0)
+    return header if header['sop_instance_uid'] else None
@@ -0,0 +1,79 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from apps.uploads import orthanc
+
+
+class _OrthancStandIn(BaseHTTPRequestHandler):
+    """Giả lập POST /instances của Orthanc với độ trễ lưu trữ cố định."""
+    protocol_version = "HTTP/1.1"
+    latency = 0.01
+    parent_study = "standin-study"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        remaining = length
+        while remaining > 0:
+            remaining -= len(self.rfile.read(min(remaining, 1 << 16)))
+        time.sleep(self.latency)
+        body = json.dumps({"ID": uuid.uuid4().hex, "ParentStudy": self.parent_study, "Status": "Success"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = "Benchmark throughput (instances/s) gửi DICOM lên một Orthanc giả lập: tuần tự từng kết nối vs pool song song."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--instances", type=int, default=200)
+        parser.add_argument("--file-kb", type=int, default=256)
+        parser.add_argument("--latency-ms", type=float, default=10.0, help="Độ trễ xử lý giả lập mỗi instance")
+        parser.add_argument("--concurrency", type=int, default=8)
+
+    def handle(self, *args, **options):
+        _OrthancStandIn.latency = options["latency_ms"] / 1000.0
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _OrthancStandIn)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                items = []
+                for i in range(options["instances"]):
+                    path = os.path.join(directory, f"{i:05d}.dcm")
+                    with open(path, "wb") as f:
+                        f.write(os.urandom(options["file_kb"] * 1024))
+                    items.append((str(i), path))
+
+                start = time.perf_counter()
+                for _, path in items:
+                    with open(path, "rb") as f:
+                        requests.post(f"{base_url}/instances", data=f.read(), headers={"Content-Type": "application/dicom"})
+                self._report("sequential", len(items), time.perf_counter() - start)
+
+                with override_settings(ORTHANC_URL=base_url, ORTHANC_POOL_SIZE=options["concurrency"]):
+                    orthanc._session = None
+                    start = time.perf_counter()
+                    failures = sum(1 for _, _, error in orthanc.store_instances(items, options["concurrency"], "parallel") if error)
+                    self._report(f"pooled x{options['concurrency']}", len(items) - failures, time.perf_counter() - start)
+                    orthanc._session = None
+        finally:
+            server.shutdown()
+
+    def _report(self, name, count, elapsed):
+        self.stdout.write(f"{name:<12} {count} instance trong {elapsed:6.2f}s  -> {count / elapsed:8.1f} instances/s")
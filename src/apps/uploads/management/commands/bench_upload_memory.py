@@ -0,0 +1,61 @@
+import json
+import os
+import pickle
+import tempfile
+import tracemalloc
+import uuid
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from apps.uploads.staging import release_session, stage_upload
+
+
+class Command(BaseCommand):
+    help = "Đo bộ nhớ đỉnh và kích thước message Celery của một phiên upload lớn: gửi nội dung file vs gửi đường dẫn staging."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--files", type=int, default=500, help="Số file trong phiên upload")
+        parser.add_argument("--file-kb", type=int, default=512, help="Kích thước mỗi file (KB)")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as source_dir, tempfile.TemporaryDirectory() as staging_dir:
+            paths = []
+            for i in range(options["files"]):
+                path = os.path.join(source_dir, f"slice_{i:04d}.dcm")
+                with open(path, "wb") as f:
+                    f.write(os.urandom(options["file_kb"] * 1024))
+                paths.append(path)
+
+            def inline_payload():
+                uploads_data = []
+                for path in paths:
+                    with open(path, "rb") as f:
+                        uploads_data.append({"upload_id": uuid.uuid4(), "content": f.read(), "original_filename": path})
+                return pickle.dumps(uploads_data)
+
+            session_id = uuid.uuid4()
+
+            def staged_payload():
+                uploads_data = []
+                for path in paths:
+                    with open(path, "rb") as f:
+                        uploads_data.append({
+                            "upload_id": str(uuid.uuid4()),
+                            "staged_path": stage_upload(File(f), session_id),
+                            "original_filename": path,
+                        })
+                return json.dumps(uploads_data).encode()
+
+            with override_settings(UPLOAD_STAGING_DIR=staging_dir):
+                for name, build in (("inline-pickle", inline_payload), ("staged-json", staged_payload)):
+                    tracemalloc.start()
+                    payload = build()
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                    self.stdout.write(
+                        f"{name:<14} message={len(payload) / 2**20:9.2f} MB  peak python heap={peak / 2**20:9.2f} MB"
+                    )
+                    del payload
+                release_session(session_id)
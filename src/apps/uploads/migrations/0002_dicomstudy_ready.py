@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+def mark_existing_studies_ready(apps, schema_editor):
+    # Các study tạo trước khi có cờ này đã được xác nhận bằng vòng chờ cũ
+    DICOMStudy = apps.get_model('uploads', 'DICOMStudy')
+    DICOMStudy.objects.update(ready=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploads', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dicomstudy',
+            name='ready',
+            field=models.BooleanField(default=False, help_text='Orthanc đã xác nhận study sẵn sàng để mở trên viewer'),
+        ),
+        migrations.RunPython(mark_existing_studies_ready, migrations.RunPython.noop),
+    ]
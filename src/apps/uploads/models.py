@@ -84,6 +84,7 @@ class DICOMStudy(models.Model):
         max_length=255, unique=True, help_text="Study Instance UID của ca chụp (dùng cho OHIF)", null=True
     )
     session_id = models.UUIDField(unique=True, help_text="ID của phiên upload để theo dõi", null=True)
+    ready = models.BooleanField(default=False, help_text="Orthanc đã xác nhận study sẵn sàng để mở trên viewer")
 
     def __str__(self):
         return f"Study cho {self.patient.full_name} vào ngày {self.study_date}"
@@ -0,0 +1,262 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
+
+import numpy as np
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from config import metrics
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class OrthancError(Exception):
+    pass
+
+
+def orthanc_url(path):
+    return f"{settings.ORTHANC_URL.rstrip('/')}{path}"
+
+
+def get_session():
+    """Session HTTP dùng chung (keep-alive, connection pool) tới Orthanc cho cả process."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                session.auth = (settings.ORTHANC_USERNAME, settings.ORTHANC_PASSWORD)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.ORTHANC_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+class FrameCache:
+    """LRU cache các frame đã tải từ Orthanc, giới hạn theo tổng số byte."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self._frames = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+            return frame
+
+    def put(self, key, frame):
+        if frame.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._frames.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            frame.setflags(write=False)
+            self._frames[key] = frame
+            self._bytes += frame.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._frames.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+
+class InstanceIdCache:
+    """LRU cache SOPInstanceUID -> ID nội bộ của Orthanc, giới hạn theo số entry."""
+
+    def __init__(self, max_entries):
+        self.max_entries = int(max_entries)
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get(self, sop_instance_uid):
+        with self._lock:
+            orthanc_id = self._ids.get(sop_instance_uid)
+            if orthanc_id is not None:
+                self._ids.move_to_end(sop_instance_uid)
+            return orthanc_id
+
+    def put(self, sop_instance_uid, orthanc_id):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._ids[sop_instance_uid] = orthanc_id
+            self._ids.move_to_end(sop_instance_uid)
+            while len(self._ids) > self.max_entries:
+                self._ids.popitem(last=False)
+
+
+_frame_cache = FrameCache(settings.ORTHANC_FRAME_CACHE_MB * 2**20)
+_instance_ids = InstanceIdCache(settings.ORTHANC_INSTANCE_ID_CACHE_SIZE)
+
+
+def find_instance_id(sop_instance_uid):
+    """Tra ID nội bộ của Orthanc cho một SOPInstanceUID (dùng /tools/lookup, có LRU cache trong process)."""
+    orthanc_id = _instance_ids.get(sop_instance_uid)
+    if orthanc_id:
+        return orthanc_id
+
+    response = get_session().post(orthanc_url("/tools/lookup"), data=sop_instance_uid, timeout=settings.ORTHANC_TIMEOUT)
+    response.raise_for_status()
+    for item in response.json():
+        if item.get("Type") == "Instance":
+            _instance_ids.put(sop_instance_uid, item["ID"])
+            return item["ID"]
+    raise OrthancError(f"Không tìm thấy instance {sop_instance_uid} trên Orthanc.")
+
+
+def fetch_instance_file(sop_instance_uid):
+    """Tải nguyên file DICOM của một instance theo SOPInstanceUID."""
+    orthanc_id = find_instance_id(sop_instance_uid)
+    response = get_session().get(orthanc_url(f"/instances/{orthanc_id}/file"), timeout=settings.ORTHANC_TIMEOUT)
+    response.raise_for_status()
+    return response.content
+
+
+def _fetch_raw_frame(orthanc_id, frame_number):
+    """Fallback cho Orthanc cũ không có endpoint /numpy: chỉ hỗ trợ transfer syntax không nén."""
+    session = get_session()
+    tags = session.get(orthanc_url(f"/instances/{orthanc_id}/simplified-tags"), timeout=settings.ORTHANC_TIMEOUT)
+    tags.raise_for_status()
+    tags = tags.json()
+
+    rows, cols = int(tags["Rows"]), int(tags["Columns"])
+    samples = int(tags.get("SamplesPerPixel", 1))
+    bits = int(tags["BitsAllocated"])
+    signed = int(tags.get("PixelRepresentation", 0)) == 1
+    dtype = np.dtype(f"<{'i' if signed else 'u'}{bits // 8}")
+
+    response = session.get(orthanc_url(f"/instances/{orthanc_id}/frames/{frame_number}/raw"), timeout=settings.ORTHANC_TIMEOUT)
+    response.raise_for_status()
+    expected = rows * cols * samples * dtype.itemsize
+    if len(response.content) != expected:
+        raise OrthancError("Frame được nén, không giải mã được từ endpoint /raw.")
+    frame = np.frombuffer(response.content, dtype=dtype)
+    return frame.reshape((rows, cols) if samples == 1 else (rows, cols, samples))
+
+
+def fetch_frame(sop_instance_uid, frame_number=0):
+    """
+    Lấy pixel gốc (đúng bit-depth, chưa rescale) của một frame (đánh số từ 0) theo SOPInstanceUID.
+    Ưu tiên endpoint /frames/{n}/numpy của Orthanc, kết quả được giữ trong LRU frame cache.
+    """
+    key = (sop_instance_uid, int(frame_number))
+    frame = _frame_cache.get(key)
+    if frame is not None:
+        return frame
+
+    orthanc_id = find_instance_id(sop_instance_uid)
+    response = get_session().get(
+        orthanc_url(f"/instances/{orthanc_id}/frames/{int(frame_number)}/numpy"),
+        params={"rescale": "0"},
+        timeout=settings.ORTHANC_TIMEOUT,
+    )
+    if response.status_code == 404:
+        frame = _fetch_raw_frame(orthanc_id, int(frame_number))
+    else:
+        response.raise_for_status()
+        frame = np.load(BytesIO(response.content), allow_pickle=False)
+        if frame.ndim == 3 and frame.shape[2] == 1:
+            frame = frame[:, :, 0]
+
+    _frame_cache.put(key, frame)
+    return frame
+
+
+def _post_instances(body, content_type):
+    mode = "zip" if content_type == "application/zip" else "single"
+    with metrics.timed(metrics.ORTHANC_POST_SECONDS.labels(mode)):
+        response = get_session().post(
+            orthanc_url("/instances"), data=body, headers={"Content-Type": content_type}, timeout=settings.ORTHANC_TIMEOUT
+        )
+    if response.status_code >= 500:
+        # Lỗi tạm thời phía Orthanc: để store_instance_file thử lại
+        raise requests.HTTPError(f"Orthanc trả về {response.status_code}: {response.text}", response=response)
+    if response.status_code != 200:
+        raise OrthancError(f"Orthanc từ chối instance ({response.status_code}): {response.text}")
+    return response.json()
+
+
+def store_instance_file(path, retries=None, backoff=None):
+    """
+    POST một file DICOM (stream từ đĩa) lên /instances qua session keep-alive.
+    Lỗi kết nối/5xx được thử lại tối đa `retries` lần với backoff luỹ thừa; trả về JSON của Orthanc.
+    """
+    retries = settings.ORTHANC_UPLOAD_RETRIES if retries is None else retries
+    backoff = settings.ORTHANC_UPLOAD_BACKOFF if backoff is None else backoff
+    for attempt in range(retries + 1):
+        try:
+            with open(path, "rb") as f:
+                return _post_instances(f, "application/dicom")
+        except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as exc:
+            if attempt >= retries:
+                raise
+            delay = backoff * (2 ** attempt)
+            metrics.ORTHANC_RETRIES.labels("single").inc()
+            logger.warning(f"[ORTHANC] Lỗi khi gửi {os.path.basename(path)} (lần {attempt + 1}), thử lại sau {delay:.1f}s: {exc}")
+            time.sleep(delay)
+
+
+def _store_zip_batch(keys_and_paths):
+    """Gửi một lô file trong một archive ZIP (Orthanc >= 1.8.2). Trả về {key: response} nếu Orthanc nhận đủ cả lô."""
+    with tempfile.SpooledTemporaryFile(max_size=64 * 2**20) as archive:
+        with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_STORED) as zf:
+            for key, path in keys_and_paths:
+                zf.write(path, arcname=f"{key}.dcm")
+        archive.seek(0)
+        result = _post_instances(archive, "application/zip")
+    if not isinstance(result, list) or len(result) != len(keys_and_paths):
+        raise OrthancError("Orthanc không xác nhận đủ số instance trong archive ZIP.")
+    return {key: item for (key, _), item in zip(keys_and_paths, result)}
+
+
+def store_instances(items, max_in_flight=None, mode=None):
+    """
+    Gửi nhiều file DICOM lên Orthanc song song, giới hạn `max_in_flight` request đồng thời.
+    `items` là list (key, path). Sinh ra (key, response_json, error) theo thứ tự hoàn thành;
+    mỗi instance được thử lại độc lập nên một file lỗi không làm hỏng cả phiên.
+    Với mode="zip", các file được gộp thành archive ZIP theo lô ORTHANC_ZIP_BATCH_SIZE, lô nào lỗi
+    sẽ được gửi lại từng file một.
+    """
+    max_in_flight = max_in_flight or settings.ORTHANC_UPLOAD_CONCURRENCY
+    mode = mode or settings.ORTHANC_UPLOAD_MODE
+
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="orthanc-stow") as pool:
+        pending = list(items)
+        if mode == "zip":
+            batch_size = settings.ORTHANC_ZIP_BATCH_SIZE
+            batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+            futures = {pool.submit(_store_zip_batch, batch): batch for batch in batches}
+            pending = []
+            for future in as_completed(futures):
+                try:
+                    for key, result in future.result().items():
+                        yield key, result, None
+                except Exception as exc:
+                    metrics.ORTHANC_RETRIES.labels("zip").inc()
+                    logger.warning(f"[ORTHANC] Lô ZIP lỗi, gửi lại từng file: {exc}")
+                    pending.extend(futures[future])
+
+        futures = {pool.submit(store_instance_file, path): key for key, path in pending}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as exc:
+                yield futures[future], None, exc
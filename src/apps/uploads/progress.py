@@ -0,0 +1,101 @@
+import json
+import logging
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+logger = logging.getLogger(__name__)
+
+# Trạng thái kết thúc: stream SSE đóng lại sau khi gửi sự kiện mang một trong các trạng thái này
+TERMINAL_STATUSES = ("COMPLETED", "FAILED")
+
+_client = None
+
+
+def channel_name(kind, key):
+    """Kênh pub/sub cho một phiên upload (kind="upload") hoặc một job dự đoán (kind="job")."""
+    return f"progress:{kind}:{key}"
+
+
+def _snapshot_key(channel):
+    return f"{channel}:last"
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.PROGRESS_REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+    return _client
+
+
+def publish(kind, key, **event):
+    """
+    Phát một sự kiện tiến độ lên Redis pub/sub và lưu lại làm snapshot cho client kết nối muộn.
+    Lỗi Redis chỉ được ghi log: mất một sự kiện tiến độ không được làm hỏng tác vụ đang chạy.
+    """
+    channel = channel_name(kind, key)
+    payload = json.dumps(event, default=str)
+    try:
+        pipe = _get_client().pipeline()
+        pipe.set(_snapshot_key(channel), payload, ex=settings.PROGRESS_SNAPSHOT_TTL)
+        pipe.publish(channel, payload)
+        pipe.execute()
+    except redis.RedisError as exc:
+        logger.warning(f"[PROGRESS] Không phát được sự kiện lên {channel}: {exc}")
+
+
+def _sse(payload):
+    data = payload.decode() if isinstance(payload, bytes) else payload
+    return f"data: {data}\n\n"
+
+
+def _is_terminal(payload):
+    try:
+        return json.loads(payload).get("status") in TERMINAL_STATUSES
+    except (ValueError, AttributeError):
+        return False
+
+
+async def stream_events(kind, key):
+    """
+    Async generator sinh các khung Server-Sent Events cho một kênh tiến độ.
+    Gửi snapshot gần nhất trước (nếu có), sau đó chuyển tiếp từng message pub/sub,
+    gửi comment heartbeat khi kênh im lặng và kết thúc khi gặp trạng thái COMPLETED/FAILED.
+    """
+    channel = channel_name(kind, key)
+    client = aioredis.Redis.from_url(settings.PROGRESS_REDIS_URL)
+    pubsub = client.pubsub()
+    try:
+        # Subscribe trước khi đọc snapshot để không lỡ sự kiện phát ra ở giữa hai bước
+        await pubsub.subscribe(channel)
+        snapshot = await client.get(_snapshot_key(channel))
+        if snapshot:
+            yield _sse(snapshot)
+            if _is_terminal(snapshot):
+                return
+
+        heartbeat = settings.PROGRESS_HEARTBEAT_SECONDS
+        while True:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=heartbeat)
+            if message is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield _sse(message["data"])
+            if _is_terminal(message["data"]):
+                return
+    finally:
+        # Chạy cả khi client đóng kết nối (generator bị huỷ)
+        await pubsub.unsubscribe(channel)
+        await pubsub.aclose()
+        await client.aclose()
+
+
+def event_stream_response(kind, key):
+    """StreamingHttpResponse text/event-stream cho một kênh tiến độ (dùng trong async view, chạy qua ASGI)."""
+    response = StreamingHttpResponse(stream_events(kind, key), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Tắt buffer của reverse proxy (nginx) để sự kiện tới client ngay
+    response["X-Accel-Buffering"] = "no"
+    return response
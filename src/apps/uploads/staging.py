@@ -0,0 +1,43 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+
+
+def session_dir(session_id):
+    return os.path.join(settings.UPLOAD_STAGING_DIR, str(session_id))
+
+
+def staged_path(relative_path):
+    return os.path.join(settings.UPLOAD_STAGING_DIR, relative_path)
+
+
+def stage_upload(uploaded_file, session_id):
+    """
+    Ghi file upload xuống thư mục staging dùng chung (web và worker cùng mount PRIVATE_DATA_ROOT) theo từng
+    chunk, đặt tên theo sha256 nội dung. Trả về đường dẫn tương đối so với UPLOAD_STAGING_DIR để truyền qua Celery.
+    """
+    directory = session_dir(session_id)
+    os.makedirs(directory, exist_ok=True)
+
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in uploaded_file.chunks():
+                digest.update(chunk)
+                out.write(chunk)
+        final_path = os.path.join(directory, digest.hexdigest())
+        os.replace(tmp_path, final_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return os.path.relpath(final_path, settings.UPLOAD_STAGING_DIR)
+
+
+def release_session(session_id):
+    """Xoá toàn bộ file staging của một phiên upload sau khi đã đẩy xong lên Orthanc."""
+    shutil.rmtree(session_dir(session_id), ignore_errors=True)
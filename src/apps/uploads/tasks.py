@@ -1,29 +1,36 @@
 # src/apps/uploads/tasks.py
 
 from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from config import metrics
 from .models import FileUpload, DICOMStudy, Patient, DICOMInstance
-import pydicom
-import requests
-from .dicom_utils import create_dicom_from_image
+from . import orthanc, progress
+from .dicom_utils import create_dicom_from_image, read_dicom_header
+from .staging import staged_path, release_session
 import datetime
+import requests
 from pydicom.uid import generate_uid
 from io import BytesIO
 import time
 
-@shared_task(bind=True, max_retries=3, default_retry_delay=5)
+# uploads_data chỉ chứa đường dẫn file staging (không chứa nội dung) nên gửi bằng JSON
+@shared_task(bind=True, max_retries=3, default_retry_delay=5, serializer='json')
 def process_upload_session(self, patient_id, uploads_data, session_id):
     if not uploads_data:
         return
 
+    started = time.perf_counter()
     try:
         patient = Patient.objects.get(patient_id=patient_id)
-        auth = ('mapdr', 'changestrongpassword')
         
-        first_upload_content = uploads_data[0]['content']
-        try:
-            study_uid = pydicom.dcmread(BytesIO(first_upload_content), stop_before_pixels=True).StudyInstanceUID
-        except pydicom.errors.InvalidDicomError:
-            study_uid = generate_uid()
+        # Header đã được đọc một lần ở view; message cũ (không có 'dicom') thì đọc lại từ file staging
+        headers = {
+            data['upload_id']: data['dicom'] if 'dicom' in data else read_dicom_header(staged_path(data['staged_path']))
+            for data in uploads_data
+        }
+        first_header = headers[uploads_data[0]['upload_id']]
+        study_uid = first_header['study_instance_uid'] if first_header and first_header['study_instance_uid'] else generate_uid()
 
         print(f"Bắt đầu xử lý {len(uploads_data)} file cho Study UID: {study_uid}")
 
@@ -31,64 +38,144 @@ def process_upload_session(self, patient_id, uploads_data, session_id):
         study_obj = None
         series_uid = generate_uid()
 
+        upload_ids = [data['upload_id'] for data in uploads_data]
+        user_id = FileUpload.objects.filter(upload_id=upload_ids[0]).values_list('user_id', flat=True).first()
+
+        # Đọc header (và chuyển ảnh thường sang DICOM trong staging) trước, sau đó gửi song song lên Orthanc
+        items = []
         for i, data in enumerate(uploads_data):
-            upload_obj = FileUpload.objects.get(upload_id=data['upload_id'])
-            upload_obj.status = FileUpload.Status.PROCESSING # Sửa lỗi: FileUpload.Status (S viết hoa)
-            upload_obj.save()
-
-            dicom_content, dicom_dataset = None, None
-            try:
-                dicom_dataset = pydicom.dcmread(BytesIO(data['content']))
-                dicom_content = data['content']
-            except pydicom.errors.InvalidDicomError:
-                dicom_content = create_dicom_from_image(data['content'], patient, study_uid, series_uid, i + 1)
-                dicom_dataset = pydicom.dcmread(BytesIO(dicom_content), stop_before_pixels=True)
-
-            response = requests.post('http://pacs:8042/instances', data=dicom_content, headers={'Content-Type': 'application/dicom'}, auth=auth)
-            
-            if response.status_code != 200:
-                raise Exception(f"Lỗi Orthanc cho file {data['original_filename']}: {response.text}")
-
-            if i == 0:
-                orthanc_study_id = response.json().get('ParentStudy')
-                if not orthanc_study_id:
-                    raise Exception("Không nhận được Orthanc Study ID từ Orthanc.")
-                
-                study_obj, _ = DICOMStudy.objects.update_or_create(
-                    study_instance_uid=study_uid,
-                    defaults={
-                        'patient': patient,
-                        'user': upload_obj.user,
-                        'orthanc_study_id': orthanc_study_id,
-                        'study_description': dicom_dataset.get('StudyDescription', 'N/A'),
-                        'study_date': datetime.datetime.strptime(dicom_dataset.get('StudyDate', '19000101'), '%Y%m%d').date(),
-                        'study_time': datetime.datetime.strptime(dicom_dataset.get('StudyTime', '000000').split('.')[0], '%H%M%S').time(),
-                    }
+            file_path = staged_path(data['staged_path'])
+            if headers[data['upload_id']] is None:
+                with open(file_path, 'rb') as image_file:
+                    dicom_content = create_dicom_from_image(image_file.read(), patient, study_uid, series_uid, i + 1)
+                headers[data['upload_id']] = read_dicom_header(BytesIO(dicom_content))
+                file_path = f"{file_path}.dcm"
+                with open(file_path, 'wb') as dicom_file:
+                    dicom_file.write(dicom_content)
+            items.append((data['upload_id'], file_path))
+
+        filenames = {data['upload_id']: data['original_filename'] for data in uploads_data}
+        batch_size = settings.UPLOAD_DB_BATCH_SIZE
+        failed = []
+        done = 0
+        progress.publish('upload', session_id, status='PROCESSING', done=0, total=len(items), failed=0)
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            FileUpload.objects.filter(upload_id__in=[upload_id for upload_id, _ in batch]).update(status=FileUpload.Status.PROCESSING)
+
+            completed, batch_failed = [], []
+            for upload_id, result, error in orthanc.store_instances(batch):
+                done += 1
+                if error is not None:
+                    print(f"Lỗi Orthanc cho file {filenames[upload_id]}: {error}")
+                    batch_failed.append(upload_id)
+                    progress.publish(
+                        'upload', session_id, status='PROCESSING', done=done, total=len(items), failed=len(failed) + len(batch_failed),
+                        file={'upload_id': upload_id, 'filename': filenames[upload_id], 'status': 'FAILED', 'error': str(error)},
+                    )
+                    continue
+                completed.append(upload_id)
+                progress.publish(
+                    'upload', session_id, status='PROCESSING', done=done, total=len(items), failed=len(failed) + len(batch_failed),
+                    file={'upload_id': upload_id, 'filename': filenames[upload_id], 'status': 'COMPLETED', 'orthanc_id': result.get('ID')},
                 )
 
-            DICOMInstance.objects.get_or_create(
-                instance_uid=dicom_dataset.SOPInstanceUID,
-                defaults={'study': study_obj}
-            )
-            
-            # SỬA LỖI: SỬ DỤNG FileUpload.Status (S viết hoa)
-            upload_obj.status = FileUpload.Status.COMPLETED
-            upload_obj.save()
+                if study_obj is None:
+                    header = headers[upload_id]
+                    orthanc_study_id = result.get('ParentStudy')
+                    if not orthanc_study_id:
+                        raise Exception("Không nhận được Orthanc Study ID từ Orthanc.")
+                    
+                    study_obj, _ = DICOMStudy.objects.update_or_create(
+                        study_instance_uid=study_uid,
+                        defaults={
+                            'patient': patient,
+                            'user_id': user_id,
+                            'orthanc_study_id': orthanc_study_id,
+                            'study_description': header['study_description'] or 'N/A',
+                            'study_date': datetime.datetime.strptime(header['study_date'] or '19000101', '%Y%m%d').date(),
+                            'study_time': datetime.datetime.strptime((header['study_time'] or '000000').split('.')[0], '%H%M%S').time(),
+                            'ready': False,
+                        }
+                    )
+
+            # Ghi trạng thái cả lô trong một transaction; tiến độ được cập nhật theo từng lô
+            with transaction.atomic():
+                if completed:
+                    DICOMInstance.objects.bulk_create(
+                        [DICOMInstance(instance_uid=headers[upload_id]['sop_instance_uid'], study=study_obj) for upload_id in completed],
+                        ignore_conflicts=True,
+                    )
+                    FileUpload.objects.filter(upload_id__in=completed).update(status=FileUpload.Status.COMPLETED)
+                if batch_failed:
+                    FileUpload.objects.filter(upload_id__in=batch_failed).update(status=FileUpload.Status.FAILED)
+            failed.extend(batch_failed)
+            metrics.UPLOAD_FILES.labels('completed').inc(len(completed))
+            metrics.UPLOAD_FILES.labels('failed').inc(len(batch_failed))
+            print(f"Đã xử lý {start + len(batch)}/{len(items)} file ({len(failed)} lỗi).")
+
+        if study_obj is None:
+            raise Exception(f"Orthanc không nhận file nào trong phiên upload ({len(failed)} file lỗi).")
+        if failed:
+            print(f"CẢNH BÁO: {len(failed)}/{len(uploads_data)} file không gửi được lên Orthanc sau khi thử lại.")
+
+        release_session(session_id)
 
         if study_obj:
             study_obj.session_id = session_id
             study_obj.save()
-            
-            for _ in range(10):
-                if requests.get(f"http://pacs:8042/studies/{orthanc_study_id}", auth=auth).status_code == 200:
-                    print(f"Orthanc đã xác nhận study {orthanc_study_id} sẵn sàng.")
-                    return
-                time.sleep(0.5)
-            print(f"CẢNH BÁO: Orthanc không xác nhận study {orthanc_study_id} kịp thời nhưng tác vụ vẫn hoàn thành.")
+
+            # Việc chờ Orthanc xác nhận study được giao cho tác vụ nhẹ confirm_study_ready (retry theo countdown),
+            # không giữ slot worker của phiên upload
+            progress.publish(
+                'upload', session_id, status='CONFIRMING', done=done, total=len(items), failed=len(failed),
+                study_instance_uid=study_uid,
+            )
+            confirm_study_ready.delay(str(study_obj.study_id), session_id)
+            elapsed = time.perf_counter() - started
+            metrics.UPLOAD_SESSION_SECONDS.observe(elapsed)
+            metrics.UPLOAD_FILES_PER_SECOND.set(len(items) / elapsed if elapsed > 0 else 0)
+            print(f"Phiên upload {session_id} chiếm worker {elapsed:.2f}s.")
         
     except Exception as exc:
         print(f"Xử lý phiên upload thất bại: {exc}")
         upload_ids = [data['upload_id'] for data in uploads_data]
         # SỬA LỖI: SỬ DỤNG FileUpload.Status (S viết hoa)
         FileUpload.objects.filter(upload_id__in=upload_ids).update(status=FileUpload.Status.FAILED)
-        self.retry(exc=exc)
\ No newline at end of file
+        if self.request.retries >= self.max_retries:
+            release_session(session_id)
+            progress.publish('upload', session_id, status='FAILED', error=str(exc))
+        else:
+            metrics.UPLOAD_RETRIES.inc()
+            progress.publish('upload', session_id, status='RETRY', error=str(exc), retries=self.request.retries + 1)
+        self.retry(exc=exc)
+
+
+@shared_task(bind=True, max_retries=None, ignore_result=True, serializer='json')
+def confirm_study_ready(self, study_id, session_id):
+    """
+    Kiểm tra một lần xem Orthanc đã có study chưa; nếu chưa thì tự lên lịch lại sau ORTHANC_READY_RETRY_DELAY giây
+    (không sleep trong worker). Hết ORTHANC_READY_MAX_ATTEMPTS lần vẫn đánh dấu sẵn sàng như luồng cũ.
+    """
+    study = DICOMStudy.objects.filter(study_id=study_id).only('orthanc_study_id', 'study_instance_uid').first()
+    if study is None:
+        return
+
+    try:
+        response = orthanc.get_session().get(
+            orthanc.orthanc_url(f"/studies/{study.orthanc_study_id}"), timeout=settings.ORTHANC_TIMEOUT
+        )
+        confirmed = response.status_code == 200
+    except requests.RequestException as exc:
+        print(f"Lỗi khi kiểm tra study {study.orthanc_study_id} trên Orthanc: {exc}")
+        confirmed = False
+
+    if not confirmed:
+        if self.request.retries + 1 < settings.ORTHANC_READY_MAX_ATTEMPTS:
+            raise self.retry(countdown=settings.ORTHANC_READY_RETRY_DELAY)
+        print(f"CẢNH BÁO: Orthanc không xác nhận study {study.orthanc_study_id} kịp thời nhưng tác vụ vẫn hoàn thành.")
+    else:
+        print(f"Orthanc đã xác nhận study {study.orthanc_study_id} sẵn sàng.")
+
+    DICOMStudy.objects.filter(study_id=study_id).update(ready=True)
+    progress.publish('upload', session_id, status='COMPLETED', study_instance_uid=study.study_instance_uid)
@@ -1,3 +1,311 @@
-from django.test import TestCase
+import datetime
+import json
+import shutil
+import tempfile
+import uuid
+from io import BytesIO
+from unittest import mock
+from urllib.parse import urlparse
 
-# Create your tests here.
+import numpy as np
+import requests
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+from pydicom.uid import generate_uid
+
+from . import orthanc, progress
+from .dicom_utils import create_dicom_from_image, read_dicom_header
+from .models import DICOMInstance, DICOMStudy, FileUpload, Patient
+from .tasks import confirm_study_ready, process_upload_session
+
+ORTHANC_URL = "http://orthanc.test"
+
+
+def _response(status_code=200, content=b"", content_type="application/octet-stream"):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    response.headers["Content-Type"] = content_type
+    return response
+
+
+class _OrthancStandIn:
+    """
+    Giả lập requests.Session tới Orthanc cho các endpoint đọc frame: /tools/lookup, /frames/{n}/numpy,
+    /simplified-tags và /frames/{n}/raw. `instances` là {sop_uid: (orthanc_id, [frame, ...])}.
+    """
+
+    def __init__(self, instances, numpy_endpoint=True, compressed=False):
+        self.instances = instances
+        self.numpy_endpoint = numpy_endpoint
+        self.compressed = compressed
+        self.calls = []
+
+    def _instance(self, orthanc_id):
+        return next(frames for oid, frames in self.instances.values() if oid == orthanc_id)
+
+    def post(self, url, data=None, **kwargs):
+        path = urlparse(url).path
+        self.calls.append(("POST", path))
+        if path == "/tools/lookup":
+            matches = [
+                {"ID": oid, "Path": f"/instances/{oid}", "Type": "Instance"}
+                for uid, (oid, _) in self.instances.items() if uid == data
+            ]
+            return _response(content=json.dumps(matches).encode(), content_type="application/json")
+        return _response(404)
+
+    def get(self, url, params=None, **kwargs):
+        path = urlparse(url).path
+        self.calls.append(("GET", path))
+        parts = path.strip("/").split("/")
+        frames = self._instance(parts[1])
+        if parts[2] == "simplified-tags":
+            frame = frames[0]
+            tags = {
+                "Rows": str(frame.shape[0]),
+                "Columns": str(frame.shape[1]),
+                "BitsAllocated": str(frame.dtype.itemsize * 8),
+                "PixelRepresentation": "1" if frame.dtype.kind == "i" else "0",
+            }
+            return _response(content=json.dumps(tags).encode(), content_type="application/json")
+
+        frame = frames[int(parts[3])]
+        if parts[4] == "numpy":
+            if not self.numpy_endpoint:
+                return _response(404)
+            assert params == {"rescale": "0"}
+            buffer = BytesIO()
+            np.save(buffer, frame[:, :, np.newaxis])
+            return _response(content=buffer.getvalue())
+        raw = frame.astype(frame.dtype.newbyteorder("<")).tobytes()
+        return _response(content=raw[: len(raw) // 2] if self.compressed else raw)
+
+    def paths(self, method=None):
+        return [path for m, path in self.calls if method in (None, m)]
+
+
+@override_settings(ORTHANC_URL=ORTHANC_URL)
+class FetchFrameTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.frames = [rng.integers(0, 4096, size=(8, 6)).astype(np.uint16) for _ in range(3)]
+        self.signed = [rng.integers(-1024, 3072, size=(8, 6)).astype(np.int16)]
+        self.instances = {"1.2.3": ("orthanc-a", self.frames), "1.2.4": ("orthanc-b", self.signed)}
+        for name, value in (("_frame_cache", orthanc.FrameCache(2**20)), ("_instance_ids", orthanc.InstanceIdCache(100))):
+            patcher = mock.patch.object(orthanc, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _use(self, stand_in):
+        patcher = mock.patch.object(orthanc, "get_session", return_value=stand_in)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return stand_in
+
+    def test_fetch_frame_looks_up_instance_and_reads_numpy(self):
+        stand_in = self._use(_OrthancStandIn(self.instances))
+        frame = orthanc.fetch_frame("1.2.3", 1)
+
+        np.testing.assert_array_equal(frame, self.frames[1])
+        self.assertEqual(frame.dtype, np.uint16)
+        self.assertEqual(stand_in.paths(), ["/tools/lookup", "/instances/orthanc-a/frames/1/numpy"])
+
+    def test_lookup_is_cached_per_instance(self):
+        stand_in = self._use(_OrthancStandIn(self.instances))
+        orthanc.fetch_frame("1.2.3", 0)
+        orthanc.fetch_frame("1.2.3", 2)
+
+        self.assertEqual(stand_in.paths("POST"), ["/tools/lookup"])
+
+    def test_unknown_instance(self):
+        self._use(_OrthancStandIn(self.instances))
+        with self.assertRaises(orthanc.OrthancError):
+            orthanc.fetch_frame("9.9.9")
+
+    def test_falls_back_to_raw_without_numpy_endpoint(self):
+        stand_in = self._use(_OrthancStandIn(self.instances, numpy_endpoint=False))
+        frame = orthanc.fetch_frame("1.2.3", 2)
+
+        np.testing.assert_array_equal(frame, self.frames[2])
+        self.assertEqual(stand_in.paths("GET"), [
+            "/instances/orthanc-a/frames/2/numpy",
+            "/instances/orthanc-a/simplified-tags",
+            "/instances/orthanc-a/frames/2/raw",
+        ])
+
+    def test_raw_fallback_keeps_signed_pixels(self):
+        self._use(_OrthancStandIn(self.instances, numpy_endpoint=False))
+        frame = orthanc.fetch_frame("1.2.4", 0)
+
+        self.assertEqual(frame.dtype, np.int16)
+        np.testing.assert_array_equal(frame, self.signed[0])
+
+    def test_raw_fallback_rejects_compressed_frames(self):
+        self._use(_OrthancStandIn(self.instances, numpy_endpoint=False, compressed=True))
+        with self.assertRaises(orthanc.OrthancError):
+            orthanc.fetch_frame("1.2.3", 0)
+
+    def test_repeated_fetch_hits_frame_cache(self):
+        stand_in = self._use(_OrthancStandIn(self.instances))
+        first = orthanc.fetch_frame("1.2.3", 0)
+        second = orthanc.fetch_frame("1.2.3", 0)
+
+        self.assertIs(first, second)
+        self.assertFalse(second.flags.writeable)
+        self.assertEqual(len(stand_in.paths("GET")), 1)
+
+    def test_least_recently_used_frame_is_evicted(self):
+        stand_in = self._use(_OrthancStandIn(self.instances))
+        with mock.patch.object(orthanc, "_frame_cache", orthanc.FrameCache(2 * self.frames[0].nbytes)):
+            orthanc.fetch_frame("1.2.3", 0)
+            orthanc.fetch_frame("1.2.3", 1)
+            orthanc.fetch_frame("1.2.3", 0)  # frame 0 vừa được dùng, frame 1 thành cũ nhất
+            orthanc.fetch_frame("1.2.3", 2)
+            stand_in.calls.clear()
+
+            orthanc.fetch_frame("1.2.3", 0)
+            orthanc.fetch_frame("1.2.3", 2)
+            self.assertEqual(stand_in.paths("GET"), [])
+            orthanc.fetch_frame("1.2.3", 1)
+            self.assertEqual(stand_in.paths("GET"), ["/instances/orthanc-a/frames/1/numpy"])
+
+
+class FrameCacheTests(SimpleTestCase):
+    def test_budget_in_bytes(self):
+        cache = orthanc.FrameCache(max_bytes=100)
+        cache.put("a", np.zeros(60, dtype=np.uint8))
+        cache.put("b", np.zeros(60, dtype=np.uint8))
+
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("b"))
+
+    def test_frame_larger_than_budget_is_not_cached(self):
+        cache = orthanc.FrameCache(max_bytes=10)
+        cache.put("a", np.zeros(11, dtype=np.uint8))
+        self.assertIsNone(cache.get("a"))
+
+
+class InstanceIdCacheTests(SimpleTestCase):
+    def test_least_recently_used_id_is_evicted(self):
+        cache = orthanc.InstanceIdCache(max_entries=2)
+        cache.put("1.2.1", "a")
+        cache.put("1.2.2", "b")
+        self.assertEqual(cache.get("1.2.1"), "a")
+        cache.put("1.2.3", "c")
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("1.2.2"))
+        self.assertEqual(cache.get("1.2.1"), "a")
+        self.assertEqual(cache.get("1.2.3"), "c")
+
+    @override_settings(ORTHANC_URL=ORTHANC_URL)
+    def test_find_instance_id_repeats_lookup_after_eviction(self):
+        stand_in = _OrthancStandIn({"1.2.3": ("orthanc-a", []), "1.2.4": ("orthanc-b", [])})
+        with mock.patch.object(orthanc, "_instance_ids", orthanc.InstanceIdCache(1)), \
+                mock.patch.object(orthanc, "get_session", return_value=stand_in):
+            orthanc.find_instance_id("1.2.3")
+            orthanc.find_instance_id("1.2.3")
+            orthanc.find_instance_id("1.2.4")
+            self.assertEqual(orthanc.find_instance_id("1.2.3"), "orthanc-a")
+        self.assertEqual(len(stand_in.paths("POST")), 3)
+
+
+def _store_instances_stand_in(items, max_in_flight=None, mode=None):
+    """Thay orthanc.store_instances: Orthanc nhận mọi file; ParentStudy chỉ được đọc từ file đầu tiên của phiên."""
+    parent_study = uuid.uuid4().hex
+    for key, _ in items:
+        yield key, {"ID": f"orthanc-{key}", "ParentStudy": parent_study, "Status": "Success"}, None
+
+
+@override_settings(UPLOAD_DB_BATCH_SIZE=10)
+class UploadQueryCountTests(TestCase):
+    """Số câu SQL của view upload_page và process_upload_session không tăng theo số file (chỉ theo số lô)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = Patient.objects.create(full_name="Upload Test", date_of_birth=datetime.date(1970, 1, 1))
+        png = BytesIO()
+        Image.fromarray(np.zeros((16, 16), dtype=np.uint8)).save(png, format="PNG")
+        cls.png = png.getvalue()
+
+    def setUp(self):
+        staging_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, staging_dir, ignore_errors=True)
+        staging = override_settings(UPLOAD_STAGING_DIR=staging_dir)
+        staging.enable()
+        self.addCleanup(staging.disable)
+        for patcher in (
+            mock.patch.object(progress, "publish"),
+            mock.patch.object(orthanc, "store_instances", side_effect=_store_instances_stand_in),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _files(self, count):
+        study_uid, series_uid = generate_uid(), generate_uid()
+        return [
+            SimpleUploadedFile(
+                f"{i:05d}.dcm",
+                create_dicom_from_image(self.png, self.patient, study_uid, series_uid, i + 1),
+                content_type="application/dicom",
+            )
+            for i in range(count)
+        ]
+
+    def _post(self, count):
+        """Gọi view upload_page thật; trả về args của process_upload_session.delay."""
+        with mock.patch.object(process_upload_session, "delay") as delay:
+            response = self.client.post(reverse("uploads:upload_page"), {
+                "patient_type": "existing",
+                "patient_uuid": str(self.patient.patient_id),
+                "files": self._files(count),
+            })
+        self.assertEqual(response.status_code, 200, response.content)
+        delay.assert_called_once()
+        return delay.call_args.args
+
+    def test_upload_page_queries_per_batch(self):
+        # Kiểm tra trùng SOP UID, tra study, tra bệnh nhân (3), rồi một INSERT FileUpload cho mỗi lô
+        # UPLOAD_DB_BATCH_SIZE file. Phiên 200 file chạy với lô mặc định 50
+        for count, batch_size in ((3, 10), (10, 10), (200, 50)):
+            batches = -(-count // batch_size)
+            with self.subTest(files=count, batch_size=batch_size), self.settings(UPLOAD_DB_BATCH_SIZE=batch_size), \
+                    self.assertNumQueries(3 + batches):
+                args = self._post(count)
+            self.assertEqual(len(args[1]), count)
+        self.assertEqual(FileUpload.objects.filter(status=FileUpload.Status.PENDING).count(), 213)
+
+    def test_upload_page_rejects_duplicates_with_one_query(self):
+        files = self._files(5)
+        study = DICOMStudy.objects.create(
+            patient=self.patient, study_date=datetime.date.today(), study_time=datetime.time(), orthanc_study_id="dup",
+        )
+        study.instances.create(instance_uid=read_dicom_header(files[3])["sop_instance_uid"])
+
+        with self.assertNumQueries(1):
+            response = self.client.post(reverse("uploads:upload_page"), {
+                "patient_type": "existing", "patient_uuid": str(self.patient.patient_id), "files": files,
+            })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(files[3].name, response.json()["message"])
+        self.assertFalse(FileUpload.objects.exists())
+
+    def test_process_upload_session_queries_per_batch(self):
+        # Chung cho cả phiên (9): bệnh nhân, user_id, update_or_create DICOMStudy (2 savepoint, SELECT, INSERT,
+        # 2 release) và lưu session_id. Mỗi lô UPLOAD_DB_BATCH_SIZE file (5): đánh dấu PROCESSING, rồi trong
+        # một transaction bulk_create DICOMInstance và đánh dấu COMPLETED. Phiên 200 file chạy với lô mặc định 50
+        for count, batch_size in ((10, 10), (30, 10), (200, 50)):
+            batches = -(-count // batch_size)
+            patient_id, uploads_data, session_id = self._post(count)
+            with self.subTest(files=count, batch_size=batch_size), self.settings(UPLOAD_DB_BATCH_SIZE=batch_size), \
+                    mock.patch.object(confirm_study_ready, "delay") as confirm, self.assertNumQueries(9 + 5 * batches):
+                process_upload_session.apply(args=(patient_id, uploads_data, session_id), throw=True)
+            confirm.assert_called_once()
+
+            upload_ids = [d["upload_id"] for d in uploads_data]
+            self.assertEqual(FileUpload.objects.filter(upload_id__in=upload_ids, status=FileUpload.Status.COMPLETED).count(), count)
+            study = DICOMStudy.objects.get(session_id=session_id)
+            self.assertEqual(study.instances.count(), count)
@@ -6,4 +6,5 @@ app_name = 'uploads'
 urlpatterns = [
     path('', views.upload_page, name='upload_page'),
     path('status/<uuid:session_id>/', views.check_study_status, name='check_study_status'),
+    path('status/<uuid:session_id>/events/', views.upload_progress_events, name='upload_progress_events'),
 ]
\ No newline at end of file
@@ -1,13 +1,15 @@
 # src/apps/uploads/views.py
 
+from django.conf import settings
 from django.shortcuts import render
 from django.http import JsonResponse
 from django.core.exceptions import ValidationError
 from .models import Patient, FileUpload, DICOMStudy, DICOMInstance
 import uuid
 from .tasks import process_upload_session
-import pydicom
-from io import BytesIO
+from .staging import stage_upload
+from . import progress
+from .dicom_utils import read_dicom_header
 
 def upload_page(request):
     if request.method == 'POST':
@@ -23,31 +25,22 @@ def upload_page(request):
                     'message': "Vui lòng chọn ít nhất một file hoặc folder để tải lên."
                 }, status=400)
 
-            for f in files:
-                f.seek(0)
-                try:
-                    ds = pydicom.dcmread(BytesIO(f.read()), stop_before_pixels=True)
-                    sop_instance_uid = ds.SOPInstanceUID
-                    if DICOMInstance.objects.filter(instance_uid=sop_instance_uid).exists():
+            # Đọc header một lần cho mọi file, kiểm tra trùng bằng một truy vấn duy nhất
+            headers = [read_dicom_header(f) for f in files]
+            sop_instance_uids = {header['sop_instance_uid'] for header in headers if header}
+            if sop_instance_uids:
+                existing_uids = set(
+                    DICOMInstance.objects.filter(instance_uid__in=sop_instance_uids).values_list('instance_uid', flat=True)
+                )
+                for f, header in zip(files, headers):
+                    if header and header['sop_instance_uid'] in existing_uids:
                         raise ValidationError(f"Ảnh DICOM '{f.name}' đã tồn tại trong hệ thống.")
-                except pydicom.errors.InvalidDicomError:
-                    pass
-                finally:
-                    f.seek(0)
 
-            first_file = files[0]
-            first_file.seek(0)
-            try:
-                ds = pydicom.dcmread(BytesIO(first_file.read()), stop_before_pixels=True)
-                existing_study_uid = ds.StudyInstanceUID
-                existing_study = DICOMStudy.objects.filter(study_instance_uid=existing_study_uid).first()
+            if headers[0] and headers[0]['study_instance_uid']:
+                existing_study = DICOMStudy.objects.filter(study_instance_uid=headers[0]['study_instance_uid']).select_related('patient').first()
                 if existing_study:
                     patient = existing_study.patient
                     print(f"Phát hiện file thuộc về ca bệnh đã có của bệnh nhân: {patient.full_name}. Sử dụng bệnh nhân gốc.")
-            except (pydicom.errors.InvalidDicomError, AttributeError):
-                pass
-            
-            first_file.seek(0)
             
             if patient is None:
                 if patient_type == 'existing':
@@ -70,21 +63,26 @@ def upload_page(request):
 
             if patient:
                 uploads_data = []
-                for f in files:
+                file_upload_objs = []
+                for f, header in zip(files, headers):
                     f.seek(0)
-                    file_content = f.read()
-                    file_upload_obj = FileUpload.objects.create(
+                    # Spool file xuống staging theo chunk, message Celery chỉ mang đường dẫn
+                    staged_path = stage_upload(f, session_id)
+                    file_upload_obj = FileUpload(
                         user=request.user if request.user.is_authenticated else None,
                         patient=patient,
                         original_filename=f.name,
                         file_format=f.name.split('.')[-1] if '.' in f.name else 'unknown',
                         status=FileUpload.Status.PENDING
                     )
+                    file_upload_objs.append(file_upload_obj)
                     uploads_data.append({
-                        'upload_id': file_upload_obj.upload_id,
-                        'content': file_content,
+                        'upload_id': str(file_upload_obj.upload_id),
+                        'staged_path': staged_path,
                         'original_filename': f.name, # <-- SỬA LỖI: THÊM LẠI DÒNG NÀY
+                        'dicom': header,
                     })
+                FileUpload.objects.bulk_create(file_upload_objs, batch_size=settings.UPLOAD_DB_BATCH_SIZE)
                 
                 if uploads_data:
                     process_upload_session.delay(str(patient.patient_id), uploads_data, str(session_id))
@@ -100,9 +98,17 @@ def upload_page(request):
 def check_study_status(request, session_id):
     try:
         study = DICOMStudy.objects.get(session_id=session_id)
-        if study.study_instance_uid:
+        if study.study_instance_uid and study.ready:
             return JsonResponse({'status': 'COMPLETED', 'study_instance_uid': study.study_instance_uid})
         else:
              return JsonResponse({'status': 'PROCESSING'})
     except DICOMStudy.DoesNotExist:
-        return JsonResponse({'status': 'PENDING'})
\ No newline at end of file
+        return JsonResponse({'status': 'PENDING'})
+
+
+async def upload_progress_events(request, session_id):
+    """
+    Stream tiến độ phiên upload dạng Server-Sent Events: mỗi file gửi lên Orthanc (done/total, lỗi)
+    và sự kiện COMPLETED kèm study_instance_uid. Thay cho việc poll check_study_status.
+    """
+    return progress.event_stream_response('upload', session_id)
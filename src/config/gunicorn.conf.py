@@ -0,0 +1,54 @@
+"""
+Cấu hình gunicorn cho chế độ production: `gunicorn -c config/gunicorn.conf.py config.asgi:application`.
+
+App Django được nạp một lần trong process master (preload_app) rồi mới fork worker uvicorn, nên code và
+settings được các worker dùng chung copy-on-write. Mỗi worker đặt số thread intra/inter-op riêng để tổng số
+thread không vượt quá số core.
+
+Worker web không warm-up model: inference chạy trên queue `inference`, worker web chỉ nạp model (lười) khi
+gặp request dự đoán đồng bộ. Với AI_WARMUP_ON_START, master chỉ đọc sẵn file .tflite (backend duy nhất dùng
+được buffer chung copy-on-write); model Keras/ONNX luôn được nạp riêng trong từng process.
+"""
+
+import gc
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", str(max(2, (os.cpu_count() or 1) // 2))))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Stream SSE giữ kết nối lâu; inference đồng bộ đầu tiên của worker có thể mất vài giây để nạp model
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+accesslog = "-"
+
+
+def when_ready(server):
+    """Chạy trong master sau khi nạp app, trước khi fork worker đầu tiên."""
+    from django.conf import settings
+    from django.db import connections
+
+    from apps.ai_processing import services
+
+    if settings.AI_WARMUP_ON_START:
+        nbytes = services.preload_model_files()
+        server.log.info(f"[AI REGISTRY] Master nạp sẵn {nbytes / 2**20:.1f} MB file model để chia sẻ với worker")
+    # Kết nối DB không được dùng chung giữa các process
+    connections.close_all()
+    # Đưa các object đã có vào thế hệ permanent để GC của worker không ghi vào (tránh copy-on-write cả heap)
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from apps.ai_processing import services
+
+    intra_op, inter_op = services.configure_inference_threads(workers=server.cfg.workers)
+    server.log.info(f"[AI] Worker {worker.pid}: intra-op {intra_op or 'mặc định'}, inter-op {inter_op or 'mặc định'}")
+
+
+def child_exit(server, worker):
+    from config import metrics
+
+    metrics.mark_process_dead(worker.pid)
@@ -0,0 +1,197 @@
+"""
+Metric Prometheus của pipeline upload và dự đoán, xuất qua endpoint /metrics.
+
+prometheus_client là phụ thuộc tuỳ chọn: khi chưa cài hoặc METRICS_ENABLED=False, mọi metric là đối tượng
+no-op và `stage()` trả về một context manager dùng chung nên chi phí gần như bằng không. Khi chạy nhiều
+process (gunicorn, Celery prefork), đặt PROMETHEUS_MULTIPROC_DIR để gộp metric của mọi worker; thư mục được
+dọn bởi lệnh khởi động container (docker-compose.yml) trước khi Django nạp, không phải từ trong process.
+"""
+
+import logging
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+logger = logging.getLogger(__name__)
+
+ENABLED = settings.METRICS_ENABLED and prometheus_client is not None
+MULTIPROCESS = ENABLED and bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+if MULTIPROCESS:
+    # Metric không có nhãn mở file .db ngay khi được tạo bên dưới, tức là lúc django.setup()
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+# Stage của pipeline dự đoán một ảnh, theo thứ tự, và "inference_batch" (một forward pass cho cả batch lát của
+# dự đoán study); stage() chỉ nhận các tên này để nhãn "stage" không phình ra vì lỗi chính tả
+PREDICTION_STAGES = (
+    "decode", "preprocess", "inference", "gradcam", "upsample", "paste", "mask", "colorize", "encode", "write",
+    "inference_batch",
+)
+_STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Nhãn model của các stage chạy ngoài prediction() (ví dụ giải mã DICOM trong view)
+NO_MODEL = "none"
+_current_model = ContextVar("metrics_model", default=NO_MODEL)
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+if ENABLED:
+    STAGE_SECONDS = prometheus_client.Histogram(
+        "ai_stage_seconds", "Thời gian từng stage của pipeline dự đoán", ["stage", "model"], buckets=_STAGE_BUCKETS
+    )
+    PREDICTIONS = prometheus_client.Counter("ai_predictions_total", "Số lần dự đoán", ["source", "model"])
+    PREDICTION_ERRORS = prometheus_client.Counter("ai_prediction_errors_total", "Số lần dự đoán lỗi", ["source", "model"])
+    PREDICTION_SECONDS = prometheus_client.Histogram(
+        "ai_prediction_seconds", "Thời gian xử lý một lần dự đoán", ["source", "model"], buckets=_STAGE_BUCKETS
+    )
+    RESULT_CACHE = prometheus_client.Counter("ai_result_cache_total", "Tra cứu cache kết quả dự đoán", ["result"])
+    MODEL_CACHE_MODELS = prometheus_client.Gauge(
+        "ai_model_cache_models", "Số model đang nằm trong registry", multiprocess_mode="livesum"
+    )
+    MODEL_CACHE_BYTES = prometheus_client.Gauge(
+        "ai_model_cache_bytes", "Dung lượng trọng số trong registry", multiprocess_mode="livesum"
+    )
+    PROCESS_RSS = prometheus_client.Gauge("app_process_rss_bytes", "RSS của process", multiprocess_mode="all")
+    UPLOAD_FILES = prometheus_client.Counter("upload_files_total", "Số file DICOM đã xử lý trong các phiên upload", ["status"])
+    UPLOAD_SESSION_SECONDS = prometheus_client.Histogram(
+        "upload_session_seconds", "Thời gian xử lý một phiên upload",
+        buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+    )
+    UPLOAD_FILES_PER_SECOND = prometheus_client.Gauge(
+        "upload_files_per_second", "Tốc độ (file/s) của phiên upload gần nhất", multiprocess_mode="mostrecent"
+    )
+    UPLOAD_RETRIES = prometheus_client.Counter("upload_task_retries_total", "Số lần task upload được thử lại")
+    ORTHANC_POST_SECONDS = prometheus_client.Histogram(
+        "orthanc_post_seconds", "Độ trễ POST /instances lên Orthanc", ["mode"],
+        buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+    )
+    ORTHANC_RETRIES = prometheus_client.Counter("orthanc_store_retries_total", "Số lần gửi lại lên Orthanc", ["mode"])
+else:
+    STAGE_SECONDS = PREDICTIONS = PREDICTION_ERRORS = PREDICTION_SECONDS = RESULT_CACHE = _NoopMetric()
+    MODEL_CACHE_MODELS = MODEL_CACHE_BYTES = PROCESS_RSS = _NoopMetric()
+    UPLOAD_FILES = UPLOAD_SESSION_SECONDS = UPLOAD_FILES_PER_SECOND = UPLOAD_RETRIES = _NoopMetric()
+    ORTHANC_POST_SECONDS = ORTHANC_RETRIES = _NoopMetric()
+
+_NOOP_CONTEXT = nullcontext()
+
+
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        STAGE_SECONDS.labels(self.name, _current_model.get()).observe(time.perf_counter() - self.start)
+        return False
+
+
+def stage(name):
+    """`with stage("inference"):` ghi thời gian vào ai_stage_seconds với nhãn model của prediction() đang chạy."""
+    if name not in PREDICTION_STAGES:
+        raise ValueError(f"Stage không hợp lệ: {name}. Hỗ trợ: {', '.join(PREDICTION_STAGES)}")
+    return _Stage(name) if ENABLED else _NOOP_CONTEXT
+
+
+def timed(histogram):
+    """Context manager ghi thời gian vào `histogram` (đã gắn nhãn)."""
+    return histogram.time() if ENABLED else _NOOP_CONTEXT
+
+
+@contextmanager
+def prediction(source, model_key):
+    """Một lần dự đoán: đặt nhãn model cho các stage bên trong, đếm request, lỗi và tổng thời gian."""
+    if not ENABLED:
+        yield
+        return
+    model_key = str(model_key)
+    token = _current_model.set(model_key)
+    start = time.perf_counter()
+    PREDICTIONS.labels(source, model_key).inc()
+    try:
+        yield
+    except Exception:
+        PREDICTION_ERRORS.labels(source, model_key).inc()
+        raise
+    finally:
+        PREDICTION_SECONDS.labels(source, model_key).observe(time.perf_counter() - start)
+        _current_model.reset(token)
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def update_process_gauges(model_cache_stats=None):
+    """Cập nhật gauge RSS và kích thước registry model của process hiện tại (`stats()` của ModelRegistry)."""
+    if not ENABLED:
+        return
+    PROCESS_RSS.set(_rss_bytes())
+    if model_cache_stats is not None:
+        MODEL_CACHE_MODELS.set(model_cache_stats["models"])
+        MODEL_CACHE_BYTES.set(model_cache_stats["total_bytes"])
+
+
+def registry():
+    if MULTIPROCESS:
+        collector_registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(collector_registry)
+        return collector_registry
+    return prometheus_client.REGISTRY
+
+
+def mark_process_dead(pid):
+    """Gọi từ process cha khi một worker thoát để gauge "live*" không còn tính worker đó."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
+
+
+def start_worker_server(port):
+    """HTTP server /metrics riêng cho process không chạy Django view (Celery worker)."""
+    if not ENABLED or not port:
+        return
+    prometheus_client.start_http_server(port, registry=registry())
+    logger.info(f"[METRICS] Phục vụ metric tại :{port}")
+
+
+def metrics_view(request):
+    if not ENABLED:
+        raise Http404("Metrics đang tắt.")
+    if not MULTIPROCESS:
+        # Một process: cập nhật gauge ngay lúc scrape
+        from apps.ai_processing import services
+
+        update_process_gauges(services.model_cache_stats())
+    return HttpResponse(prometheus_client.generate_latest(registry()), content_type=prometheus_client.CONTENT_TYPE_LATEST)
@@ -81,6 +81,8 @@ AUTH_PASSWORD_VALIDATORS = [
     {"NAME": "django.contrib.auth.password_validation.NumericPasswordValidator"},
 ]
 
+# Mức log; đặt DEBUG để xem log chi tiết từng bước dự đoán ([AI DEBUG]), thời gian từng stage xem qua /metrics
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,  # giữ lại log mặc định của Django
@@ -103,7 +105,7 @@ LOGGING = {
     },
     "root": {
         "handlers": ["console"],
-        "level": "DEBUG",  # cho phép tất cả log hiển thị
+        "level": LOG_LEVEL,
     },
     "loggers": {
         "django": {
@@ -113,7 +115,7 @@ LOGGING = {
         },
         "apps.ai_processing": {   # app bạn muốn log (ví dụ services.py trong app ai_processing)
             "handlers": ["console"],
-            "level": "DEBUG",
+            "level": LOG_LEVEL,
             "propagate": False,
         },
     },
@@ -129,13 +131,97 @@ CELERY_RESULT_BACKEND = "redis://redis:6379/0"
 CELERY_ACCEPT_CONTENT = ["json", "pickle"]
 CELERY_TASK_SERIALIZER = "pickle"
 CELERY_RESULT_SERIALIZER = "pickle"
+# Tác vụ AI chạy trên queue riêng để worker inference giữ model trong bộ nhớ, tách khỏi web và upload
+CELERY_TASK_ROUTES = {
+    "apps.ai_processing.tasks.*": {"queue": "inference"},
+}
+
+# --- TIẾN ĐỘ REALTIME (Server-Sent Events qua Redis pub/sub) ---
+PROGRESS_REDIS_URL = os.environ.get("PROGRESS_REDIS_URL", CELERY_BROKER_URL)
+# Sự kiện gần nhất của mỗi kênh được giữ lại để client kết nối muộn vẫn nhận được trạng thái hiện tại
+PROGRESS_SNAPSHOT_TTL = int(os.environ.get("PROGRESS_SNAPSHOT_TTL", "3600"))
+PROGRESS_HEARTBEAT_SECONDS = float(os.environ.get("PROGRESS_HEARTBEAT_SECONDS", "15"))
+
+# --- ORTHANC ---
+ORTHANC_URL = os.environ.get("ORTHANC_URL", "http://pacs:8042")
+ORTHANC_USERNAME = os.environ.get("ORTHANC_USERNAME", "mapdr")
+ORTHANC_PASSWORD = os.environ.get("ORTHANC_PASSWORD", "changestrongpassword")
+ORTHANC_TIMEOUT = float(os.environ.get("ORTHANC_TIMEOUT", "30"))
+ORTHANC_POOL_SIZE = int(os.environ.get("ORTHANC_POOL_SIZE", "10"))
+ORTHANC_FRAME_CACHE_MB = int(os.environ.get("ORTHANC_FRAME_CACHE_MB", "256"))
+# Số SOPInstanceUID -> ID Orthanc giữ lại trong mỗi process (LRU)
+ORTHANC_INSTANCE_ID_CACHE_SIZE = int(os.environ.get("ORTHANC_INSTANCE_ID_CACHE_SIZE", "10000"))
+# Upload lên Orthanc: số request đồng thời, số lần thử lại mỗi instance, "parallel" hoặc "zip" (Orthanc >= 1.8.2)
+ORTHANC_UPLOAD_CONCURRENCY = int(os.environ.get("ORTHANC_UPLOAD_CONCURRENCY", "8"))
+ORTHANC_UPLOAD_RETRIES = int(os.environ.get("ORTHANC_UPLOAD_RETRIES", "3"))
+ORTHANC_UPLOAD_BACKOFF = float(os.environ.get("ORTHANC_UPLOAD_BACKOFF", "0.5"))
+ORTHANC_UPLOAD_MODE = os.environ.get("ORTHANC_UPLOAD_MODE", "parallel")
+ORTHANC_ZIP_BATCH_SIZE = int(os.environ.get("ORTHANC_ZIP_BATCH_SIZE", "50"))
+# Xác nhận study trên Orthanc sau upload: kiểm tra lại sau mỗi ORTHANC_READY_RETRY_DELAY giây, tối đa ORTHANC_READY_MAX_ATTEMPTS lần
+ORTHANC_READY_RETRY_DELAY = float(os.environ.get("ORTHANC_READY_RETRY_DELAY", "0.5"))
+ORTHANC_READY_MAX_ATTEMPTS = int(os.environ.get("ORTHANC_READY_MAX_ATTEMPTS", "10"))
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.environ.get("MEDIA_ROOT", os.path.join(BASE_DIR, "mediafiles"))
+# Dữ liệu nội bộ dùng chung giữa web và worker nhưng không được phục vụ qua MEDIA_URL (file DICOM gốc của bệnh
+# nhân, cache kết quả); phải nằm ngoài MEDIA_ROOT
+PRIVATE_DATA_ROOT = os.environ.get("PRIVATE_DATA_ROOT", os.path.join(BASE_DIR, "privatedata"))
+# File upload được spool xuống đây (volume dùng chung giữa web và worker), Celery chỉ nhận đường dẫn
+UPLOAD_STAGING_DIR = os.environ.get("UPLOAD_STAGING_DIR", os.path.join(PRIVATE_DATA_ROOT, "staging"))
+# Số file tối đa trong một request upload (mặc định của Django là 100, quá ít cho upload cả folder study)
+DATA_UPLOAD_MAX_NUMBER_FILES = int(os.environ.get("DATA_UPLOAD_MAX_NUMBER_FILES", "1000"))
+# Số file mỗi lô khi ghi trạng thái upload vào DB (bulk_create / update)
+UPLOAD_DB_BATCH_SIZE = int(os.environ.get("UPLOAD_DB_BATCH_SIZE", "50"))
 
 # STATIC
 STATIC_URL = "/static/"
 STATIC_ROOT = os.environ.get("STATIC_ROOT", os.path.join(BASE_DIR, "staticfiles"))
 
 # Auto field
-DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
\ No newline at end of file
+DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+# --- AI inference ---
+# Gom các request predict-frame đồng thời thành batch cho mỗi model
+AI_BATCHING_ENABLED = os.environ.get("AI_BATCHING_ENABLED", "True").lower() in ("true", "1", "t")
+AI_BATCH_MAX_SIZE = int(os.environ.get("AI_BATCH_MAX_SIZE", "8"))
+AI_BATCH_MAX_WAIT_MS = float(os.environ.get("AI_BATCH_MAX_WAIT_MS", "10"))
+# Nội suy heatmap Grad-CAM: "cubic" (tương đương griddata, ma trận tính sẵn), "bicubic", "linear", "griddata"
+AI_GRADCAM_INTERPOLATION = os.environ.get("AI_GRADCAM_INTERPOLATION", "cubic")
+# Model registry: warm-up khi Celery worker khởi động (gunicorn chỉ đọc sẵn file .tflite), ngân sách bộ nhớ (0 = không giới hạn), phát hiện trọng số mới
+AI_WARMUP_ON_START = os.environ.get("AI_WARMUP_ON_START", "False").lower() in ("true", "1", "t")
+AI_MODEL_CACHE_MAX_MB = int(os.environ.get("AI_MODEL_CACHE_MAX_MB", "0"))
+AI_MODEL_RELOAD_CHECK = os.environ.get("AI_MODEL_RELOAD_CHECK", "mtime")  # "mtime", "checksum" hoặc "none"
+AI_MODEL_RELOAD_INTERVAL = float(os.environ.get("AI_MODEL_RELOAD_INTERVAL", "5"))
+# Số thread intra-op của backend ONNX Runtime / TFLite (AIModel.backend); 0 = mặc định của runtime
+AI_BACKEND_THREADS = int(os.environ.get("AI_BACKEND_THREADS", "0"))
+# Số thread intra/inter-op của TensorFlow cho mỗi process inference; 0 = theo profile autotune, không có thì
+# gunicorn/Celery prefork tự chia số core cho số worker
+AI_TF_INTRA_OP_THREADS = int(os.environ.get("AI_TF_INTRA_OP_THREADS", "0"))
+AI_TF_INTER_OP_THREADS = int(os.environ.get("AI_TF_INTER_OP_THREADS", "0"))
+# Profile thread/batch do lệnh autotune_inference đo trên máy này; worker áp dụng khi khởi động nếu các biến
+# AI_TF_*_THREADS / AI_STUDY_BATCH_SIZE không được đặt và profile được đo với cùng số worker, số core. Để rỗng để tắt
+AI_TUNING_PROFILE_PATH = os.environ.get("AI_TUNING_PROFILE_PATH", os.path.join(MEDIA_ROOT, "tuning", "inference_profile.json"))
+# Cache kết quả dự đoán theo (hash pixel, model_id, model_version, fingerprint trọng số, tham số heatmap): Redis, fallback ra đĩa khi Redis lỗi
+AI_RESULT_CACHE_ENABLED = os.environ.get("AI_RESULT_CACHE_ENABLED", "True").lower() in ("true", "1", "t")
+AI_RESULT_CACHE_URL = os.environ.get("AI_RESULT_CACHE_URL", CELERY_BROKER_URL)
+AI_RESULT_CACHE_DIR = os.environ.get("AI_RESULT_CACHE_DIR", os.path.join(PRIVATE_DATA_ROOT, "cache", "predictions"))
+AI_RESULT_CACHE_TTL = int(os.environ.get("AI_RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+# Số giây bỏ qua Redis (chỉ dùng cache trên đĩa) sau một lỗi kết nối
+AI_RESULT_CACHE_REDIS_BACKOFF = float(os.environ.get("AI_RESULT_CACHE_REDIS_BACKOFF", "30"))
+# Định dạng heatmap mặc định: "png" (RGBA), "webp" (RGBA lossless) hoặc "gray" (uint8 một kênh, viewer tự tô màu)
+AI_HEATMAP_FORMAT = os.environ.get("AI_HEATMAP_FORMAT", "png")
+# Colormap tô heatmap RGBA: jet, hot, gray hoặc bản đảo "_r"
+AI_HEATMAP_COLORMAP = os.environ.get("AI_HEATMAP_COLORMAP", "jet_r")
+# Chuẩn hoá cường độ DICOM trước khi vào model: "minmax" (từng frame, như lúc huấn luyện),
+# "window" (Rescale + WindowCenter/Width trong header) hoặc "study" (một cửa sổ chung cho cả study)
+AI_DICOM_INTENSITY_MODE = os.environ.get("AI_DICOM_INTENSITY_MODE", "minmax")
+# Dự đoán cả study: số lát mỗi batch (0 = theo profile autotune, mặc định 16), cách gộp ("mean", "max", "topk")
+# và k cho "topk"
+AI_STUDY_BATCH_SIZE = int(os.environ.get("AI_STUDY_BATCH_SIZE", "0"))
+AI_STUDY_POOLING = os.environ.get("AI_STUDY_POOLING", "mean")
+AI_STUDY_TOP_K = int(os.environ.get("AI_STUDY_TOP_K", "5"))
+
+# --- Metrics (Prometheus, /metrics) ---
+# Cần cài prometheus_client; tắt hoặc chưa cài thì mọi metric là no-op. Chạy nhiều process (gunicorn, Celery
+# prefork) thì đặt PROMETHEUS_MULTIPROC_DIR; Celery worker phục vụ metric trên cổng METRICS_WORKER_PORT (0 = tắt)
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "True").lower() in ("true", "1", "t")
+METRICS_WORKER_PORT = int(os.environ.get("METRICS_WORKER_PORT", "0"))
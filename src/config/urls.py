@@ -2,8 +2,10 @@ from django.contrib import admin
 from django.urls import path, include 
 from django.conf import settings 
 from django.conf.urls.static import static
+from config.metrics import metrics_view
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('uploads/', include('apps.uploads.urls', namespace='uploads')),
     path('api/ai/', include('apps.ai_processing.urls')),
 ]